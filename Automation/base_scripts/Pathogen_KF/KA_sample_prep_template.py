@@ -4,6 +4,8 @@ from opentrons import protocol_api
 import time
 from timeit import default_timer as timer
 import json
+import threading
+import queue
 from datetime import datetime
 import csv
 
@@ -28,6 +30,7 @@ NUM_SAMPLES = $num_samples
 NUM_SAMPLES = NUM_SAMPLES - 2 # exclude positive and negative controls!
 air_gap_vol = 0
 run_id = 'test'
+progress_url = '' # Lab progress service, e.g. 'http://10.39.219.10:8080/event'; empty to disable
 volume_sample = 200
 ic_volume = 10
 value_pairs={'IC': [$IC_total_volume,$IC_wells]}
@@ -69,6 +72,64 @@ def run(ctx: protocol_api.ProtocolContext):
             os.mkdir(folder_path)
         file_path = folder_path + '/KA_SampleSetup_viral_time_log.txt'
 
+    ##########
+    # JSONL event log: one fixed-schema record per line, appended while the run
+    # goes on (line buffered) so an aborted run still leaves its events on disk
+    event_state = {'step': 0, 'commands': 0, 'publish': bool(progress_url)}
+    event_log = None
+    if not ctx.is_simulating():
+        event_station = os.path.basename(file_path).replace('_time_log.txt', '')
+        event_log = open(file_path.replace('_time_log.txt', '_events.jsonl'), 'a', buffering = 1)
+
+    def log_event(event, step = None, column = None, seconds = None, message = None):
+        if step is not None:
+            event_state['step'] = step
+        if event_log is not None and not event_log.closed:
+            record = json.dumps({'time': datetime.now().isoformat(),
+                'run_id': str(run_id), 'station': event_station, 'event': event,
+                'step': event_state['step'], 'column': column, 'seconds': seconds,
+                'commands': event_state['commands'], 'samples': NUM_SAMPLES, 'message': message})
+            event_log.write(record + '\n')
+            if event_state['publish']:
+                event_queue.put(record)
+
+    def publish_events():
+        # one sender posts the events in the order they were logged; the progress
+        # service is optional: an event it does not take is tried again after 1,
+        # 2 and 4 s and then skipped, the next events are still sent
+        import urllib.request
+        for record in iter(event_queue.get, None):
+            for retry_wait in [1, 2, 4, None]:
+                try:
+                    urllib.request.urlopen(urllib.request.Request(progress_url, data = record.encode(),
+                        headers = {'Content-Type': 'application/json'}), timeout = 2)
+                    break
+                except Exception:
+                    if retry_wait is not None:
+                        time.sleep(retry_wait)
+
+    event_queue = queue.Queue()
+    event_sender = threading.Thread(target = publish_events, daemon = True)
+    if event_log is not None:
+        event_sender.start()
+
+    def count_command(message):
+        if message['$'] == 'before':
+            event_state['commands'] += 1
+            if message['name'] == command_types.PAUSE:
+                log_event('pause', message = message['payload'].get('text'))
+            elif message['name'] == command_types.DELAY: # the delay payload splits it in minutes and seconds
+                log_event('wait', seconds = message['payload'].get('minutes', 0) * 60 + message['payload'].get('seconds', 0),
+                          message = message['payload'].get('text'))
+
+    try:
+        from opentrons.commands import types as command_types
+        ctx.broker.subscribe(command_types.COMMAND, count_command)
+    except (ImportError, AttributeError):
+        ctx.comment('Robot commands will not be counted in the event log')
+    log_event('run_start')
+    ##########
+
     # Define Reagents as objects with their properties
     class Reagent:
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, rinse,
@@ -301,6 +362,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
         ctx.comment('###############################################')
 
@@ -327,12 +389,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
                     ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 2: Add internal control
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
         ctx.comment('###############################################')
 
@@ -362,6 +426,13 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
                     ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
+
+    log_event('run_end')
+    if event_log is not None:
+        event_log.close()
+        event_queue.put(None) # the sender stops once run_end is posted
+        event_sender.join(timeout = 10)
 
     ############################################################################
 
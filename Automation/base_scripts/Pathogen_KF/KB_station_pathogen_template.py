@@ -3,9 +3,10 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
+import threading
+import queue
 from datetime import datetime
 import csv
 
@@ -40,9 +41,12 @@ wash_buffer2_vol = 450
 waiting = 10 # minutes
 pipette_allowed_capacity = 180
 max_multiwell_volume = 13300
+reservoir_dead_volume = 600 # ul left in every reservoir column that the tips can not take
+num_batches = 1 # Plate sets filled in this session; sets after the first are prefilled for upcoming runs
 
 
 run_id =  $run_id
+progress_url = '' # Lab progress service, e.g. 'http://10.39.219.10:8080/event'; empty to disable
 
 x_offset = [0,0]
 multi_well_rack_area = 8.2 * 71.2  # Cross section of the 12 well reservoir
@@ -62,7 +66,8 @@ def run(ctx: protocol_api.ProtocolContext):
         6: {'Execute': True, 'description': 'Add 260 ul Lysis Buffer'},
         7: {'Execute': True, 'description': 'Mix beads'},
         8: {'Execute': True, 'description': 'Wait for 10 minutes', 'wait_time': 600}, # 10 minutes of waiting
-        9: {'Execute': True, 'description': 'Add 260 ul Beads'}
+        9: {'Execute': True, 'description': 'Add 260 ul Beads'},
+        10: {'Execute': num_batches > 1, 'description': 'Prefill plate sets for upcoming runs'}
         }
 
     for s in STEPS:  # Create an empty wait_time
@@ -74,6 +79,64 @@ def run(ctx: protocol_api.ProtocolContext):
             os.mkdir(folder_path)
         file_path = folder_path + '/KB_pathogen_time_log.txt'
 
+    ##########
+    # JSONL event log: one fixed-schema record per line, appended while the run
+    # goes on (line buffered) so an aborted run still leaves its events on disk
+    event_state = {'step': 0, 'commands': 0, 'publish': bool(progress_url)}
+    event_log = None
+    if not ctx.is_simulating():
+        event_station = os.path.basename(file_path).replace('_time_log.txt', '')
+        event_log = open(file_path.replace('_time_log.txt', '_events.jsonl'), 'a', buffering = 1)
+
+    def log_event(event, step = None, column = None, seconds = None, message = None):
+        if step is not None:
+            event_state['step'] = step
+        if event_log is not None and not event_log.closed:
+            record = json.dumps({'time': datetime.now().isoformat(),
+                'run_id': str(run_id), 'station': event_station, 'event': event,
+                'step': event_state['step'], 'column': column, 'seconds': seconds,
+                'commands': event_state['commands'], 'samples': NUM_SAMPLES, 'message': message})
+            event_log.write(record + '\n')
+            if event_state['publish']:
+                event_queue.put(record)
+
+    def publish_events():
+        # one sender posts the events in the order they were logged; the progress
+        # service is optional: an event it does not take is tried again after 1,
+        # 2 and 4 s and then skipped, the next events are still sent
+        import urllib.request
+        for record in iter(event_queue.get, None):
+            for retry_wait in [1, 2, 4, None]:
+                try:
+                    urllib.request.urlopen(urllib.request.Request(progress_url, data = record.encode(),
+                        headers = {'Content-Type': 'application/json'}), timeout = 2)
+                    break
+                except Exception:
+                    if retry_wait is not None:
+                        time.sleep(retry_wait)
+
+    event_queue = queue.Queue()
+    event_sender = threading.Thread(target = publish_events, daemon = True)
+    if event_log is not None:
+        event_sender.start()
+
+    def count_command(message):
+        if message['$'] == 'before':
+            event_state['commands'] += 1
+            if message['name'] == command_types.PAUSE:
+                log_event('pause', message = message['payload'].get('text'))
+            elif message['name'] == command_types.DELAY: # the delay payload splits it in minutes and seconds
+                log_event('wait', seconds = message['payload'].get('minutes', 0) * 60 + message['payload'].get('seconds', 0),
+                          message = message['payload'].get('text'))
+
+    try:
+        from opentrons.commands import types as command_types
+        ctx.broker.subscribe(command_types.COMMAND, count_command)
+    except (ImportError, AttributeError):
+        ctx.comment('Robot commands will not be counted in the event log')
+    log_event('run_start')
+    ##########
+
     # Define Reagents as objects with their properties
     class Reagent:
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, rinse,
@@ -293,12 +356,14 @@ def run(ctx: protocol_api.ProtocolContext):
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
         nonlocal tip_track
-        if not ctx.is_simulating():
-            if tip_track['counts'][pip] == tip_track['maxes'][pip]:
-                ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
-                resuming.')
-                pip.reset_tipracks()
-                tip_track['counts'][pip] = 0
+        # the racks are checked and not the counts, which not every pick updates;
+        # the swap is also simulated so that the prefill of several plate sets,
+        # which takes more tips than the racks hold, passes the upload analysis
+        if not any(rack.next_tip(pip.channels) for rack in pip.tip_racks):
+            ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
+            resuming.')
+            pip.reset_tipracks()
+            tip_track['counts'][pip] = 0
         pip.pick_up_tip()
     ##########
 
@@ -406,6 +471,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -418,6 +484,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(vol_list):
@@ -439,6 +506,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
     ############################################################################
@@ -446,6 +514,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -458,6 +527,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(vol_list):
@@ -479,6 +549,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
 
@@ -488,6 +559,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -497,6 +569,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Water or elution buffer
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
                 # Calculate pickup_height based on remaining volume and shape of container
@@ -526,12 +599,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 4: Filling with IC
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -541,6 +616,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m20.hw_pipette['has_tip']:
                 pick_up(m20)
             move_vol_multichannel(m20, reagent = IC, source = IC.reagent_reservoir[IC.col],
@@ -556,12 +632,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 5: TRANSFER IC2
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         # Transfer parameters
         start = datetime.now()
         ctx.comment('###############################################')
@@ -570,6 +648,7 @@ def run(ctx: protocol_api.ProtocolContext):
         IC_transfer_vol = [ic_volume]
         rinse = True
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m20.hw_pipette['has_tip']:
                 pick_up(m20)
             for j, transfer_vol in enumerate(IC_transfer_vol):
@@ -587,11 +666,13 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
     ############################################################################
     # STEP 6: Add Lysis
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -606,6 +687,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(vol_list):
@@ -629,6 +711,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
         lysis_taken_time = time_taken.total_seconds()
 
     ############################################################################
@@ -636,6 +719,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
 
         start = datetime.now()
         ctx.comment('###############################################')
@@ -659,6 +743,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
         beads_premix_taken_time = time_taken.total_seconds()
 
     ############################################################################
@@ -671,6 +756,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     STEP += 1
     if STEPS[STEP]['Execute']==True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
     #Transfer magnetic beads
         start = datetime.now()
         ctx.comment(' ')
@@ -684,12 +770,14 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 9: Filling with Beads
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -702,6 +790,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(vol_list):
@@ -730,6 +819,94 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
+
+    ############################################################################
+    # STEP 10: Prefill plate sets for upcoming runs
+    ############################################################################
+    STEP += 1
+    if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
+        start = datetime.now()
+        ctx.comment('###############################################')
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
+        ctx.comment('###############################################')
+
+        # [step, reagent, volumes, plate, air gap, pickup height, dispense height, touch tip, post dispense]
+        prefill = [
+            [1, WashBuffer1, divide_volume(wash_buffer1_vol, pipette_allowed_capacity), WashBuffer1_100ul_plate1, air_gap_vol, 0.4, -2, False, False],
+            [2, WashBuffer2, divide_volume(wash_buffer2_vol, pipette_allowed_capacity), WashBuffer2_100ul_plate1, air_gap_vol, 0.4, -2, False, False],
+            [3, ElutionBuffer, [elution_buffer_vol], ElutionBuffer_50ul_plate, air_gap_vol_elutionbuffer, 0.5, -4, True, False]]
+        # Reservoirs are already wet and mixed by this run, so the sets after
+        # the first one are filled without rinsing; reservoirs are only topped
+        # up when what is left can not fill another set
+        reservoir_left = {}
+        for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+            # the reservoir was filled with reagent_reservoir_volume and the step of the run took its volume
+            reservoir_left[reagent.name] = reagent.reagent_reservoir_volume
+            if STEPS[s]['Execute'] == True:
+                reservoir_left[reagent.name] -= sum(volumes) * 8 * num_cols
+            # the columns are emptied in order, so what is left is in the last ones
+            reagent.col = min(len(reagent.reagent_reservoir) - 1, max(0, len(reagent.reagent_reservoir) -
+                              math.ceil(reservoir_left[reagent.name] / reagent.vol_well_original)))
+            reagent.vol_well = (reservoir_left[reagent.name] -
+                                reagent.vol_well_original * (len(reagent.reagent_reservoir) - 1 - reagent.col))
+
+        for batch in range(2, num_batches + 1):
+            for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+                set_volume = sum(volumes) * 8 * num_cols
+                dead_volume = reservoir_dead_volume * len(reagent.reagent_reservoir)
+                if reservoir_left[reagent.name] - dead_volume < set_volume:
+                    refill = min(set_volume * (num_batches - batch + 1) + dead_volume,
+                                 max_multiwell_volume * len(reagent.reagent_reservoir))
+                    ctx.comment('Fill ' + reagent.name + ' reservoir up to ' +
+                                str(refill) + ' ul in ' + str(len(reagent.reagent_reservoir)) + ' column(s), ' +
+                                str(dead_volume) + ' ul of them dead volume')
+                    reservoir_left[reagent.name] = refill
+                    reagent.col = 0
+                    reagent.vol_well = refill / len(reagent.reagent_reservoir)
+            ctx.pause('Move the filled plates out and place empty plates for set ' +
+                      str(batch) + ' of ' + str(num_batches) + ' in slots 1, 6 and 10. ' +
+                      'Fill reservoirs as indicated and click continue')
+
+            for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+                reservoir_left[reagent.name] -= sum(volumes) * 8 * num_cols
+                if not m300.hw_pipette['has_tip']:
+                    pick_up(m300)
+                for i, dest in enumerate(plate.rows()[0][:num_cols]):
+                    for j, transfer_vol in enumerate(volumes):
+                        if (batch == 2 and i == 0 and j == 0 and STEPS[s]['Execute'] == False):
+                            rinse = True # Reservoir not used yet in this run
+                        else:
+                            rinse = False
+                        if reagent.col < len(reagent.reagent_reservoir) - 1:
+                            [height, col_change] = calc_height(reagent, multi_well_rack_area, transfer_vol*8,
+                                                               min_height = pickup_height, extra_volume = reservoir_dead_volume)
+                        else: # last column takes what is left
+                            reagent.vol_well = reagent.vol_well - transfer_vol*8
+                            height = max(pickup_height, (reagent.vol_well - reagent.v_cono) / multi_well_rack_area)
+                        move_vol_multichannel(m300, reagent = reagent, source = reagent.reagent_reservoir[reagent.col],
+                                       dest = dest, vol = transfer_vol,
+                                       air_gap_vol = gap, x_offset = x_offset,
+                                       pickup_height = height, rinse = rinse, disp_height = disp_height,
+                                       blow_out = True, touch_tip = touch, post_airgap=True, post_dispense=post)
+                m300.drop_tip(home_after=False)
+                tip_track['counts'][m300] += 8
+            ctx.comment('Plate set ' + str(batch) + ' of ' + str(num_batches) + ' filled')
+
+        ctx.pause('Move the last prefilled plates out and click continue')
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' +
+                    STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
+
+    log_event('run_end')
+    if event_log is not None:
+        event_log.close()
+        event_queue.put(None) # the sender stops once run_end is posted
+        event_sender.join(timeout = 10)
 
 ############################################################################
     # Export the time log to a tsv file
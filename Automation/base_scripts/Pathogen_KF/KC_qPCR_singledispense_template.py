@@ -3,9 +3,10 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
+import threading
+import queue
 from datetime import datetime
 import csv
 
@@ -14,7 +15,7 @@ metadata = {
     'protocolName': 'Station C Kingfisher Pathogen qPCR setup Version 2',
     'author': 'Hiart Maortua, Aitor Gastaminza & José Luis Villanueva (jlvillanueva@clinic.cat)',
     'source': 'Hospital Clínic Barcelona, Hospital Universitario Cruces Bilbao',
-    'apiLevel': '2.2',
+    'apiLevel': '2.3',
     'description': 'Protocol for Kingfisher sample setup (C) - Pathogen Kit (ref 4462359) using CORE script'
 
 }
@@ -31,6 +32,7 @@ air_gap_vol = 20
 air_gap_mmix = 5
 air_gap_sample = 2
 run_id = $run_id
+progress_url = '' # Lab progress service, e.g. 'http://10.39.219.10:8080/event'; empty to disable
 
 # Tune variables
 size_transfer = 4  # Number of wells the distribute function will fill. Deprecated by calculation function
@@ -74,7 +76,7 @@ volume_mmix_available = (NUM_SAMPLES * 1.1 * MMIX_vol[mmix_selection][0])  # Tot
 
 #############################################
 # Calculated variables
-area_section_screwcap = (np.pi * diameter_screwcap**2) / 4
+area_section_screwcap = (math.pi * diameter_screwcap**2) / 4
 h_cone = (volume_cone * 3 / area_section_screwcap)
 num_cols = math.ceil((NUM_SAMPLES-2) / 8)  # Columns we are working on
 
@@ -108,6 +110,64 @@ def run(ctx: protocol_api.ProtocolContext):
             os.mkdir(folder_path)
         file_path = folder_path + '/KC_qPCR_time_log.txt'
 
+    ##########
+    # JSONL event log: one fixed-schema record per line, appended while the run
+    # goes on (line buffered) so an aborted run still leaves its events on disk
+    event_state = {'step': 0, 'commands': 0, 'publish': bool(progress_url)}
+    event_log = None
+    if not ctx.is_simulating():
+        event_station = os.path.basename(file_path).replace('_time_log.txt', '')
+        event_log = open(file_path.replace('_time_log.txt', '_events.jsonl'), 'a', buffering = 1)
+
+    def log_event(event, step = None, column = None, seconds = None, message = None):
+        if step is not None:
+            event_state['step'] = step
+        if event_log is not None and not event_log.closed:
+            record = json.dumps({'time': datetime.now().isoformat(),
+                'run_id': str(run_id), 'station': event_station, 'event': event,
+                'step': event_state['step'], 'column': column, 'seconds': seconds,
+                'commands': event_state['commands'], 'samples': NUM_SAMPLES, 'message': message})
+            event_log.write(record + '\n')
+            if event_state['publish']:
+                event_queue.put(record)
+
+    def publish_events():
+        # one sender posts the events in the order they were logged; the progress
+        # service is optional: an event it does not take is tried again after 1,
+        # 2 and 4 s and then skipped, the next events are still sent
+        import urllib.request
+        for record in iter(event_queue.get, None):
+            for retry_wait in [1, 2, 4, None]:
+                try:
+                    urllib.request.urlopen(urllib.request.Request(progress_url, data = record.encode(),
+                        headers = {'Content-Type': 'application/json'}), timeout = 2)
+                    break
+                except Exception:
+                    if retry_wait is not None:
+                        time.sleep(retry_wait)
+
+    event_queue = queue.Queue()
+    event_sender = threading.Thread(target = publish_events, daemon = True)
+    if event_log is not None:
+        event_sender.start()
+
+    def count_command(message):
+        if message['$'] == 'before':
+            event_state['commands'] += 1
+            if message['name'] == command_types.PAUSE:
+                log_event('pause', message = message['payload'].get('text'))
+            elif message['name'] == command_types.DELAY: # the delay payload splits it in minutes and seconds
+                log_event('wait', seconds = message['payload'].get('minutes', 0) * 60 + message['payload'].get('seconds', 0),
+                          message = message['payload'].get('text'))
+
+    try:
+        from opentrons.commands import types as command_types
+        ctx.broker.subscribe(command_types.COMMAND, count_command)
+    except (ImportError, AttributeError):
+        ctx.comment('Robot commands will not be counted in the event log')
+    log_event('run_start')
+    ##########
+
     # Define Reagents as objects with their properties
     class Reagent:
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, rinse,
@@ -417,13 +477,25 @@ def run(ctx: protocol_api.ProtocolContext):
             col_change = False
         return height, col_change
 
+    ##########
+    # temperature targets are set at the start and reached in the background;
+    # only the step that really needs the target waits for it
+    def start_temperature(module, celsius):
+        module.start_set_temperature(celsius)
+        ctx.comment('Temperature module set to ' + str(celsius) + 'ºC (not waiting)')
+
+    def wait_temperature(module, celsius):
+        ctx.comment('Waiting for temperature module to reach ' + str(celsius) + 'ºC')
+        module.await_temperature(celsius)
+    ##########
+
     ############################################
     # tempdeck
     tempdeck = ctx.load_module('tempdeck', '1') #temdeck for qpcr samples
-    tempdeck.set_temperature(temperature)
+    start_temperature(tempdeck, temperature) # cools while the MMIX is prepared
 
     tempdeck_two = ctx.load_module('tempdeck', '4') #tempdeck for MMIX, PC and NC
-    tempdeck_two.set_temperature(temperature)
+    start_temperature(tempdeck_two, temperature)
 
     ####################################
     # load labware and modules
@@ -527,6 +599,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         # Check if among the pipettes, p300_single is installed
         used_vol=[]
@@ -570,6 +643,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
     ############################################################################
@@ -578,7 +652,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
+        wait_temperature(tempdeck, temperature) # qPCR plate must be cold before MMIX
+        wait_temperature(tempdeck_two, temperature) # MMIX tubes must be cold too
         p300.pick_up_tip()
 
         for dest in pcr_wells:
@@ -602,6 +679,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 3: Transfer Master MIX with P20
@@ -609,7 +687,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
+        wait_temperature(tempdeck, temperature) # qPCR plate must be cold before MMIX
+        wait_temperature(tempdeck_two, temperature) # MMIX tubes must be cold too
         p20.pick_up_tip()
 
         for dest in pcr_wells:
@@ -633,6 +714,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
         ctx.pause('Put samples please')
 
     ############################################################################
@@ -641,6 +723,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         clean_up_wells=[pc_well_old,nc_well_old]
         p20.pick_up_tip()
@@ -663,6 +746,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
     ############################################################################
@@ -671,6 +755,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('pcr_wells')
         #Loop over defined wells
@@ -695,6 +780,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
 
@@ -704,6 +790,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         p20.pick_up_tip()
 
@@ -724,6 +811,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 6: Transfer NC with P20
@@ -731,6 +819,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx._hw_manager.hardware.set_lights(rails=False) # set lights off when using MMIX
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         p20.pick_up_tip()
 
@@ -750,10 +839,17 @@ def run(ctx: protocol_api.ProtocolContext):
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         ctx.comment('#######################################################')
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
     tempdeck.deactivate()
     tempdeck_two.deactivate()
 
 
+    log_event('run_end')
+    if event_log is not None:
+        event_log.close()
+        event_queue.put(None) # the sender stops once run_end is posted
+        event_sender.join(timeout = 10)
+
     ############################################################################
     # Export the time log to a tsv file
     if not ctx.is_simulating():
@@ -774,14 +870,14 @@ def run(ctx: protocol_api.ProtocolContext):
     #os.system('mpg123 -f -8000 /etc/audio/speaker-test.mp3 &')
 
     '''if STEPS[1]['Execute'] == True:
-        total_used_vol = np.sum(used_vol)
+        total_used_vol = sum(used_vol)
         total_needed_volume = total_used_vol
         ctx.comment('Total Master Mix used volume is: ' + str(total_used_vol) + '\u03BCl.')
         ctx.comment('Needed Master Mix volume is ' +
                     str(total_needed_volume + extra_dispensal*len(dests)) +'\u03BCl')
         ctx.comment('Used Master Mix volumes per run are: ' + str(used_vol) + '\u03BCl.')
         ctx.comment('Master Mix Volume remaining in tubes is: ' +
-                    format(np.sum(MMIX.unused)+extra_dispensal*len(dests)+MMIX.vol_well) + '\u03BCl.')
+                    format(sum(MMIX.unused)+extra_dispensal*len(dests)+MMIX.vol_well) + '\u03BCl.')
         ctx.comment('200 ul Used tips in total: ' + str(tip_track['counts'][p300]))
         ctx.comment('200 ul Used racks in total: ' + str(tip_track['counts'][p300] / 96))'''
 
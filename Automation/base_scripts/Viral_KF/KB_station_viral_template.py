@@ -3,9 +3,10 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
+import threading
+import queue
 from datetime import datetime
 import csv
 
@@ -31,6 +32,7 @@ NUM_SAMPLES = $num_samples
 air_gap_vol = 10
 air_gap_vol_elutionbuffer = 10
 run_id =  $run_id
+progress_url = '' # Lab progress service, e.g. 'http://10.39.219.10:8080/event'; empty to disable
 air_gap_ic = 5
 WBone_vol=100
 WBtwo_vol=100
@@ -38,10 +40,32 @@ Elution_vol=50
 ic_vol = 10
 beads_vol = 20
 
+num_batches = 1 # Plate sets filled in this session; sets after the first are prefilled for upcoming runs
+max_multiwell_volume = 13300
+reservoir_dead_volume = 600 # ul left in every reservoir column that the tips can not take
+bead_mix_profiles = False # Mix the beads with mix_profiles instead of the validated 10 round mix (to be validated)
 x_offset = [0,0]
 multi_well_rack_area = 8.2 * 71.2  # Cross section of the 12 well reservoir
 num_cols = math.ceil(NUM_SAMPLES / 8)  # Columns we are working on
 
+# Mixing profiles of the liquids that settle (used with bead_mix_profiles, to be
+# validated on real samples before they replace the 10 round mix): stroke as a fraction of the liquid
+# under each tip, aspirate height, dispense heights swept up and down over the
+# rounds (the tip moves through the pellet while mixing), flow rates ramped from
+# the first to the last round and times the liquid is turned over
+mix_profiles = {
+    'beads_lysis': {'fraction': 0.8, 'aspirate_height': 0.3, 'heights': [1, 5, 10],
+                    'rates': [2, 4], 'turnovers': 3},
+    'beads': {'fraction': 0.8, 'aspirate_height': 0.7, 'heights': [0.7, 3, 5],
+              'rates': [2, 4], 'turnovers': 3},
+}
+# [tips sharing the liquid of a well, most rounds that still resuspend] of the
+# labware mixed with the multichannel
+mix_labware = {
+    'nest_12_reservoir_15ml': [8, 8],
+    'nest_96_wellplate_100ul_pcr_full_skirt': [1, 6],
+}
+
 
 def run(ctx: protocol_api.ProtocolContext):
     ctx.comment('Actual used columns: ' + str(num_cols))
@@ -58,7 +82,8 @@ def run(ctx: protocol_api.ProtocolContext):
         7: {'Execute': False, 'description': 'Mix beads'},
         8: {'Execute': False, 'description': 'Transfer beads'},
         9: {'Execute': True, 'description': 'Mix beadstwo'},
-        10: {'Execute': True, 'description': 'Transfer beadstwo'}
+        10: {'Execute': True, 'description': 'Transfer beadstwo'},
+        11: {'Execute': num_batches > 1, 'description': 'Prefill plate sets for upcoming runs'}
         }
 
     for s in STEPS:  # Create an empty wait_time
@@ -70,11 +95,70 @@ def run(ctx: protocol_api.ProtocolContext):
             os.mkdir(folder_path)
         file_path = folder_path + '/KB_station_viral_time_log.txt'
 
+    ##########
+    # JSONL event log: one fixed-schema record per line, appended while the run
+    # goes on (line buffered) so an aborted run still leaves its events on disk
+    event_state = {'step': 0, 'commands': 0, 'publish': bool(progress_url)}
+    event_log = None
+    if not ctx.is_simulating():
+        event_station = os.path.basename(file_path).replace('_time_log.txt', '')
+        event_log = open(file_path.replace('_time_log.txt', '_events.jsonl'), 'a', buffering = 1)
+
+    def log_event(event, step = None, column = None, seconds = None, message = None):
+        if step is not None:
+            event_state['step'] = step
+        if event_log is not None and not event_log.closed:
+            record = json.dumps({'time': datetime.now().isoformat(),
+                'run_id': str(run_id), 'station': event_station, 'event': event,
+                'step': event_state['step'], 'column': column, 'seconds': seconds,
+                'commands': event_state['commands'], 'samples': NUM_SAMPLES, 'message': message})
+            event_log.write(record + '\n')
+            if event_state['publish']:
+                event_queue.put(record)
+
+    def publish_events():
+        # one sender posts the events in the order they were logged; the progress
+        # service is optional: an event it does not take is tried again after 1,
+        # 2 and 4 s and then skipped, the next events are still sent
+        import urllib.request
+        for record in iter(event_queue.get, None):
+            for retry_wait in [1, 2, 4, None]:
+                try:
+                    urllib.request.urlopen(urllib.request.Request(progress_url, data = record.encode(),
+                        headers = {'Content-Type': 'application/json'}), timeout = 2)
+                    break
+                except Exception:
+                    if retry_wait is not None:
+                        time.sleep(retry_wait)
+
+    event_queue = queue.Queue()
+    event_sender = threading.Thread(target = publish_events, daemon = True)
+    if event_log is not None:
+        event_sender.start()
+
+    def count_command(message):
+        if message['$'] == 'before':
+            event_state['commands'] += 1
+            if message['name'] == command_types.PAUSE:
+                log_event('pause', message = message['payload'].get('text'))
+            elif message['name'] == command_types.DELAY: # the delay payload splits it in minutes and seconds
+                log_event('wait', seconds = message['payload'].get('minutes', 0) * 60 + message['payload'].get('seconds', 0),
+                          message = message['payload'].get('text'))
+
+    try:
+        from opentrons.commands import types as command_types
+        ctx.broker.subscribe(command_types.COMMAND, count_command)
+    except (ImportError, AttributeError):
+        ctx.comment('Robot commands will not be counted in the event log')
+    log_event('run_start')
+    ##########
+
     # Define Reagents as objects with their properties
     class Reagent:
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, rinse,
                      reagent_reservoir_volume, delay, num_wells, h_cono, v_fondo,
-                      tip_recycling = 'none', rinse_loops = 3, flow_rate_dispense_mix = 4, flow_rate_aspirate_mix = 4):
+                      tip_recycling = 'none', rinse_loops = 3, flow_rate_dispense_mix = 4, flow_rate_aspirate_mix = 4,
+                      mix_profile = None):
 
             self.name = name
             self.flow_rate_aspirate = flow_rate_aspirate
@@ -93,6 +177,8 @@ def run(ctx: protocol_api.ProtocolContext):
             self.tip_recycling = tip_recycling
             self.vol_well_original = reagent_reservoir_volume / num_wells
             self.rinse_loops = rinse_loops
+            self.mix_profile = mix_profile
+            self.mixed_col = None # column last mixed with its profile by the tip on the pipette
 
 
     # Reagents and their characteristics
@@ -162,6 +248,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     flow_rate_aspirate=0.5,
                     flow_rate_dispense=0.5,
                     rinse=True,
+                    mix_profile='beads_lysis',
                     rinse_loops=6,
                     num_wells=$Beads_wells,
                     delay=3,
@@ -173,6 +260,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     flow_rate_aspirate=0.5,
                     flow_rate_dispense=0.5,
                     rinse=True,
+                    mix_profile='beads',
                     rinse_loops=4,
                     num_wells=2,
                     delay=3,
@@ -202,8 +290,8 @@ def run(ctx: protocol_api.ProtocolContext):
         disp_height: dispense height; by default it's close to the top (z=-2), but in case it is needed it can be lowered
         blow_out, touch_tip: if True they will be done after dispensing
         '''
-        # Rinse before aspirating
-        if rinse == True:
+        # Rinse before aspirating, unless the tip has just mixed the column
+        if rinse == True and reagent.mixed_col != reagent.col:
             custom_mix(pipet, reagent, location = source, vol = vol,
                        rounds = reagent.rinse_loops, blow_out = True, mix_height = 0,
                        x_offset = x_offset, post_airgap=False,post_dispense=False, post_dispense_vol=20,post_airgap_vol=10)
@@ -258,6 +346,43 @@ def run(ctx: protocol_api.ProtocolContext):
         if post_airgap == True:
             pipet.aspirate(post_airgap_vol, location.top(z = 5))
 
+    def profile_mix(pipet, reagent, location, blow_out = True, post_dispense = False,
+                    post_dispense_vol = 20, post_airgap = True, post_airgap_vol = 10, x_offset = x_offset):
+        '''
+        Mixes [reagent] in [location] with its mixing profile. The stroke is a
+        fraction of the liquid under each tip and the rounds turn that liquid
+        over the times of the profile, no more than the labware allows: a well
+        with little liquid left stops early. The dispense height sweeps up and
+        down the heights of the profile and the flow rates ramp over the rounds
+        '''
+        profile = mix_profiles[reagent.mix_profile]
+        [tips, max_rounds] = mix_labware[location.parent.load_name]
+        liquid = reagent.vol_well / tips
+        vol = min(liquid * profile['fraction'], pipet.max_volume - 1)
+        rounds = max(1, min(max_rounds, math.ceil(profile['turnovers'] * liquid / vol)))
+        sweep = profile['heights'] + profile['heights'][-2:0:-1]
+        [first_rate, last_rate] = profile['rates']
+        source = location.bottom(z = profile['aspirate_height']).move(Point(x = x_offset[0]))
+        ctx.comment('Mixing ' + reagent.name + ': ' + str(rounds) + ' rounds of ' + str(round(vol)) + ' ul')
+        start = datetime.now()
+        pipet.aspirate(1, location = source, rate = first_rate)
+        for r in range(rounds):
+            rate = first_rate + (last_rate - first_rate) * r / max(rounds - 1, 1)
+            pipet.aspirate(vol, location = source, rate = rate)
+            pipet.dispense(vol, location = location.bottom(
+                z = sweep[r % len(sweep)]).move(Point(x = x_offset[1])), rate = rate)
+        pipet.dispense(1, location = location.bottom(
+            z = sweep[0]).move(Point(x = x_offset[1])), rate = last_rate)
+        if blow_out == True:
+            pipet.blow_out(location.top(z = -2))
+        if post_dispense == True:
+            pipet.dispense(post_dispense_vol, location.top(z = -2))
+        if post_airgap == True:
+            pipet.aspirate(post_airgap_vol, location.top(z = 5))
+        reagent.mixed_col = reagent.col
+        log_event('mix', column = reagent.col, seconds = (datetime.now() - start).total_seconds(),
+                  message = reagent.mix_profile + ': ' + str(rounds) + ' rounds of ' + str(round(vol)) + ' ul')
+
     def calc_height(reagent, cross_section_area, aspirate_volume, min_height = 0.2, extra_volume = 50):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -292,12 +417,14 @@ def run(ctx: protocol_api.ProtocolContext):
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
         nonlocal tip_track
-        if not ctx.is_simulating():
-            if tip_track['counts'][pip] == tip_track['maxes'][pip]:
-                ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
-                resuming.')
-                pip.reset_tipracks()
-                tip_track['counts'][pip] = 0
+        # the racks are checked and not the counts, which not every pick updates;
+        # the swap is also simulated so that the prefill of several plate sets,
+        # which takes more tips than the racks hold, passes the upload analysis
+        if not any(rack.next_tip(pip.channels) for rack in pip.tip_racks):
+            ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
+            resuming.')
+            pip.reset_tipracks()
+            tip_track['counts'][pip] = 0
         pip.pick_up_tip()
     ##########
 
@@ -406,6 +533,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -416,6 +544,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Water or elution buffer
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for transfer_vol in ElutionBuffer_vol:
@@ -432,6 +561,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
     ############################################################################
@@ -440,6 +570,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -450,6 +581,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(WB1):
@@ -470,12 +602,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 3: Filling with WashBuffer2
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -486,6 +620,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(WB2):
@@ -506,12 +641,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 4: Filling with Lysis
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         start = datetime.now()
         ctx.comment('###############################################')
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
@@ -523,6 +660,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ########
         # Wash buffer dispense
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(lysis_vol):
@@ -543,12 +681,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 5: TRANSFER IC
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         # Transfer parameters
         start = datetime.now()
         ctx.comment('###############################################')
@@ -557,6 +697,7 @@ def run(ctx: protocol_api.ProtocolContext):
         IC_transfer_vol = [ic_vol]
         rinse = True
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m20.hw_pipette['has_tip']:
                 pick_up(m20)
             for j, transfer_vol in enumerate(IC_transfer_vol):
@@ -574,12 +715,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 6: TRANSFER IC2
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         # Transfer parameters
         start = datetime.now()
         ctx.comment('###############################################')
@@ -588,6 +731,7 @@ def run(ctx: protocol_api.ProtocolContext):
         IC_transfer_vol = [ic_vol]
         rinse = True
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m20.hw_pipette['has_tip']:
                 pick_up(m20)
             for j, transfer_vol in enumerate(IC_transfer_vol):
@@ -605,12 +749,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 7: PREMIX BEADS
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
 
         start = datetime.now()
         ctx.comment('###############################################')
@@ -619,11 +765,13 @@ def run(ctx: protocol_api.ProtocolContext):
         if not m300.hw_pipette['has_tip']:
             pick_up(m300)
             ctx.comment('Tip picked up')
-        ctx.comment('Mixing ' + Beads.name)
-
         # Mixing
-        custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col], vol=120,
-                   rounds=10, blow_out=True, mix_height=10, post_dispense=True, source_height=0.3)
+        if bead_mix_profiles == True:
+            profile_mix(m300, Beads, Beads.reagent_reservoir[Beads.col], post_dispense=True)
+        else:
+            ctx.comment('Mixing ' + Beads.name)
+            custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col], vol=120,
+                       rounds=10, blow_out=True, mix_height=10, post_dispense=True, source_height=0.3)
         ctx.comment('Finished premixing!')
         ctx.comment('Now, reagents will be transferred to deepwell plate.')
 
@@ -632,12 +780,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 8: TRANSFER BEADS
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         # Transfer parameters
         start = datetime.now()
         ctx.comment('###############################################')
@@ -646,6 +796,7 @@ def run(ctx: protocol_api.ProtocolContext):
         beads_transfer_vol = [beads_vol]  # Two rounds of 130
         rinse = True
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(beads_transfer_vol):
@@ -660,9 +811,12 @@ def run(ctx: protocol_api.ProtocolContext):
                 if change_col == True:  # If we switch column because there is not enough volume left in current reservoir column we mix new column
                     ctx.comment(
                         'Mixing new reservoir column: ' + str(Beads.col))
-                    custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col],
-                               vol=120, rounds=10, blow_out=True, mix_height=1,
-                               post_dispense=True)
+                    if bead_mix_profiles == True:
+                        profile_mix(m300, Beads, Beads.reagent_reservoir[Beads.col], post_dispense=True)
+                    else:
+                        custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col],
+                                   vol=120, rounds=10, blow_out=True, mix_height=1,
+                                   post_dispense=True)
                 ctx.comment(
                     'Aspirate from reservoir column: ' + str(Beads.col))
                 ctx.comment('Pickup height is ' + str(pickup_height))
@@ -688,6 +842,7 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
 
     ############################################################################
@@ -695,6 +850,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
 
         start = datetime.now()
         ctx.comment('###############################################')
@@ -703,11 +859,13 @@ def run(ctx: protocol_api.ProtocolContext):
         if not m300.hw_pipette['has_tip']:
             pick_up(m300)
             ctx.comment('Tip picked up')
-        ctx.comment('Mixing ' + Beadstwo.name)
-
         # Mixing
-        custom_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col], vol=80,
-                   rounds=10, blow_out=True, mix_height=5, post_dispense=True, source_height=0.7)
+        if bead_mix_profiles == True:
+            profile_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col], post_dispense=True)
+        else:
+            ctx.comment('Mixing ' + Beadstwo.name)
+            custom_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col], vol=100,
+                       rounds=10, blow_out=True, mix_height=5, post_dispense=True, source_height=0.3)
         ctx.comment('Finished premixing!')
         ctx.comment('Now, reagents will be transferred to deepwell plate.')
 
@@ -716,12 +874,14 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
 
     ############################################################################
     # STEP 10: TRANSFER BEADStwo
     ############################################################################
     STEP += 1
     if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
         # Transfer parameters
         start = datetime.now()
         ctx.comment('###############################################')
@@ -730,6 +890,7 @@ def run(ctx: protocol_api.ProtocolContext):
         beads_transfer_vol = [beads_vol]  # Two rounds of 130
         rinse = True
         for i in range(num_cols):
+            log_event('column', column = i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j, transfer_vol in enumerate(beads_transfer_vol):
@@ -745,9 +906,12 @@ def run(ctx: protocol_api.ProtocolContext):
                 if change_col == True:  # If we switch column because there is not enough volume left in current reservoir column we mix new column
                     ctx.comment(
                         'Mixing new reservoir column: ' + str(Beadstwo.col))
-                    custom_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col],
-                               vol=100, rounds=10, blow_out=True, mix_height=0.7,
-                               post_dispense=True)
+                    if bead_mix_profiles == True:
+                        profile_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col], post_dispense=True)
+                    else:
+                        custom_mix(m300, Beadstwo, Beadstwo.reagent_reservoir[Beadstwo.col],
+                                   vol=100, rounds=10, blow_out=True, mix_height=1,
+                                   post_dispense=True)
 
                 ctx.comment(
                     'Aspirate from reservoir column: ' + str(Beadstwo.col))
@@ -774,6 +938,95 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
+
+    ############################################################################
+    # STEP 11: Prefill plate sets for upcoming runs
+    ############################################################################
+    STEP += 1
+    if STEPS[STEP]['Execute'] == True:
+        log_event('step_start', step = STEP, message = STEPS[STEP]['description'])
+        start = datetime.now()
+        ctx.comment('###############################################')
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
+        ctx.comment('###############################################')
+
+        # [step, reagent, volumes, plate, air gap, pickup height, dispense height, touch tip, post dispense]
+        prefill = [
+            [1, ElutionBuffer, [Elution_vol], ElutionBuffer_50ul_plate, air_gap_vol_elutionbuffer, 0.2, -2, True, False],
+            [2, WashBuffer1, [WBone_vol], WashBuffer1_100ul_plate1, air_gap_vol, 0.3, -2, False, False],
+            [3, WashBuffer2, [WBtwo_vol], WashBuffer2_100ul_plate1, air_gap_vol, 0.2, -2, False, False],
+            [4, Lysis, [100], kf_plate, air_gap_vol, 0.2, -2, False, True]]
+        # Reservoirs are already wet and mixed by this run, so the sets after
+        # the first one are filled without rinsing; reservoirs are only topped
+        # up when what is left can not fill another set
+        reservoir_left = {}
+        for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+            # the reservoir was filled with reagent_reservoir_volume and the step of the run took its volume
+            reservoir_left[reagent.name] = reagent.reagent_reservoir_volume
+            if STEPS[s]['Execute'] == True:
+                reservoir_left[reagent.name] -= sum(volumes) * 8 * num_cols
+            # the columns are emptied in order, so what is left is in the last ones
+            reagent.col = min(len(reagent.reagent_reservoir) - 1, max(0, len(reagent.reagent_reservoir) -
+                              math.ceil(reservoir_left[reagent.name] / reagent.vol_well_original)))
+            reagent.vol_well = (reservoir_left[reagent.name] -
+                                reagent.vol_well_original * (len(reagent.reagent_reservoir) - 1 - reagent.col))
+
+        for batch in range(2, num_batches + 1):
+            for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+                set_volume = sum(volumes) * 8 * num_cols
+                dead_volume = reservoir_dead_volume * len(reagent.reagent_reservoir)
+                if reservoir_left[reagent.name] - dead_volume < set_volume:
+                    refill = min(set_volume * (num_batches - batch + 1) + dead_volume,
+                                 max_multiwell_volume * len(reagent.reagent_reservoir))
+                    ctx.comment('Fill ' + reagent.name + ' reservoir up to ' +
+                                str(refill) + ' ul in ' + str(len(reagent.reagent_reservoir)) + ' column(s), ' +
+                                str(dead_volume) + ' ul of them dead volume')
+                    reservoir_left[reagent.name] = refill
+                    reagent.col = 0
+                    reagent.vol_well = refill / len(reagent.reagent_reservoir)
+            ctx.pause('Move the filled plates out and place empty plates for set ' +
+                      str(batch) + ' of ' + str(num_batches) + ' in slots 1, 2, 4 and 7. ' +
+                      'Fill reservoirs as indicated and click continue')
+
+            for [s, reagent, volumes, plate, gap, pickup_height, disp_height, touch, post] in prefill:
+                reservoir_left[reagent.name] -= sum(volumes) * 8 * num_cols
+                if not m300.hw_pipette['has_tip']:
+                    pick_up(m300)
+                for i, dest in enumerate(plate.rows()[0][:num_cols]):
+                    for j, transfer_vol in enumerate(volumes):
+                        if (batch == 2 and i == 0 and j == 0 and STEPS[s]['Execute'] == False):
+                            rinse = True # Reservoir not used yet in this run
+                        else:
+                            rinse = False
+                        if reagent.col < len(reagent.reagent_reservoir) - 1:
+                            [height, col_change] = calc_height(reagent, multi_well_rack_area, transfer_vol*8,
+                                                               min_height = pickup_height, extra_volume = reservoir_dead_volume)
+                        else: # last column takes what is left
+                            reagent.vol_well = reagent.vol_well - transfer_vol*8
+                            height = max(pickup_height, (reagent.vol_well - reagent.v_cono) / multi_well_rack_area)
+                        move_vol_multichannel(m300, reagent = reagent, source = reagent.reagent_reservoir[reagent.col],
+                                       dest = dest, vol = transfer_vol,
+                                       air_gap_vol = gap, x_offset = x_offset,
+                                       pickup_height = height, rinse = rinse, disp_height = disp_height,
+                                       blow_out = True, touch_tip = touch, post_airgap=True, post_dispense=post)
+                m300.drop_tip(home_after=False)
+                tip_track['counts'][m300] += 8
+            ctx.comment('Plate set ' + str(batch) + ' of ' + str(num_batches) + ' filled')
+
+        ctx.pause('Move the last prefilled plates out and click continue')
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' +
+                    STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        log_event('step_end', step = STEP, seconds = time_taken.total_seconds())
+
+    log_event('run_end')
+    if event_log is not None:
+        event_log.close()
+        event_queue.put(None) # the sender stops once run_end is posted
+        event_sender.join(timeout = 10)
 
 ############################################################################
     # Export the time log to a tsv file
@@ -0,0 +1,186 @@
+# Benchmarks of the generator (input_file_tecnico.py and the multi well layout
+# plots) and of the simulation of every station script. Every time is divided
+# by the time of a fixed calibration workload measured in the same run, so the
+# baseline stored in benchmark_baseline.json holds ratios that compare across
+# machines; the exit status is 1 when a case is slower than the baseline by
+# more than the tolerance.
+#
+#   python benchmark.py            # compare with the baseline
+#   python benchmark.py --save     # store the current times as the baseline
+#
+# Everything runs offline; the station scripts are simulated with opentrons
+# when it is installed and with fake_context.py otherwise (timed as separate
+# cases), and the cases that can not run are reported as skipped.
+
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import tempfile
+
+automation_path = os.path.dirname(os.path.abspath(__file__))
+repo_path = os.path.dirname(automation_path)
+baseline_path = os.path.join(automation_path, 'benchmark_baseline.json')
+sys.path.insert(0, os.path.join(repo_path, 'general_scripts'))
+
+# station scripts and the constants they are simulated with (the pathogen qPCR
+# script adds the controls to NUM_SAMPLES and does not fit 96 samples)
+station_scripts = {'KingFisher_viral/KA_sample_prep.py': {}, 'KingFisher_viral/KB_station_viral.py': {},
+                   'KingFisher_viral/KC_qPCR_singledispense.py': {},
+                   'KingFisher_pathogen_core/KA_sample_prep.py': {},
+                   'KingFisher_pathogen_core/KB_station_pathogen.py': {},
+                   'KingFisher_pathogen_core/KC_qPCR_singledispense.py': {'NUM_SAMPLES': 94},
+                   'MagMax_Pathogen/A_sample_prep.py': {}, 'MagMax_Pathogen/B_extraction.py': {},
+                   'MagMax_Pathogen/C_qPCR_singledispense.py': {},
+                   'Homebrew_viral_protocol/B_station.py': {}}
+for kit in ['MAGMAX', 'OMEGA', 'QIAGEN AL', 'QIAGEN_RLT']:
+    for station in ['Station_A', 'Station_B', 'Station_C']:
+        station_scripts['covidwarriors_protocols/COMMERCIAL_KIT_PROTOCOLS/' + kit + '/' + station + '.py'] = {}
+
+
+def calibration():
+    '''
+    Fixed pure Python work (dictionaries, strings and sorting, like the
+    generator and the simulations): the unit of every benchmark time
+    '''
+    names = {'A' + str(i * 7919 % 10007): i for i in range(10000)}
+    return sorted(names, key=names.get)
+
+
+def filled_excel(folder, num_samples=94):
+    '''
+    Copy of Reference_template.xlsx with [num_samples] sample codes
+    '''
+    import openpyxl
+    book = openpyxl.load_workbook(os.path.join(automation_path, 'base_scripts', 'Reference_template.xlsx'))
+    sheet = book.worksheets[0]
+    for i in range(num_samples):
+        sheet.cell(row=3 + i, column=3).value = 'S' + str(i + 1)
+    path = os.path.join(folder, 'fill.xlsx')
+    book.save(path)
+    return path
+
+
+def generator_cases(folder):
+    sys.path.insert(0, automation_path)
+    import input_file_tecnico as generator
+    from multi_well_viral import generate_multi_well_viral
+    from multi_well_pathogen_IC import generate_multi_well_pathogen_IC
+    from multi_well_pathogen_R import generate_multi_well_pathogen_R
+    from multi_mini_well import generate_multi_mini_well
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    recipe_V = generator.generate_recipe('V', 96, generator.recipes, 94)
+    recipe_P = generator.generate_recipe('P', 96, generator.recipes, 94)
+    operation_data = {'$technician': "'Benchmark'", '$num_samples': '94', '$date': "'01/01/2020, 10:00:00'",
+                      '$run_id': '1', '$hora': '10:00', '$dia': '2020_01_01', '$num_s_corrected': '96',
+                      '$num_cols': '12', '$MMIX': str(recipe_V['MMIX'][0]), '$Taqpath': str(recipe_V['Taqpath'][0]),
+                      '$Assay': str(recipe_V['Assay'][0]), '$Water': str(recipe_V['Water'][0])}
+    templates = os.path.join(automation_path, 'base_scripts', 'Viral_KF')
+    os.makedirs(os.path.join(folder, 'scripts'), exist_ok=True)
+
+    def update_files():
+        for filename in sorted(os.listdir(templates)):
+            if filename.endswith('.py'):
+                shutil.copy(os.path.join(templates, filename), os.path.join(folder, 'scripts', filename))
+                generator.update_files(folder, filename, recipe_V, operation_data)
+
+    def plots(function, *args):
+        def run():
+            function(*args)
+            plt.close('all')
+        return run
+
+    excel = filled_excel(folder)
+    return {
+        'generate_recipe': lambda: [generator.generate_recipe(mode, -(-n // 8) * 8, generator.recipes, n)
+                                    for mode in 'VP' for n in range(1, 95)],
+        'thermocycler_generator': lambda: generator.thermocycler_generator(excel),
+        'update_files': update_files,
+        'multi_well_viral': plots(generate_multi_well_viral, folder, recipe_V),
+        'multi_well_pathogen_IC': plots(generate_multi_well_pathogen_IC, folder, recipe_P),
+        'multi_well_pathogen_R': plots(generate_multi_well_pathogen_R, folder, recipe_P),
+        'multi_mini_well': plots(generate_multi_mini_well, folder, recipe_V, 'V', 12),
+    }
+
+
+def simulation_cases():
+    from protocol_timing import simulate
+    try:
+        import opentrons.simulate
+        backend = 'simulate '
+    except ImportError:
+        backend = 'simulate offline '
+    return {backend + script: (lambda path=os.path.join(repo_path, script), constants=constants:
+                               simulate(path, constants=constants))
+            for script, constants in station_scripts.items()}
+
+
+def measure(function, repeat=5):
+    '''
+    Seconds per call of the fastest of [repeat] rounds; each round makes as
+    many calls as fit in 0.2 s, and the minimum is the least affected by the
+    rest of the machine
+    '''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the generator and the station simulations')
+    parser.add_argument('--save', action='store_true', help='store the times as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown (default 50%%)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-k', help='only run the cases whose name contains this text')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    folder = tempfile.mkdtemp()
+    cases = {}
+    for name, collect in [('generator', lambda: generator_cases(folder)), ('simulation', simulation_cases)]:
+        try:
+            cases.update(collect())
+        except ImportError as e:
+            print('SKIPPED ' + name + ' cases: ' + str(e))
+
+    unit = measure(calibration, args.repeat)
+    print('%-90s %9.4f s' % ('calibration (unit of the ratios)', unit))
+    times = {}
+    slower = []
+    for name, function in cases.items():
+        if args.k and args.k not in name:
+            continue
+        try:
+            times[name] = measure(function, args.repeat) / unit
+        except Exception as e:
+            print('%-90s FAILED %s' % (name, e))
+            slower.append(name)
+            continue
+        reference = baseline.get(name)
+        flag = ''
+        if reference and times[name] > reference * (1 + args.tolerance):
+            flag = '  <-- SLOWER'
+            slower.append(name)
+        print('%-90s %9.4f s  %8.2f x  baseline %s%s' % (name, times[name] * unit, times[name],
+                                                         '%.2f x' % reference if reference else '-', flag))
+    shutil.rmtree(folder)
+
+    if args.save:
+        baseline.update({name: float('%.4g' % ratio) for name, ratio in times.items()})
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('Baseline saved to ' + baseline_path)
+        return 0
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
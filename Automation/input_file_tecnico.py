@@ -6,6 +6,7 @@
 
 from datetime import datetime
 import os
+import sys
 import os.path
 import pandas as pd
 import string
@@ -22,6 +23,7 @@ import platform # use this to generate the input file forms
 platform.system()
 
 demo_mode=True
+build_command_streams=False # simulate the generated scripts offline and store their command streams (command_cache.py build)
 
 # recipes for protocol types [obj. volume per well, allowable remaining nonusable volume in channel]
 viral_recipe={'Beads':[20,3],
@@ -172,14 +174,15 @@ def thermocycler_generator(path):
         print('BEWARE! Excel file is not complete! Fill sample codes and restart.')
         exit()
 
+    sample_list[sample_list.columns[3]]=sample_list.iloc[:,3].astype(object) # filled with well names below
     i=0
     for number in range(1,13):
         for key in code_data['Table 1'].tolist():
             sample_list.iloc[i,3]=key+str(number)
             i+=1
 
-    cp=sample_list.notna()[::-1].idxmax()[2]+1
-    cn=sample_list.notna()[::-1].idxmax()[2]+2
+    cp=sample_list.notna()[::-1].idxmax().iloc[2]+1
+    cn=sample_list.notna()[::-1].idxmax().iloc[2]+2
     f[sample_list.iloc[cp,3]]=str('CP')
     f[sample_list.iloc[cn,3]]=str('CN')
 
@@ -344,6 +347,21 @@ def main():
         else:
             print('No files found')
 
+    # command streams of the offline simulation (general_scripts/command_cache.py), only
+    # on request: they are not the analysis the OT-2 app makes of the uploaded scripts
+    if build_command_streams==True:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'general_scripts'))
+        from command_cache import cached_simulate
+        for filename in sorted(os.listdir(final_path+'/scripts/')):
+            if filename.endswith('.py'):
+                try:
+                    cached_simulate(os.path.join(final_path+'/scripts/',filename))
+                except Exception as e:
+                    print('The command stream of '+filename+' could not be computed: '+str(e))
+    else:
+        print('Command streams not built; to build them: python '+os.path.join(os.path.dirname(os.path.abspath(__file__)),
+              '..', 'general_scripts', 'command_cache.py')+' build '+final_path+'/scripts/*.py')
+
 if __name__ == '__main__':
     main()
 
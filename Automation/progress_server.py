@@ -0,0 +1,190 @@
+# Lab-side progress service. The station protocols POST every event of their
+# JSONL event log to /event (see progress_url in the scripts); this service
+# keeps the latest state of each robot (address and station script) and
+# estimates when each one will stop for the next plate handoff, from the step
+# times and pauses seen in earlier runs with the same number of samples.
+# GET / shows all robots in one page, GET /status returns the same as JSON.
+#!usr/bin/local/python
+# coding=utf-8
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+refresh = 5 # seconds between page reloads
+
+
+def history_key(station, samples):
+    '''
+    Runs of different sizes take different times: the history is kept per
+    station and number of samples
+    '''
+    return station + '/' + str(samples)
+
+
+def is_tip_replacement(message):
+    return 'replace' in str(message).lower() and 'tiprack' in str(message).lower()
+
+
+class Progress:
+    '''
+    Latest state per robot, by (address, station) as two robots can run the
+    same script, plus the history used for the estimates, per station and
+    number of samples of the run ('KB_station_viral/96'):
+    durations[key][step] = [seconds, ...], pauses[key] = [steps]
+    '''
+    def __init__(self, history_path=None):
+        self.lock = threading.Lock()
+        self.history_path = history_path
+        self.robots = {}
+        self.history = {'durations': {}, 'pauses': {}}
+        if history_path and os.path.isfile(history_path):
+            with open(history_path) as f:
+                self.history = json.load(f)
+
+    def save(self):
+        if self.history_path:
+            with open(self.history_path + '.tmp', 'w') as f:
+                json.dump(self.history, f)
+            os.replace(self.history_path + '.tmp', self.history_path)
+
+    def add_event(self, event, address):
+        station = event['station']
+        step = str(event['step'])
+        key = history_key(station, event.get('samples'))
+        with self.lock:
+            robot = self.robots.setdefault((address, station), {'paused_steps': []})
+            robot.update({'address': address, 'station': station, 'run_id': event['run_id'],
+                          'last_event': event['event'], 'updated': event['time'], 'step': event['step'], 'commands': event['commands'],
+                          'samples': event.get('samples')})
+            if event['event'] == 'run_start':
+                robot.update({'paused_steps': [], 'step_started': None, 'description': None,
+                              'column': None, 'message': None})
+            elif event['event'] == 'step_start':
+                robot.update({'step_started': event['time'], 'description': event['message'], 'column': None})
+            elif event['event'] == 'column':
+                robot['column'] = event['column']
+            elif event['event'] == 'step_end':
+                times = self.history['durations'].setdefault(key, {}).setdefault(step, [])
+                times.append(event['seconds'])
+                del times[:-20] # recent runs only
+                self.save()
+            elif event['event'] in ('pause', 'wait'):
+                robot['message'] = event['message']
+                # running out of tips is not a plate handoff: its step is not learned
+                if event['event'] == 'pause' and not is_tip_replacement(event['message']):
+                    robot['paused_steps'].append(event['step'])
+                    pauses = self.history['pauses'].setdefault(key, [])
+                    if event['step'] not in pauses:
+                        pauses.append(event['step'])
+                        self.save()
+
+    def eta_next_pause(self, robot_id, now=None):
+        '''
+        Seconds until the next pause of the robot: what is left of the
+        current step plus the usual time of the steps up to the pausing one
+        '''
+        robot = self.robots[robot_id]
+        key = history_key(robot['station'], robot['samples'])
+        durations = self.history['durations'].get(key, {})
+        step = robot['step']
+        upcoming = sorted(s for s in self.history['pauses'].get(key, [])
+                          if s > step or (s == step and s not in robot['paused_steps']))
+        if robot['last_event'] == 'pause' and not is_tip_replacement(robot['message']):
+            return None
+        if robot['samples'] is None or not upcoming or robot['last_event'] == 'run_end':
+            return None
+        now = now or datetime.now()
+        eta = 0
+        if robot.get('step_started') and str(step) in durations:
+            elapsed = (now - datetime.fromisoformat(robot['step_started'])).total_seconds()
+            eta += max(statistics.median(durations[str(step)]) - elapsed, 0)
+        for s in range(step + 1, upcoming[0] + 1):
+            if str(s) in durations:
+                eta += statistics.median(durations[str(s)])
+        return eta
+
+    def status(self):
+        with self.lock:
+            status = {}
+            for (address, station), robot in sorted(self.robots.items()):
+                status[address + ' ' + station] = dict(robot, waiting_operator=robot['last_event'] == 'pause',
+                                                       eta_next_pause=self.eta_next_pause((address, station)))
+            return status
+
+
+def render(status):
+    rows = ''
+    for robot in status.values():
+        if robot['waiting_operator']:
+            state = '<b>WAITING: ' + str(robot['message']) + '</b>'
+        elif robot['eta_next_pause'] is not None:
+            state = 'next handoff in ' + str(round(robot['eta_next_pause'] / 60)) + ' min'
+        else:
+            state = robot['last_event']
+        rows += ('<tr><td>' + robot['address'] + '</td><td>' + robot['station'] + '</td><td>' +
+                 str(robot['run_id']) + '</td><td>' +
+                 str(robot['step']) + ' ' + str(robot.get('description') or '') + '</td><td>' +
+                 str(robot.get('column') if robot.get('column') is not None else '') + '</td><td>' +
+                 state + '</td><td>' + robot['updated'][11:19] + '</td></tr>\n')
+    return ('<html><head><meta http-equiv="refresh" content="' + str(refresh) + '">' +
+            '<title>Robots</title></head><body><table border="1">\n' +
+            '<tr><th>Robot</th><th>Station</th><th>Run</th><th>Step</th><th>Column</th><th>State</th><th>Updated</th></tr>\n' +
+            rows + '</table></body></html>')
+
+
+def make_handler(progress):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/event':
+                self.send_error(404)
+                return
+            try:
+                event = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                progress.add_event(event, self.client_address[0])
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400)
+                return
+            self.send_response(204)
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == '/status':
+                body, kind = json.dumps(progress.status()), 'application/json'
+            elif self.path == '/':
+                body, kind = render(progress.status()), 'text/html'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', kind + '; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lab-side progress service for the robots')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--history', default='progress_history.json',
+                        help='json file where the step times and pauses are learnt (default in the current directory)')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('', args.port), make_handler(Progress(args.history)))
+    print('Listening on port ' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
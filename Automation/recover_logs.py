@@ -0,0 +1,124 @@
+# Collect the run logs (time logs and event logs) from every robot into the
+# downloads folder. All robots are queried at the same time, each over a
+# single shared ssh connection, and only files that are new or have changed
+# since the last collection are copied. Every copied file is checked against
+# the checksum reported by the robot.
+#!usr/bin/local/python
+# coding=utf-8
+
+import os
+import sys
+import argparse
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# IP routing for these robots
+IP_list = ['10.39.219.'+str(i) for i in [12,14,16,18]]
+
+rpi_path = '/var/lib/jupyter/notebooks'
+logs_path = '/home/downloads'
+log_patterns = ['*_time_log.txt', '*_events.jsonl']
+
+# one master connection per robot, reused by every command sent to it
+ssh_options = ['-o', 'ControlMaster=auto', '-o', 'ControlPath=~/.ssh/cm-%r@%h:%p',
+               '-o', 'ControlPersist=60', '-o', 'ConnectTimeout=5', '-o', 'BatchMode=yes']
+
+
+def robot_command(IP, command, local_root=None):
+    '''
+    Build the command line that runs [command] in the notebooks folder of the
+    robot. With local_root the robot is a local folder (local_root/IP), which
+    is how the collector is tried without robots.
+    '''
+    if local_root is not None:
+        return ['sh', '-c', 'cd ' + os.path.join(local_root, IP) + ' && ' + command]
+    return ['ssh'] + ssh_options + ['root@' + IP, 'cd ' + rpi_path + ' && ' + command]
+
+
+def list_remote(IP, run_id=None, local_root=None):
+    '''
+    Returns {relative path: md5} of the log files of the robot, in one call
+    '''
+    folder = run_id if run_id is not None else '.'
+    names = ' -o '.join(["-name '" + p + "'" for p in log_patterns])
+    command = 'find ' + folder + ' -type f \\( ' + names + ' \\) -exec md5sum {} +'
+    out = subprocess.run(robot_command(IP, command, local_root),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    if out.returncode != 0 and not out.stdout:
+        raise RuntimeError(out.stderr.decode(errors='replace').strip())
+    files = {}
+    for line in out.stdout.decode().splitlines():
+        md5, path = line.split(None, 1)
+        files[os.path.normpath(path)] = md5
+    return files
+
+
+def md5_file(path):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def collect_robot(IP, dest, run_id=None, local_root=None):
+    '''
+    Copies the new or changed logs of one robot to dest/IP in a single tar
+    stream and verifies them. Returns (copied, unchanged, errors)
+    '''
+    robot_dest = os.path.join(dest, IP)
+    remote = list_remote(IP, run_id, local_root)
+    pending = [path for path, md5 in sorted(remote.items())
+               if not os.path.isfile(os.path.join(robot_dest, path))
+               or md5_file(os.path.join(robot_dest, path)) != md5]
+    errors = []
+    if pending:
+        os.makedirs(robot_dest, exist_ok=True)
+        tar = subprocess.run(robot_command(IP, 'tar -cf - ' + ' '.join(
+                             ["'" + p + "'" for p in pending]), local_root),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
+        subprocess.run(['tar', '-xf', '-', '-C', robot_dest], input=tar.stdout, check=True)
+        for path in pending:
+            local = os.path.join(robot_dest, path)
+            if not os.path.isfile(local) or md5_file(local) != remote[path]:
+                errors.append(path)
+    return len(pending) - len(errors), len(remote) - len(pending), errors
+
+
+def collect(IPs, dest, run_id=None, local_root=None):
+    '''
+    Collects all robots concurrently; returns {IP: (copied, unchanged, errors)}
+    where a robot that could not be reached has its error message as errors
+    '''
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(IPs)) as pool:
+        jobs = {IP: pool.submit(collect_robot, IP, dest, run_id, local_root) for IP in IPs}
+        for IP, job in jobs.items():
+            try:
+                results[IP] = job.result()
+            except Exception as e:
+                results[IP] = (0, 0, [str(e)])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect run logs from the robots')
+    parser.add_argument('--run_id', help='only collect this run (default: all runs)')
+    parser.add_argument('--dest', default=logs_path, help='folder to store the logs')
+    parser.add_argument('--robots', nargs='+', default=IP_list, help='robot IPs')
+    parser.add_argument('--local_root', help='read robots from local folders named by IP')
+    args = parser.parse_args()
+
+    results = collect(args.robots, args.dest, args.run_id, args.local_root)
+    failed = False
+    for IP, (copied, unchanged, errors) in results.items():
+        print(IP + ': ' + str(copied) + ' copied, ' + str(unchanged) + ' unchanged')
+        for error in errors:
+            print('  ' + IP + ': ' + error + ' could not be exported')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# Historical store of the step timings of every run. The station logs (TSV
+# time logs, JSONL event logs and the old station_b_log_*.json files) are
+# loaded into a SQLite database keyed by run, station, protocol version, step
+# and number of samples, so questions such as the median time per column of a
+# step over the last month are answered with an indexed query.
+#!usr/bin/local/python
+# coding=utf-8
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+db_path = '/home/downloads/run_store.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, date TEXT, num_samples INTEGER);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT, station TEXT, version TEXT, step INTEGER, description TEXT,
+    executed INTEGER, wait_time REAL, seconds REAL, num_samples INTEGER,
+    started TEXT, source TEXT,
+    PRIMARY KEY (run_id, station, step));
+CREATE INDEX IF NOT EXISTS steps_by_description ON steps (description, started);
+CREATE INDEX IF NOT EXISTS steps_by_station ON steps (station, step, started);
+CREATE TABLE IF NOT EXISTS events (
+    run_id TEXT, station TEXT, time TEXT, event TEXT, step INTEGER,
+    column_ INTEGER, seconds REAL, message TEXT,
+    PRIMARY KEY (run_id, station, time, event, step));
+CREATE INDEX IF NOT EXISTS events_by_station ON events (station, time);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime REAL, size INTEGER);
+'''
+
+
+def connect(path=db_path):
+    db = sqlite3.connect(path)
+    db.executescript(schema)
+    return db
+
+
+def parse_duration(text):
+    '''
+    Seconds of a str(timedelta) such as '0:01:02.345678' or '1 day, 0:00:01'
+    '''
+    text = text.strip()
+    days = 0
+    if 'day' in text:
+        d, text = text.split(',', 1)
+        days = int(d.split()[0])
+    h, m, s = text.strip().split(':')
+    return days * 86400 + int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def run_id_from_path(path):
+    '''
+    Run folders are named <date>_OT_<id>_<protocol>; the log collector keeps
+    the robot folder name, which is the run id itself
+    '''
+    for part in reversed(os.path.normpath(path).split(os.sep)[:-1]):
+        found = re.search(r'_OT_?(\d+)', part)
+        if found:
+            return found.group(1)
+        if part.isdigit():
+            return part
+    return None
+
+
+def script_version(path, station):
+    '''
+    md5 of the station script stored with the run (scripts/KA..., KB..., KC...)
+    '''
+    scripts = os.path.join(os.path.dirname(os.path.dirname(path)), 'scripts')
+    if not os.path.isdir(scripts):
+        return None
+    for filename in sorted(os.listdir(scripts)):
+        if filename.endswith('.py') and filename[:2] == station[:2]:
+            with open(os.path.join(scripts, filename), 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()[:10]
+    return None
+
+
+def read_time_log(path):
+    '''
+    Rows of a TSV time log: STEP, execution, description, wait_time, execution_time
+    '''
+    rows = []
+    with open(path) as f:
+        next(f, None)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 4:
+                continue
+            seconds = parse_duration(fields[4]) if len(fields) > 4 and fields[4] else None
+            rows.append([int(fields[0]), fields[2], fields[1] == 'True', float(fields[3]), seconds])
+    return rows
+
+
+def read_events(path):
+    '''
+    step_end records of a JSONL event log, grouped by (run_id, station), and
+    all the events; a run that aborted still has the steps it finished
+    '''
+    descriptions = {}
+    runs = {}
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue # last line of a run that was cut while writing
+            events.append(event)
+            key = (event['run_id'], event['station'])
+            if event['event'] == 'step_start':
+                descriptions[key + (event['step'],)] = event['message']
+            elif event['event'] == 'step_end':
+                runs.setdefault(key, []).append([event['step'], descriptions.get(key + (event['step'],)),
+                                                 True, 0, event['seconds'], event['time']])
+    return runs, events
+
+
+def read_old_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    rows = []
+    for step, values in data.items():
+        seconds = parse_duration(values['Time:']) if 'Time:' in values else None
+        rows.append([int(step), values.get('description'), bool(values.get('Execute', True)),
+                     float(values.get('wait_time', 0)), seconds])
+    return rows
+
+
+def store_rows(db, run_id, station, version, rows, started, source, replace=True):
+    num_samples = db.execute('SELECT num_samples FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+    num_samples = num_samples[0] if num_samples else None
+    verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+    db.executemany(verb + ' INTO steps VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                   [(run_id, station, version, row[0], row[1], int(row[2]), row[3], row[4],
+                     num_samples, row[5] if len(row) > 5 else started, source) for row in rows])
+
+
+def ingest_registry(db, path):
+    '''
+    id_runs.txt written by input_file_tecnico.py: ID, date, hora, sample_num
+    '''
+    with open(path) as f:
+        next(f, None)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 4:
+                date = datetime.strptime(fields[1] + ' ' + fields[2], '%Y_%m_%d %H:%M').isoformat()
+                db.execute('INSERT OR REPLACE INTO runs VALUES (?,?,?)', (fields[0], date, int(fields[3])))
+    fill_num_samples(db)
+
+
+def fill_num_samples(db):
+    db.execute('UPDATE steps SET num_samples = (SELECT num_samples FROM runs WHERE runs.run_id = steps.run_id) '
+               'WHERE num_samples IS NULL')
+
+
+def ingest(db, roots):
+    '''
+    Loads every log file under [roots] that is new or changed since the last
+    ingestion. Returns the number of files loaded
+    '''
+    loaded = 0
+    for root in roots:
+        for folder, dirs, files in os.walk(root):
+            # time logs first so event logs only add runs that have no time log
+            for filename in sorted(files, key=lambda name: name.endswith('.jsonl')):
+                path = os.path.join(folder, filename)
+                stat = os.stat(path)
+                known = db.execute('SELECT mtime, size FROM files WHERE path = ?', (path,)).fetchone()
+                if known == (stat.st_mtime, stat.st_size):
+                    continue
+                started = datetime.fromtimestamp(stat.st_mtime).isoformat()
+                if filename.endswith('_time_log.txt'):
+                    station = filename[:-len('_time_log.txt')]
+                    store_rows(db, run_id_from_path(path), station, script_version(path, station),
+                               read_time_log(path), started, 'tsv')
+                elif filename.endswith('_events.jsonl'):
+                    runs, events = read_events(path)
+                    # the events carry the samples of the run; the registry, when
+                    # given, has the last word
+                    db.executemany('INSERT OR IGNORE INTO runs VALUES (?,?,?)',
+                                   [(e['run_id'], e['time'], e['samples']) for e in events
+                                    if e['event'] == 'run_start' and e.get('samples') is not None])
+                    for (run_id, station), rows in runs.items():
+                        store_rows(db, run_id, station, script_version(path, station),
+                                   rows, started, 'jsonl', replace=False)
+                    db.executemany('INSERT OR IGNORE INTO events VALUES (?,?,?,?,?,?,?,?)',
+                                   [(e['run_id'], e['station'], e['time'], e['event'], e['step'],
+                                     e['column'], e['seconds'], e['message']) for e in events])
+                elif re.match(r'station_[a-z]_log_.*\.json$', filename):
+                    store_rows(db, filename[len('station_b_log_'):-len('.json')], filename[:9],
+                               None, read_old_json(path), started, 'json')
+                else:
+                    continue
+                db.execute('INSERT OR REPLACE INTO files VALUES (?,?,?)', (path, stat.st_mtime, stat.st_size))
+                loaded += 1
+    fill_num_samples(db) # time logs loaded before the events of their run
+    db.commit()
+    return loaded
+
+
+def step_times(db, description, days=30, station=None, per_column=False):
+    '''
+    Durations in seconds of the executed steps whose description contains
+    [description] over the last [days]; per_column divides by the columns of
+    the run (8 samples per column)
+    '''
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    query = ('SELECT seconds, num_samples FROM steps WHERE description LIKE ? AND started >= ? '
+             'AND executed = 1 AND seconds IS NOT NULL')
+    values = ['%' + description + '%', since]
+    if station is not None:
+        query += ' AND station = ?'
+        values.append(station)
+    times = []
+    for seconds, num_samples in db.execute(query, values):
+        if per_column:
+            if not num_samples:
+                continue
+            seconds = seconds / -(-num_samples // 8)
+        times.append(seconds)
+    return times
+
+
+def mix_times(db, days=30, station=None):
+    '''
+    {profile: [[rounds, seconds], ...]} of the mix events of the last [days];
+    the message of a mix event is 'profile: rounds rounds of vol ul'
+    '''
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    query = "SELECT message, seconds FROM events WHERE event = 'mix' AND time >= ? AND seconds IS NOT NULL"
+    values = [since]
+    if station is not None:
+        query += ' AND station = ?'
+        values.append(station)
+    mixes = {}
+    for message, seconds in db.execute(query, values):
+        found = re.match(r'(\w+): (\d+) rounds', message or '')
+        if found:
+            mixes.setdefault(found.group(1), []).append([int(found.group(2)), seconds])
+    return mixes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Historical store of run step timings')
+    parser.add_argument('--db', default=db_path)
+    sub = parser.add_subparsers(dest='command')
+    load = sub.add_parser('ingest', help='load new or changed logs')
+    load.add_argument('roots', nargs='+')
+    load.add_argument('--registry', help='id_runs.txt with the sample count of each run')
+    median = sub.add_parser('median', help='median duration of a step')
+    median.add_argument('description')
+    median.add_argument('--days', type=int, default=30)
+    median.add_argument('--station')
+    median.add_argument('--per_column', action='store_true')
+    mixes = sub.add_parser('mixes', help='median rounds and time of the mixes of each mixing profile')
+    mixes.add_argument('--days', type=int, default=30)
+    mixes.add_argument('--station')
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.command == 'ingest':
+        if args.registry:
+            ingest_registry(db, args.registry)
+        print(str(ingest(db, args.roots)) + ' log files loaded')
+        if args.registry:
+            ingest_registry(db, args.registry)
+            db.commit()
+    elif args.command == 'median':
+        times = step_times(db, args.description, args.days, args.station, args.per_column)
+        if not times:
+            print('No runs found')
+            return 1
+        print(args.description + ': median ' + '%.1f' % statistics.median(times) +
+              ' s over ' + str(len(times)) + ' runs')
+    elif args.command == 'mixes':
+        mixes = mix_times(db, args.days, args.station)
+        if not mixes:
+            print('No mixes found')
+            return 1
+        for profile, times in sorted(mixes.items()):
+            print('%s: %d mixes, median %g rounds in %.1f s, %.1f s per round' % (
+                profile, len(times), statistics.median(r for r, s in times),
+                statistics.median(s for r, s in times), statistics.median(s / r for r, s in times)))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
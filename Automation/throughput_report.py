@@ -0,0 +1,153 @@
+# Lab throughput report built from the run store (run_store.py): samples per
+# hour, utilisation and idle time of each station, time lost at pauses,
+# handoff gaps between stations, critical path of the runs and the bottleneck
+# station of every day. The result is a static html page, written next to the
+# run store unless --out says otherwise.
+#!usr/bin/local/python
+# coding=utf-8
+
+import os
+import re
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+from run_store import connect, db_path
+
+stations = ['A', 'B', 'C']
+
+
+def station_letter(station):
+    '''
+    KA_SampleSetup_viral -> A, KB_station_viral -> B, station_b -> B,
+    StationA -> A, Station_KB_sample_prep_viral_path2 -> B, B_station_manual_viral -> B
+    '''
+    found = re.match(r'(?i)^(?:station_?)?k?([abc])(?![a-z])', station)
+    return found.group(1).upper() if found else None
+
+
+def station_runs(db, since):
+    '''
+    One [run_id, station, start, end, busy seconds, pause seconds, wait
+    seconds, samples] per station run. Busy is the time the robot was moving:
+    the run minus the operator pauses and the waits (incubations, settling on
+    the magnet). Event logs give exact times; runs with only a time log end
+    when the log was written and start their summed step time before
+    '''
+    runs = {}
+    for run_id, station, time, event, seconds in db.execute(
+            'SELECT run_id, station, time, event, seconds FROM events WHERE time >= ? '
+            'ORDER BY run_id, station, time', (since,)):
+        run = runs.setdefault((run_id, station), {'start': time, 'end': time, 'pause': 0, 'wait': 0,
+                                                  'paused': None})
+        run['end'] = time
+        if run['paused'] is not None:
+            run['pause'] += (datetime.fromisoformat(time) - datetime.fromisoformat(run['paused'])).total_seconds()
+            run['paused'] = None
+        if event == 'pause':
+            run['paused'] = time
+        elif event == 'wait':
+            run['wait'] += seconds or 0
+    for run_id, station, end, seconds, wait in db.execute(
+            'SELECT run_id, station, MAX(started), SUM(seconds), SUM(wait_time) FROM steps '
+            'WHERE source != ? AND started >= ? AND executed = 1 GROUP BY run_id, station', ('jsonl', since)):
+        if (run_id, station) not in runs and seconds:
+            start = (datetime.fromisoformat(end) - timedelta(seconds=seconds)).isoformat()
+            runs[(run_id, station)] = {'start': start, 'end': end, 'pause': 0, 'wait': min(wait or 0, seconds)}
+    samples = dict(db.execute('SELECT run_id, num_samples FROM runs'))
+    result = []
+    for (run_id, station), run in runs.items():
+        start, end = datetime.fromisoformat(run['start']), datetime.fromisoformat(run['end'])
+        busy = max((end - start).total_seconds() - run['pause'] - run['wait'], 0)
+        result.append([run_id, station_letter(station), start, end,
+                       busy, run['pause'], run['wait'], samples.get(run_id) or 0])
+    return sorted(result, key=lambda r: r[2])
+
+
+def day_summary(runs):
+    '''
+    Per day: per station stats, handoff gaps, critical path and bottleneck
+    '''
+    days = {}
+    for run in runs:
+        days.setdefault(run[2].date(), []).append(run)
+    summary = []
+    for day, day_runs in sorted(days.items()):
+        per_station = {}
+        for letter in stations:
+            mine = [r for r in day_runs if r[1] == letter]
+            if not mine:
+                continue
+            busy = sum(r[4] for r in mine)
+            span = (max(r[3] for r in mine) - min(r[2] for r in mine)).total_seconds()
+            idle = sum(max((b[2] - a[3]).total_seconds(), 0) for a, b in zip(mine, mine[1:]))
+            samples = sum(r[7] for r in mine)
+            per_station[letter] = {'runs': len(mine), 'samples': samples,
+                                   'samples_hour': samples / (busy / 3600) if busy else 0,
+                                   'utilisation': busy / span if span else 1, 'idle': idle,
+                                   'pause': sum(r[5] for r in mine), 'wait': sum(r[6] for r in mine),
+                                   'busy': busy}
+        by_run = {}
+        for r in day_runs:
+            by_run.setdefault(r[0], {})[r[1]] = r
+        gaps, paths = {}, []
+        for run_id, run in by_run.items():
+            for first, second in zip(stations, stations[1:]):
+                if first in run and second in run:
+                    gaps.setdefault(first + '>' + second, []).append(
+                        max((run[second][2] - run[first][3]).total_seconds(), 0))
+            paths.append((max(r[3] for r in run.values()) - min(r[2] for r in run.values())).total_seconds())
+        summary.append({'day': day, 'stations': per_station,
+                        'gaps': {k: sum(v) / len(v) for k, v in gaps.items()},
+                        'critical_path': sum(paths) / len(paths) if paths else 0,
+                        # a day with runs of unknown stations only has no bottleneck
+                        'bottleneck': max(per_station, key=lambda s: per_station[s]['busy'])
+                                      if per_station else None})
+    return summary
+
+
+def minutes(seconds):
+    return '%.0f' % (seconds / 60)
+
+
+def render(summary):
+    rows = ''
+    for day in summary:
+        for letter, s in sorted(day['stations'].items()):
+            rows += ('<tr><td>' + str(day['day']) + '</td><td>' + letter +
+                     (' (bottleneck)' if letter == day['bottleneck'] else '') + '</td><td>' +
+                     str(s['runs']) + '</td><td>' + str(s['samples']) + '</td><td>' +
+                     '%.0f' % s['samples_hour'] + '</td><td>' + '%.0f%%' % (100 * s['utilisation']) +
+                     '</td><td>' + minutes(s['idle']) + '</td><td>' + minutes(s['pause']) + '</td><td>' +
+                     minutes(s['wait']) + '</td></tr>\n')
+    handoffs = ''
+    for day in summary:
+        handoffs += ('<tr><td>' + str(day['day']) + '</td><td>' + minutes(day['critical_path']) + '</td><td>' +
+                     ', '.join(k + ': ' + minutes(v) for k, v in sorted(day['gaps'].items())) + '</td></tr>\n')
+    return ('<html><head><meta charset="utf-8"><title>Throughput</title></head><body>\n' +
+            '<h1>Lab throughput</h1><p>Generated ' + datetime.now().strftime('%Y-%m-%d %H:%M') + '</p>\n' +
+            '<h2>Stations</h2><table border="1">\n<tr><th>Day</th><th>Station</th><th>Runs</th>' +
+            '<th>Samples</th><th>Samples/hour</th><th>Utilisation</th><th>Idle between runs (min)</th>' +
+            '<th>Waiting at pauses (min)</th><th>Incubations and waits (min)</th></tr>\n' + rows + '</table>\n' +
+            '<h2>Runs</h2><table border="1">\n<tr><th>Day</th><th>Mean critical path (min)</th>' +
+            '<th>Mean handoff gaps (min)</th></tr>\n' + handoffs + '</table>\n</body></html>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lab throughput report from the run store')
+    parser.add_argument('--db', default=db_path)
+    parser.add_argument('--out', help='html file (default throughput.html next to the run store)')
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.db)), 'throughput.html')
+    since = (datetime.now() - timedelta(days=args.days)).isoformat()
+    summary = day_summary(station_runs(connect(args.db), since))
+    with open(out, 'w') as f:
+        f.write(render(summary))
+    print('Report with ' + str(len(summary)) + ' days written to ' + out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,6 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
 from datetime import datetime
@@ -38,6 +37,7 @@ elution_vol=50
 ic_vol = 10
 beads_vol = 20
 mag_height = 6.1
+temperature = 8  # Temperature of temp module (elution plate)
 
 x_offset_rs = 1 #Offset of the pickup when magnet is ON
 multi_well_rack_area = 8.2 * 71.2  # Cross section of the 12 well reservoir
@@ -288,6 +288,18 @@ def run(ctx: protocol_api.ProtocolContext):
             col_change = False
         return height, col_change
 
+    ##########
+    # temperature targets are set at the start and reached in the background;
+    # only the step that really needs the target waits for it
+    def start_temperature(module, celsius):
+        module.start_set_temperature(celsius)
+        ctx.comment('Temperature module set to ' + str(celsius) + 'ºC (not waiting)')
+
+    def wait_temperature(module, celsius):
+        ctx.comment('Waiting for temperature module to reach ' + str(celsius) + 'ºC')
+        module.await_temperature(celsius)
+    ##########
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
@@ -335,7 +347,7 @@ def run(ctx: protocol_api.ProtocolContext):
     # Elution Deepwell plate
     ############################################
     tempdeck = ctx.load_module('tempdeck', '3')
-    #tempdeck.set_temperature(temperature)
+    start_temperature(tempdeck, temperature) # cools while the extraction runs
     qpcr_plate = tempdeck.load_labware(
         'opentrons_96_aluminumblock_nest_wellplate_100ul',
         'chilled qPCR final plate')
@@ -941,6 +953,8 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
         ctx.comment('###############################################')
 
+        wait_temperature(tempdeck, temperature) # elution plate must be cold before transfer
+
         elut_vol_corrected = [x+20 for x in elut_vol] # take 20µl more than needed elution volume
         air_gap_vol_water = 0 # as we will take more volume than wanted an air_gap will be already generated
 
@@ -983,8 +997,6 @@ def run(ctx: protocol_api.ProtocolContext):
     ############################################################################
     # Light flash end of program
     if not ctx.is_simulating():
-        from opentrons.drivers.rpi_drivers import gpio
-
         for i in range(3):
             ctx._hw_manager.hardware.set_lights(rails=False)
             #ctx._hw_manager.hardware.set_button_light(1,0,0)
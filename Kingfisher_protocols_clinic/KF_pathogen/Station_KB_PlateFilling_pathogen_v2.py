@@ -3,7 +3,6 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
 from datetime import datetime
@@ -489,15 +488,16 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ############################################################################
     # Light flash end of program
-    from opentrons.drivers.rpi_drivers import gpio
-    for i in range(3):
-        gpio.set_rail_lights(False)
-        gpio.set_button_light(1, 0, 0)
-        time.sleep(0.3)
-        gpio.set_rail_lights(True)
-        gpio.set_button_light(0, 0, 1)
-        time.sleep(0.3)
-    gpio.set_button_light(0, 1, 0)
+    if not ctx.is_simulating():
+        from opentrons.drivers.rpi_drivers import gpio
+        for i in range(3):
+            gpio.set_rail_lights(False)
+            gpio.set_button_light(1, 0, 0)
+            time.sleep(0.3)
+            gpio.set_rail_lights(True)
+            gpio.set_button_light(0, 0, 1)
+            time.sleep(0.3)
+        gpio.set_button_light(0, 1, 0)
     ctx.comment(
         'Finished! \nMove deepwell plates to KingFisher extractor.')
     ctx.comment('Used tips in total: ' + str(tip_track['counts'][m300]))
@@ -3,7 +3,6 @@ from opentrons.types import Point
 from opentrons import protocol_api
 import time
 import os
-import numpy as np
 from timeit import default_timer as timer
 import json
 from datetime import datetime
@@ -42,7 +41,7 @@ diameter_screwcap = 8.25  # Diameter of the screwcap
 volume_cone = 50  # Volume in ul that fit in the screwcap cone
 
 # Calculated variables
-area_section_screwcap = (np.pi * diameter_screwcap**2) / 4
+area_section_screwcap = (math.pi * diameter_screwcap**2) / 4
 h_cone = (volume_cone * 3 / area_section_screwcap)
 screwcap_cross_section_area = math.pi * \
     diameter_screwcap**2 / 4  # screwcap cross secion area
@@ -53,7 +52,6 @@ num_cols = math.ceil(NUM_SAMPLES / 8)  # Columns we are working on
 
 # 'kf_96_wellplate_2400ul'
 def run(ctx: protocol_api.ProtocolContext):
-    from opentrons.drivers.rpi_drivers import gpio
     ctx.comment('Actual used columns: ' + str(num_cols))
 
     # Define the STEPS of the protocol
@@ -430,15 +428,17 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ############################################################################
     # Light flash end of program
-    gpio.set_rail_lights(False)
-    time.sleep(2)
-    #os.system('mpg123 -f -8000 /var/lib/jupyter/notebooks/toreador.mp3 &')
-    for i in range(3):
+    if not ctx.is_simulating():
+        from opentrons.drivers.rpi_drivers import gpio
         gpio.set_rail_lights(False)
-        gpio.set_button_light(1, 0, 0)
-        time.sleep(0.3)
-        gpio.set_rail_lights(True)
-        gpio.set_button_light(0, 0, 1)
-        time.sleep(0.3)
-    gpio.set_button_light(0, 1, 0)
+        time.sleep(2)
+        #os.system('mpg123 -f -8000 /var/lib/jupyter/notebooks/toreador.mp3 &')
+        for i in range(3):
+            gpio.set_rail_lights(False)
+            gpio.set_button_light(1, 0, 0)
+            time.sleep(0.3)
+            gpio.set_rail_lights(True)
+            gpio.set_button_light(0, 0, 1)
+            time.sleep(0.3)
+        gpio.set_button_light(0, 1, 0)
     ctx.comment('Finished! \nMove plate to KingFisher')
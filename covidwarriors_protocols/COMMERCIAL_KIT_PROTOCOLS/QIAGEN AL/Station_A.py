@@ -10,13 +10,13 @@ import csv
 
 # metadata
 metadata = {
-    'protocolName': 'Station A Template version for OMEGA type reactives',
+    'protocolName': 'Station A Template version for QIAGEN AL type reactives',
     'author': 'Aitor Gastaminza <gastaminza.aitor@gmail.com>, '
     'José Luis Villanueva (Hospital Clinic Barcelona) '
     '& Alex Gasulla <agasulla@gmail.com',
     'source': 'Hospital Clínic Barcelona',
     'apiLevel': '2.0',
-    'description': 'Protocol for sample setup (A) for OMEGA protocol'
+    'description': 'Protocol for sample setup (A) for QIAGEN AL protocol'
 }
 
 '''
@@ -31,34 +31,34 @@ air_gap_vol_ci = 2
 air_gap_vol_sample = 5
 run_id = '$run_id'
 
-TNA_VOLUME = 240 # TNA Volume to be added
-ISO_VOLUME = 280 # Isoproponaol volume to be added
-BEADS_VOLUME = 10 # Volume of beads to be added
-
-volume_control = TNA_VOLUME + ISO_VOLUME + BEADS_VOLUME # Volume of buffer to be added to each well
+volume_buffer = 530 # Volume of Lysis buffer to be added to each well
 volume_sample = 200 # Sample volume to place in deepwell
-height_control = 0.5 # height from which control is dispensed
+height_buffer = 0.5 # height from which the buffer is dispensed referred to TOP
+buffer_first = True # Add the buffer before the samples (True) or after them (False)
+buffer_tip_per_well = False # New tip for every well, otherwise one tip for the whole plate
+sample_mix_rounds = 2 # Mix rounds after dispensing each sample, 0 for none
 #temperature = 10
 x_offset = [0,0]
 
 #Screwcap variables
 diameter_sample = 8.25  # Diameter of the screwcap, it will change if samples come in 5ml tubes
-volume_cone = 50  # Volume in ul of the screwcap lower cone
 
-#falcon
-diameter_falcon = 27 # Diameter of the falcon containing the internal control or lysis buffer
-h_cone_falcon = 17.4
+#Buffer tube
+diameter_buffer = 27 # Diameter of the tube holding the Lysis buffer
+h_cone_buffer = 17.4 # Height of the lower cone of the tube
 
 # Calculated variables
 area_section_sample = (math.pi * diameter_sample**2) / 4 # It will change if samples come in 5ml tubes
-falcon_cross_section_area = math.pi * diameter_falcon**2 / 4  # falcon cross secion area, cross_section_area = 63.61
-v_cone_falcon = 1/3*h_cone_falcon * falcon_cross_section_area
+buffer_cross_section_area = math.pi * diameter_buffer**2 / 4 # buffer tube cross secion area
+v_cone_buffer = 1/3 * h_cone_buffer * buffer_cross_section_area
 
 def run(ctx: protocol_api.ProtocolContext):
     STEP = 0
+    step_order = ['buffer', 'samples'] if buffer_first == True else ['samples', 'buffer']
+    descriptions = {'buffer': 'Add Lysis buffer ('+str(volume_buffer)+'ul)',
+                    'samples': 'Add samples ('+str(volume_sample)+'ul)'}
     STEPS = {  # Dictionary with STEP activation, description and times
-        1: {'Execute': True, 'description': 'Add Lysis buffer ('+str(volume_control)+'ul)'},
-        2: {'Execute': True, 'description': 'Add samples ('+str(volume_sample)+'ul)'}
+        s + 1: {'Execute': True, 'description': descriptions[name]} for s, name in enumerate(step_order)
     }
     for s in STEPS:  # Create an empty wait_time
         if 'wait_time' not in STEPS[s]:
@@ -100,8 +100,8 @@ def run(ctx: protocol_api.ProtocolContext):
                      delay = 0,
                      reagent_reservoir_volume = 50000,
                      num_wells = 1,
-                     h_cono = (v_cone_falcon * 3 / falcon_cross_section_area),
-                     v_fondo = v_cone_falcon
+                     h_cono = h_cone_buffer,
+                     v_fondo = v_cone_buffer
                      )
 
     Samples = Reagent(name = 'Samples',
@@ -227,10 +227,47 @@ def run(ctx: protocol_api.ProtocolContext):
                 tip_track['counts'][pip] = 0
         pip.pick_up_tip()
 
+    ##########
+    # the two transfers of the station, run in the order of step_order
+    def add_buffer():
+        for d in destinations:
+            if not buffer_pipette.hw_pipette['has_tip']:
+                pick_up(buffer_pipette)
+            # Calculate pickup_height based on remaining volume and shape of container
+            [pickup_height, change_col] = calc_height(BUFFER, buffer_cross_section_area, volume_buffer)
+            move_vol_multichannel(buffer_pipette, reagent = BUFFER, source = BUFFER.reagent_reservoir,
+            dest = d, vol=volume_buffer, air_gap_vol = air_gap_vol_ci,
+            x_offset = x_offset, pickup_height = pickup_height, rinse = BUFFER.rinse,
+            disp_height = height_buffer, blow_out = True, touch_tip = True)
+
+            if buffer_tip_per_well == True:
+                #Drop tip and update counter
+                buffer_pipette.drop_tip()
+                tip_track['counts'][buffer_pipette] += 1
+            #Otherwise the tip is not contaminated and is kept for the next well
+
+    def add_samples():
+        for s, d in zip(sample_sources, destinations):
+            if not p1000.hw_pipette['has_tip']:
+                pick_up(p1000)
+            # Mix the sample BEFORE dispensing
+            #custom_mix(p1000, reagent = Samples, location = s, vol = volume_sample, rounds = 2, blow_out = True, mix_height = 15)
+            move_vol_multichannel(p1000, reagent=Samples, source=s, dest=d,
+            vol=volume_sample, air_gap_vol=air_gap_vol_sample, x_offset=x_offset,
+                               pickup_height=1, rinse=Samples.rinse, disp_height=-10,
+                               blow_out=True, touch_tip=True)
+            if sample_mix_rounds > 0:
+                # Mix the sample AFTER dispensing
+                custom_mix(p1000, reagent = Samples, location = d, vol = 800, rounds = sample_mix_rounds,
+                           blow_out = False, mix_height = 10, x_offset = x_offset)
+
+            p1000.drop_tip()
+            tip_track['counts'][p1000] += 1
+
     ####################################
     # load labware and modules
-    ####################################
 
+    ####################################
     # Load Sample racks
     if NUM_SAMPLES < 96:
         rack_num = math.ceil(NUM_SAMPLES / 24)
@@ -261,7 +298,7 @@ def run(ctx: protocol_api.ProtocolContext):
         #'cooled reagent tubes')
 
     reagents = ctx.load_labware('opentrons_6_tuberack_falcon_50ml_conical',
-                                     '7', 'Lysis buffer tuberack in Falcon tube')
+                                '7', 'Lysis buffer tuberack in Falcon tube')
 
     ####################################
     # Load tip_racks
@@ -283,6 +320,7 @@ def run(ctx: protocol_api.ProtocolContext):
     p20 = ctx.load_instrument(
         'p20_single_gen2', mount='right', tip_racks=tips20)
     p1000 = ctx.load_instrument('p1000_single_gen2', 'left', tip_racks=tips1000) # load P1000 pipette
+    buffer_pipette = p1000
 
     # used tip counter and set maximum tips available
     tip_track = {
@@ -291,72 +329,26 @@ def run(ctx: protocol_api.ProtocolContext):
     }
 
     ############################################################################
-    # STEP 1: Add TNA
-    ############################################################################
-    STEP += 1
-    if STEPS[STEP]['Execute'] == True:
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-
-        # Transfer parameters
-        start = datetime.now()
-        if not p1000.hw_pipette['has_tip']:
-            pick_up(p1000)
-        for d in destinations:
-            # Calculate pickup_height based on remaining volume and shape of container
-            [pickup_height, change_col] = calc_height(BUFFER, falcon_cross_section_area, volume_control)
-            move_vol_multichannel(p1000, reagent = BUFFER, source = BUFFER.reagent_reservoir,
-            dest = d, vol=volume_control, air_gap_vol = air_gap_vol_ci,
-            x_offset = x_offset, pickup_height = pickup_height, rinse = BUFFER.rinse,
-            disp_height = height_control, blow_out = True, touch_tip = True)
-
-            # Mix the sample AFTER dispensing using 15µl of volume
-            #custom_mix(p20, reagent = Control_I, location = d, vol = 15, rounds = 4, blow_out = True, mix_height = 15)
-
-            #Do not drop tip as it is not contaminated
-            #p1000.drop_tip()
-            #tip_track['counts'][p20]+=1
-
-        #Time statistics
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
-        ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
-
-    ############################################################################
-    # STEP 2: Add Samples
+    # STEPS: Add Lysis buffer and Add Samples, in the order of step_order
     ############################################################################
-    STEP += 1
-    if STEPS[STEP]['Execute'] == True:
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-
-        # Transfer parameters
-        start = datetime.now()
-        for s, d in zip(sample_sources, destinations):
-            if not p1000.hw_pipette['has_tip']:
-                pick_up(p1000)
-
-            # Mix the sample BEFORE dispensing
-            #custom_mix(p1000, reagent = Samples, location = s, vol = volume_sample, rounds = 2, blow_out = True, mix_height = 15)
-            move_vol_multichannel(p1000, reagent=Samples, source=s, dest=d,
-            vol=volume_sample, air_gap_vol=air_gap_vol_sample, x_offset=x_offset,
-                               pickup_height=1, rinse=Samples.rinse, disp_height=-10,
-                               blow_out=True, touch_tip=True)
-            # Mix the sample AFTER dispensing using 15µl of volume
-            custom_mix(p1000, reagent = Samples, location = d, vol = 800, rounds = 2, blow_out = False, mix_height = 10)
-
-            p1000.drop_tip()
-            tip_track['counts'][p1000] += 1
-
-        # Time statistics
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
-                    ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
+    for STEP in STEPS:
+        if STEPS[STEP]['Execute'] == True:
+            ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
+            ctx.comment('###############################################')
+
+            # Transfer parameters
+            start = datetime.now()
+            if step_order[STEP - 1] == 'buffer':
+                add_buffer()
+            else:
+                add_samples()
 
+            # Time statistics
+            end = datetime.now()
+            time_taken = (end - start)
+            ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
+                        ' took ' + str(time_taken))
+            STEPS[STEP]['Time:'] = str(time_taken)
 
     # Export the time log to a tsv file
     if not ctx.is_simulating():
@@ -377,17 +369,17 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ############################################################################
     # Light flash end of program
-    from opentrons.drivers.rpi_drivers import gpio
-    #if not ctx.is_simulating():
+    if not ctx.is_simulating():
+        from opentrons.drivers.rpi_drivers import gpio
         #os.system('mpg123 -f -14000 /var/lib/jupyter/notebooks/lionking.mp3')
-    for i in range(3):
-        gpio.set_rail_lights(False)
-        gpio.set_button_light(1, 0, 0)
-        time.sleep(0.3)
-        gpio.set_rail_lights(True)
-        gpio.set_button_light(0, 0, 1)
-        time.sleep(0.3)
-    gpio.set_button_light(0, 1, 0)
+        for i in range(3):
+            gpio.set_rail_lights(False)
+            gpio.set_button_light(1, 0, 0)
+            time.sleep(0.3)
+            gpio.set_rail_lights(True)
+            gpio.set_button_light(0, 0, 1)
+            time.sleep(0.3)
+        gpio.set_button_light(0, 1, 0)
     ctx.comment(
         'Finished! \nMove deepwell plate (slot 5) to Station B for extraction protocol')
     ctx.comment('Used p1000 tips in total: ' + str(tip_track['counts'][p1000]))
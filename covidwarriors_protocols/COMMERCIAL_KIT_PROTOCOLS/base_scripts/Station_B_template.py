@@ -0,0 +1,846 @@
+import math
+from opentrons.types import Point
+from opentrons import protocol_api
+import time
+import os
+from timeit import default_timer as timer
+import json
+from datetime import datetime
+import csv
+
+# metadata
+metadata = {
+    'protocolName': 'S2 Station B Version 4',
+    'author': 'Aitor Gastaminza <gastaminza.aitor@gmail.com>, '
+    'José Luis Villanueva (Hospital Clinic Barcelona) '
+    '& Alex Gasulla <agasulla@gmail.com',
+    'source': 'Hospital Clínic Barcelona & HU Vall Hebrón',
+    'apiLevel': '2.3', # from 2.2 on a returned (parked) tip is not picked up again as a fresh one
+    'description': 'Protocol for RNA extraction with the $kit_name kit'
+}
+
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+NUM_SAMPLES     = 8
+sample_volume   = $sample_volume   # Sample volume received in station A
+set_temp_on     = False # Do you want to start temperature module?
+temperature     = 23    # Set temperature. It will be uesed if set_temp_on is set to True
+recycle_tip     = False # Do you want to recycle tips? It shoud only be set True for testing
+park_tips       = True  # Reuse one parked tip per sample column for the supernatant removals
+wash_mix_in_place = False # Dispense the last wash trip at the mixing height and mix it there (to be validated)
+################################################
+
+#mag_height = 11 # Height needed for NUNC deepwell in magnetic deck
+mag_height = 14 # Height needed for NEST deepwell in magnetic deck
+
+L_deepwell = 8 # Deepwell lenght (NEST deepwell)
+#D_deepwell = 8.35 # Deepwell diameter (NUNC deepwell)
+multi_well_rack_area = 8 * 71 #Cross section of the 12 well reservoir
+deepwell_cross_section_area = L_deepwell ** 2 # deepwell square cross secion area
+supernatant_min_height = 1 # Height of the last supernatant pass, next to the pellet
+meniscus_submerge = 2 # Depth below the meniscus for the supernatant passes
+pellet_height = 5 # Below this height the tip moves away from the bead pellet
+mixing_height = $mixing_height # Height of the mixes in the reservoir and the deepwell plate
+wash_x_offset = $wash_x_offset # Lateral offset of the wash and water dispenses, away from the pellet
+air_gap_after_dispense = $air_gap_after_dispense # Air gap at the destination after every dispense
+max_samples = $max_samples # Samples whose reagents fit the reservoir columns of the kit layout
+
+num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
+
+def run(ctx: protocol_api.ProtocolContext):
+
+    #Change light to red
+    if not ctx.is_simulating():
+        from opentrons.drivers.rpi_drivers import gpio
+        gpio.set_button_light(1,0,0)
+
+    ctx.comment('Actual used columns: '+str(num_cols))
+    if NUM_SAMPLES > max_samples:
+        raise ValueError('The reservoir columns of the $kit_name layout hold the reagents of ' +
+                         str(max_samples) + ' samples at most, not ' + str(NUM_SAMPLES))
+    STEP = 0
+    STEPS = { #Dictionary with STEP activation, description, times and the step graph:
+            # 'after': steps that have to be finished before, 'resources': what the step uses,
+            # 'wait_time': seconds its resources stay held after the step (incubations),
+            # 'magnet': magnet position set by the step, 'action': pipetting of the step
+            1:{'Execute': False, 'description': 'Mix beads', 'after': [], 'resources': ['m300'], 'action': 'mix_beads'},# REMOVE
+            2:{'Execute': True, 'description': 'Transfer lysis', 'after': [1], 'resources': ['m300', 'deepwell'], 'action': 'transfer_lysis'},#
+            3:{'Execute': $lysis_incubation, 'description': 'Wait with magnet OFF', 'wait_time': $lysis_wait, 'after': [2], 'resources': ['deepwell']}, #300
+            4:{'Execute': True, 'description': 'Incubate wait with magnet ON', 'wait_time': 300, 'after': [3], 'resources': ['magdeck', 'deepwell'], 'magnet': 'engage'}, #300
+            5:{'Execute': True, 'description': 'Remove supernatant', 'after': [4], 'resources': ['m300', 'deepwell'], 'action': 'remove_lysis'},#
+            6:{'Execute': True, 'description': 'Switch off magnet', 'after': [5], 'resources': ['magdeck'], 'magnet': 'disengage'},#
+            7:{'Execute': True, 'description': 'Add VHB/WB1', 'after': [6], 'resources': ['m300', 'deepwell'], 'action': 'add_vhb'},#
+            8:{'Execute': True, 'description': 'Incubate wait with magnet ON', 'wait_time': 300, 'after': [7], 'resources': ['magdeck', 'deepwell'], 'magnet': 'engage'},#300
+            9:{'Execute': True, 'description': 'Remove supernatant', 'after': [8], 'resources': ['m300', 'deepwell'], 'action': 'remove_vhb'},#
+            10:{'Execute': True, 'description': 'Switch off magnet', 'after': [9], 'resources': ['magdeck'], 'magnet': 'disengage'},#
+            11:{'Execute': True, 'description': 'Add SPR/WB2', 'after': [10], 'resources': ['m300', 'deepwell'], 'action': 'add_spr'},#
+            12:{'Execute': True, 'description': 'Incubate wait with magnet ON', 'wait_time': 300, 'after': [11], 'resources': ['magdeck', 'deepwell'], 'magnet': 'engage'},#300
+            13:{'Execute': True, 'description': 'Remove supernatant', 'after': [12], 'resources': ['m300', 'deepwell'], 'action': 'remove_spr'},#
+            14:{'Execute': $second_wash2, 'description': 'Switch off magnet', 'after': [13], 'resources': ['magdeck'], 'magnet': 'disengage'},#
+            15:{'Execute': $second_wash2, 'description': 'Add SPR/WB2', 'after': [14], 'resources': ['m300', 'deepwell'], 'action': 'add_spr'},#
+            16:{'Execute': $second_wash2, 'description': 'Incubate wait with magnet ON', 'wait_time': 300, 'after': [15], 'resources': ['magdeck', 'deepwell'], 'magnet': 'engage'},#300
+            17:{'Execute': $second_wash2, 'description': 'Remove supernatant', 'after': [16], 'resources': ['m300', 'deepwell'], 'action': 'remove_spr'},#
+            18:{'Execute': True, 'description': 'Allow to dry', 'wait_time': $dry_wait, 'after': [17], 'resources': ['magdeck', 'deepwell']},#900
+            19:{'Execute': True, 'description': 'Switch off magnet', 'after': [18], 'resources': ['magdeck'], 'magnet': 'disengage'},#
+            20:{'Execute': True, 'description': 'Add water', 'after': [19], 'resources': ['m300', 'deepwell'], 'action': 'add_water'},#
+            21:{'Execute': True, 'description': 'Wait with magnet OFF', 'wait_time': 300, 'after': [20], 'resources': ['deepwell']},#600
+            22:{'Execute': True, 'description': 'Incubate wait with magnet ON', 'wait_time': 300, 'after': [21], 'resources': ['magdeck', 'deepwell'], 'magnet': 'engage'},#300
+            23:{'Execute': True, 'description': 'Transfer to final elution plate', 'after': [22], 'resources': ['m300', 'deepwell', 'elution_plate'], 'action': 'transfer_elution'},
+            }
+
+    # parked tips are dropped after the last supernatant removal that will be run
+    last_supernatant_step = max([s for s in STEPS if STEPS[s]['description'] == 'Remove supernatant'
+                                and STEPS[s]['Execute'] == True] + [0])
+
+    """if not ctx.is_simulating():
+        folder_path='/data/log_times/'
+        if not os.path.isdir(folder_path):
+            os.mkdir(folder_path)
+        file_path=folder_path+'/time_log.json'"""
+
+    #Define Reagents as objects with their properties
+    class Reagent:
+        def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, flow_rate_aspirate_mix, flow_rate_dispense_mix,
+        air_gap_vol_bottom, air_gap_vol_top, disposal_volume, rinse, max_volume_allowed, reagent_volume, reagent_reservoir_volume, num_wells, h_cono, v_fondo, tip_recycling = 'none',
+        mix_volume = 180, mix_rounds = 20, mix_height = mixing_height):
+            self.name = name
+            self.flow_rate_aspirate = flow_rate_aspirate
+            self.flow_rate_dispense = flow_rate_dispense
+            self.flow_rate_aspirate_mix = flow_rate_aspirate_mix
+            self.flow_rate_dispense_mix = flow_rate_dispense_mix
+            self.air_gap_vol_bottom = air_gap_vol_bottom
+            self.air_gap_vol_top = air_gap_vol_top
+            self.disposal_volume = disposal_volume
+            self.rinse = bool(rinse)
+            self.max_volume_allowed = max_volume_allowed
+            self.reagent_volume = reagent_volume
+            self.reagent_reservoir_volume = reagent_reservoir_volume
+            self.num_wells = num_wells
+            self.col = 0
+            self.vol_well = 0
+            self.h_cono = h_cono
+            self.v_cono = v_fondo
+            self.tip_recycling = tip_recycling
+            self.vol_well_original = reagent_reservoir_volume / num_wells
+            self.mix_volume = mix_volume # mix in the well after the reagent is added
+            self.mix_rounds = mix_rounds
+            self.mix_height = mix_height
+
+    #Reagents and their characteristics
+    Lysis = Reagent(name = 'Lysis',
+                    flow_rate_aspirate = $lysis_flow_rate_aspirate, # Original = 0.5
+                    flow_rate_dispense = $lysis_flow_rate_dispense, # Original = 1
+                    flow_rate_aspirate_mix = $lysis_flow_rate_aspirate_mix,
+                    flow_rate_dispense_mix = $lysis_flow_rate_dispense_mix,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = True,
+                    max_volume_allowed = 180,
+                    reagent_volume = $lysis_volume, # reagent volume needed per sample
+                    reagent_reservoir_volume =  (NUM_SAMPLES + 5) * $lysis_volume, #70000, #51648
+                    num_wells = math.ceil((NUM_SAMPLES + 5) * $lysis_volume / 13000), #num_Wells max is 4, 13000 is the reservoir max volume (eventhough reservoir allows 15000)
+                    h_cono = 1.95,
+                    v_fondo = 750, #1.95 * multi_well_rack_area / 2, #Prismatic
+                    tip_recycling = 'A1')
+
+    VHB = Reagent(name = 'VHB',
+                    flow_rate_aspirate = 3,
+                    flow_rate_dispense = 3,
+                    flow_rate_aspirate_mix = 15,
+                    flow_rate_dispense_mix = 25,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = True,
+                    max_volume_allowed = 180,
+                    reagent_volume = $wash1_volume,
+                    reagent_reservoir_volume = (NUM_SAMPLES + 5) * $wash1_volume, #60000, #38400
+                    num_wells = math.ceil((NUM_SAMPLES + 5) * $wash1_volume / 13000), #num_Wells max is 4
+                    h_cono = 1.95,
+                    v_fondo = 750, #1.95 * multi_well_rack_area / 2, #Prismatic
+                    tip_recycling = 'A1')
+
+    Beads_PK = Reagent(name = 'Magnetic beads+PK',
+                    flow_rate_aspirate = 1,
+                    flow_rate_dispense = 1.5,
+                    flow_rate_aspirate_mix = 1.5,
+                    flow_rate_dispense_mix = 5,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = True,
+                    max_volume_allowed = 180,
+                    reagent_volume = 500,
+                    reagent_reservoir_volume = NUM_SAMPLES * 500, #11920,
+                    num_wells = math.ceil((NUM_SAMPLES + 5) * 500 / 13000), #num_Wells max is 4,
+                    h_cono = 1.95,
+                    v_fondo = 750, #1.95 * multi_well_rack_area / 2, #Prismatic
+                    tip_recycling = 'A2')
+
+    SPR = Reagent(name = 'SPR',
+                    flow_rate_aspirate = 3, # Original = 1
+                    flow_rate_dispense = 3, # Original = 1
+                    flow_rate_aspirate_mix = 15,
+                    flow_rate_dispense_mix = 25,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = True,
+                    max_volume_allowed = 180,
+                    reagent_volume = $wash2_volume,
+                    reagent_reservoir_volume = (NUM_SAMPLES + 5) * $wash2_volume, #120000, #96000
+                    num_wells = math.ceil((NUM_SAMPLES + 5) * $wash2_volume / 13000), #num_Wells max is 4
+                    h_cono = 1.95,
+                    v_fondo = 750, #1.95 * multi_well_rack_area / 2, #Prismatic
+                    tip_recycling = 'A3')
+
+    Water = Reagent(name = 'Water',
+                    flow_rate_aspirate = 3,
+                    flow_rate_dispense = 3,
+                    flow_rate_aspirate_mix = 15,
+                    flow_rate_dispense_mix = 25,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = False,
+                    max_volume_allowed = 150,
+                    reagent_volume = 50,
+                    reagent_reservoir_volume = (NUM_SAMPLES + 5) * 50,
+                    num_wells = 1, #math.ceil((NUM_SAMPLES + 5) * 50 / 13000), #num_Wells max is 1
+                    h_cono = 1.95,
+                    v_fondo = 750) #1.95*multi_well_rack_area/2) #Prismatic
+
+    Elution = Reagent(name = 'Elution',
+                    flow_rate_aspirate = 3, # Original 0.5
+                    flow_rate_dispense = 3, # Original 1
+                    flow_rate_aspirate_mix = 15,
+                    flow_rate_dispense_mix = 25,
+                    air_gap_vol_bottom = 5,
+                    air_gap_vol_top = 0,
+                    disposal_volume = 1,
+                    rinse = False,
+                    max_volume_allowed = 150,
+                    reagent_volume = 50,
+                    reagent_reservoir_volume = (NUM_SAMPLES + 5) * 50, #14800,
+                    num_wells = num_cols, #num_cols comes from available columns
+                    h_cono = 4,
+                    v_fondo = 4 * math.pi * 4**3 / 3) #Sphere
+
+    Lysis.vol_well      = Lysis.vol_well_original
+    VHB.vol_well        = VHB.vol_well_original
+    #Beads_PK.vol_well = Beads_PK.vol_well_original
+    SPR.vol_well        = SPR.vol_well_original
+    Water.vol_well      = Water.vol_well_original
+    Elution.vol_well    = 350 # Arbitrary value
+
+    ctx.comment(' ')
+    ctx.comment('###############################################')
+    ctx.comment('VOLUMES FOR ' + str(NUM_SAMPLES) + ' SAMPLES')
+    ctx.comment(' ')
+    ctx.comment('Lysis: ' + str(Lysis.num_wells) + ' wells from well 1 in reservoir 1 with volume ' + str(Lysis.vol_well_original) + ' uL each one')
+    ctx.comment('WH1: ' + str(VHB.num_wells) + ' wells from well 5 in reservoir 1 with volume ' + str(VHB.vol_well_original) + ' uL each one')
+    ctx.comment('WH2: ' + str(SPR.num_wells) + ' wells from $spr_position with volume ' + str(SPR.vol_well_original) + ' uL each one')
+    ctx.comment('Water: ' + str(Water.num_wells) + ' wells from $water_position with volume ' + str(Water.vol_well_original) + ' uL each one')
+    ctx.comment('###############################################')
+    ctx.comment(' ')
+
+    ###################
+    #Custom functions
+    def custom_mix(pipet, reagent, location, vol, rounds, blow_out, mix_height, offset):
+        '''
+        Function for mix in the same location a certain number of rounds. Blow out optional. Offset
+        can set to 0 or a higher/lower value which indicates the lateral movement
+        '''
+        if mix_height == 0:
+            mix_height = 1
+        pipet.aspirate(1, location = location.bottom(z = mix_height), rate = reagent.flow_rate_aspirate_mix)
+        for _ in range(rounds):
+            pipet.aspirate(vol, location = location.bottom(z = mix_height), rate = reagent.flow_rate_aspirate_mix)
+            pipet.dispense(vol, location = $mix_dispense.move(Point(x = offset)), rate = reagent.flow_rate_dispense_mix)
+        pipet.dispense(1, location = location.bottom(z = mix_height), rate = reagent.flow_rate_dispense_mix)
+        if blow_out == True:
+            pipet.blow_out(location.top(z = -2)) # Blow out
+
+    def dispense_mix(pipet, reagent, dest, vol, offset):
+        '''
+        Dispenses [vol] at the mixing height of [reagent] in [dest] and mixes it
+        there before leaving the well, so the mix needs no second visit. The air
+        gap is dispensed above the liquid first. Used when wash_mix_in_place is
+        True; the mix aspirates and dispenses at the same offset from the pellet
+        '''
+        if reagent.air_gap_vol_bottom != 0:
+            pipet.dispense(reagent.air_gap_vol_bottom, dest.top(z = -5), rate = reagent.flow_rate_dispense)
+        depth = dest.bottom(z = reagent.mix_height).move(Point(x = offset))
+        pipet.dispense(vol, depth, rate = reagent.flow_rate_dispense)
+        for _ in range(reagent.mix_rounds):
+            pipet.aspirate(reagent.mix_volume, location = depth, rate = reagent.flow_rate_aspirate_mix)
+            pipet.dispense(reagent.mix_volume, location = depth, rate = reagent.flow_rate_dispense_mix)
+
+    def calc_height(reagent, cross_section_area, aspirate_volume):
+        nonlocal ctx
+        ctx.comment('Remaining volume ' + str(reagent.vol_well) +
+                    '< needed volume ' + str(aspirate_volume) + '?')
+        if reagent.vol_well < aspirate_volume:
+            ctx.comment('Next column should be picked')
+            ctx.comment('Previous to change: ' + str(reagent.col))
+            # column selector position; intialize to required number
+            reagent.col = reagent.col + 1
+            ctx.comment(str('After change: ' + str(reagent.col)))
+            reagent.vol_well = reagent.vol_well_original
+            ctx.comment('New volume:' + str(reagent.vol_well))
+            height = (reagent.vol_well - aspirate_volume - reagent.v_cono) / cross_section_area
+                    #- reagent.h_cono
+            reagent.vol_well = reagent.vol_well - aspirate_volume
+            ctx.comment('Remaining volume:' + str(reagent.vol_well))
+            if height < 5:
+                height = 1
+            col_change = True
+        else:
+            height = (reagent.vol_well - aspirate_volume - reagent.v_cono) / cross_section_area
+            reagent.vol_well = reagent.vol_well - aspirate_volume
+            ctx.comment('Calculated height is ' + str(height))
+            if height < 5:
+                height = 1
+            ctx.comment('Used height is ' + str(height))
+            col_change = False
+        return height, col_change
+
+    def move_vol_multi(pipet, reagent, source, dest, vol, x_offset_source, x_offset_dest, pickup_height, rinse, avoid_droplet, wait_time, blow_out,
+                       mix = False, mix_offset = 0):
+        # Rinse before aspirating
+        if rinse == True:
+            #pipet.aspirate(air_gap_vol_top, location = source.top(z = -5), rate = reagent.flow_rate_aspirate) #air gap
+            custom_mix(pipet, reagent, location = source, vol = vol, rounds = 20, blow_out = False, mix_height = mixing_height, offset = 0)
+            #pipet.dispense(air_gap_vol_top, location = source.top(z = -5), rate = reagent.flow_rate_dispense)
+
+        # SOURCE
+        if reagent.air_gap_vol_top != 0: #If there is air_gap_vol, switch pipette to slow speed
+            pipet.move_to(source.top(z = 0))
+            pipet.air_gap(reagent.air_gap_vol_top) #air gap
+            #pipet.aspirate(reagent.air_gap_vol_top, source.top(z = -5), rate = reagent.flow_rate_aspirate) #air gap
+
+        s = source.bottom(pickup_height).move(Point(x = x_offset_source))
+        pipet.aspirate(vol, s) # aspirate liquid
+
+        if reagent.air_gap_vol_bottom != 0: #If there is air_gap_vol, switch pipette to slow speed
+            pipet.move_to(source.top(z = 0))
+            pipet.air_gap(reagent.air_gap_vol_bottom) #air gap
+            #pipet.aspirate(air_gap_vol_bottom, source.top(z = -5), rate = reagent.flow_rate_aspirate) #air gap
+
+        if wait_time != 0:
+            ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
+
+        if avoid_droplet == True: # Touch the liquid surface to avoid droplets
+            ctx.comment("Moving to: " + str(pickup_height))
+            pipet.move_to(source.bottom(pickup_height))
+
+        # GO TO DESTINATION
+        if mix == True:
+            dispense_mix(pipet, reagent, dest, vol - reagent.disposal_volume, offset = x_offset_dest + mix_offset)
+        else:
+            d = dest.top(z = -5).move(Point(x = x_offset_dest))
+            pipet.dispense(vol - reagent.disposal_volume + reagent.air_gap_vol_bottom, d, rate = reagent.flow_rate_dispense)
+
+            if wait_time != 0:
+                ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
+
+        if reagent.air_gap_vol_top != 0:
+            pipet.dispense(reagent.air_gap_vol_top, dest.top(z = 0), rate = reagent.flow_rate_dispense)
+
+        if blow_out == True:
+            pipet.blow_out(dest.top(z = 0))
+
+        if air_gap_after_dispense == True and reagent.air_gap_vol_bottom != 0:
+            pipet.move_to(dest.top(z = 0))
+            pipet.air_gap(reagent.air_gap_vol_bottom) #air gap
+            #pipet.aspirate(air_gap_vol_bottom, dest.top(z = 0),rate = reagent.flow_rate_aspirate) #air gap
+
+    ##########
+    # temperature targets are set at the start and reached in the background;
+    # only the step that really needs the target waits for it
+    def start_temperature(module, celsius):
+        module.start_set_temperature(celsius)
+        ctx.comment('Temperature module set to ' + str(celsius) + 'ºC (not waiting)')
+
+    def wait_temperature(module, celsius):
+        ctx.comment('Waiting for temperature module to reach ' + str(celsius) + 'ºC')
+        module.await_temperature(celsius)
+    ##########
+
+    ##########
+    # pick up a fresh tip and if there is none left, prompt user for a new rack.
+    # Every fresh pick up is counted and the well it comes from is returned
+    def pick_up(pip):
+        nonlocal tip_track
+        #if not ctx.is_simulating():
+        if tip_track['counts'][pip] >= tip_track['maxes'][pip]:
+            ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
+            resuming.')
+            pip.reset_tipracks()
+            tip_track['counts'][pip] = 0
+            if len(parked_tips) > 0: # parked tips leave with the replaced racks
+                ctx.comment('Parked tips discarded with the tipracks: ' + str(len(parked_tips)))
+                parked_tips.clear()
+        for rack in pip.tip_racks:
+            tip = rack.next_tip(pip.channels)
+            if tip != None:
+                break
+        pip.pick_up_tip(tip)
+        tip_track['counts'][pip] += pip.channels
+        tip_track['total'][pip] += pip.channels
+        return tip
+
+    ##########
+    # tip parking: the tip that removes the supernatant of a sample column goes back to
+    # its rack position and is only picked up again for that same column in later washes
+    parked_tips = {}
+    park_track = {'parked': 0, 'reused': 0}
+
+    def pick_up_parked(pip, col):
+        if col in parked_tips:
+            pip.pick_up_tip(parked_tips[col])
+            park_track['reused'] += 1
+            ctx.comment('Column ' + str(col + 1) + ': reusing parked tip from ' + str(parked_tips[col]))
+        else:
+            parked_tips[col] = pick_up(pip)
+
+    def park_tip(pip, col):
+        pip.return_tip() # the returned tip stays out of the fresh tips (apiLevel 2.2)
+        park_track['parked'] += 1
+        ctx.comment('Column ' + str(col + 1) + ': tip parked in ' + str(parked_tips[col]))
+
+    def release_tip(pip, col):
+        pip.drop_tip(home_after = False)
+        if col in parked_tips:
+            del parked_tips[col]
+
+    ##########
+    def find_side(col):
+        if col%2 == 0:
+            side = -1 # left
+        else:
+            side = 1 # right
+        return side
+
+    ##########
+    # volume tracker of the deepwell columns; all the wells of a column hold the same volume
+    well_volume = [sample_volume] * num_cols
+
+    def plan_supernatant(col, max_volume, x_offset_rs, final_extra = 20):
+        '''
+        Plans the passes needed to empty a deepwell column from its tracked volume.
+        Every pass aspirates just below the meniscus it leaves behind, the last one at
+        the bottom taking up to final_extra uL more to make sure the well is empty.
+        The extra volume never adds a pass, it only fills the room the last pass has left.
+        Passes close to the bottom keep the tip away from the bead pellet (find_side).
+        Returns a list of [volume, pickup_height, x_offset_source]
+        '''
+        trips = max(1, math.ceil(well_volume[col] / max_volume))
+        trip_volume = well_volume[col] / trips
+        passes = []
+        for t in range(trips):
+            remaining = well_volume[col] - trip_volume * (t + 1)
+            height = remaining / deepwell_cross_section_area - meniscus_submerge
+            volume = trip_volume
+            if t == trips - 1:
+                volume = min(max_volume, trip_volume + final_extra)
+            if t == trips - 1 or height < supernatant_min_height:
+                height = supernatant_min_height
+            if height < pellet_height:
+                x_offset_source = find_side(col) * x_offset_rs
+            else:
+                x_offset_source = 0
+            passes.append([volume, round(height, 1), x_offset_source])
+        ctx.comment('Column ' + str(col + 1) + ' holds ' + str(well_volume[col]) +
+                    ' uL, removed in ' + str(trips) + ' passes')
+        well_volume[col] = 0
+        return passes
+
+    ##########
+    # step scheduler: every executed step of STEPS runs once the steps of its 'after' are
+    # finished and its resources are not held by the wait of a previous step. The waits
+    # do not block the robot, among the steps ready to run the first declared one whose
+    # resources are free goes first, and the robot is only delayed when none is.
+    # Every pipetting step of this station works on the deepwell plate, so the graph is
+    # a chain and no step overlaps the incubations; the waits only run concurrently with
+    # steps that declare other resources.
+    clock = {'delayed': 0} # seconds delayed while simulating, the delays do not take time then
+
+    def now():
+        return time.monotonic() + clock['delayed']
+
+    def finished(step, done):
+        if step not in STEPS:
+            return False
+        if STEPS[step]['Execute'] == False: # disabled steps are skipped, their dependents follow their 'after'
+            return all([finished(s, done) for s in STEPS[step]['after']])
+        return step in done
+
+    def wait_for(resources):
+        held_until = [held[r] for r in resources if r in held and held[r][0] > now()]
+        if len(held_until) > 0:
+            [release, holder] = max(held_until)
+            seconds = math.ceil(release - now())
+            ctx.delay(seconds = seconds, msg = 'Waiting ' + str(seconds) + ' seconds for step ' +
+                      str(holder) + ': ' + STEPS[holder]['description'])
+            if ctx.is_simulating():
+                clock['delayed'] += seconds
+
+    held = {} # resource: [time it is released, step that holds it]
+
+    def run_steps():
+        nonlocal STEP
+        done = []
+        pending = [s for s in sorted(STEPS) if STEPS[s]['Execute'] == True]
+        while len(pending) > 0:
+            ready = [s for s in pending if all([finished(a, done) for a in STEPS[s]['after']])]
+            if len(ready) == 0:
+                missing = sorted(set([a for s in pending for a in STEPS[s]['after'] if a not in STEPS]))
+                if len(missing) > 0:
+                    raise ValueError('Steps ' + str(pending) + ' wait for steps missing from STEPS: ' + str(missing))
+                raise ValueError('Steps ' + str(pending) + ' wait for each other in their \'after\'')
+            free = [s for s in ready if all([held.get(r, [0])[0] <= now() for r in STEPS[s]['resources']])]
+            STEP = (free + ready)[0]
+            wait_for(STEPS[STEP]['resources'])
+            start = datetime.now()
+            ctx.comment(' ')
+            ctx.comment('###############################################')
+            ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+            ctx.comment('###############################################')
+            ctx.comment(' ')
+            if STEPS[STEP].get('magnet') == 'engage':
+                magdeck.engage(height=mag_height)
+            elif STEPS[STEP].get('magnet') == 'disengage':
+                magdeck.disengage()
+            if 'action' in STEPS[STEP]:
+                actions[STEPS[STEP]['action']]()
+            if STEPS[STEP].get('wait_time', 0) > 0:
+                for r in STEPS[STEP]['resources']:
+                    held[r] = [now() + STEPS[STEP]['wait_time'], STEP]
+            end = datetime.now()
+            time_taken = (end - start)
+            ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
+            STEPS[STEP]['Time:']=str(time_taken)
+            ctx.comment('Used tips in total: '+ str(tip_track['total'][m300]))
+            done.append(STEP)
+            pending.remove(STEP)
+        wait_for(list(held)) # incubations still running at the end
+
+####################################
+    # load labware and modules
+    ######## 12 well rack
+    reagent_res = ctx.load_labware('nest_12_reservoir_15ml', '2','reagent deepwell plate 1')
+    reagent_res_2 = ctx.load_labware('nest_12_reservoir_15ml', '3','reagent deepwell plate 2')
+
+############################################
+    ########## tempdeck
+    tempdeck = ctx.load_module('tempdeck', '1')
+    if set_temp_on == True:
+        start_temperature(tempdeck, temperature) # cools while the extraction runs
+
+##################################
+    ####### Elution plate - final plate, goes to C
+    elution_plate = tempdeck.load_labware(
+        'biorad_96_alum',
+        'cooled elution plate')
+
+############################################
+    ######## Elution plate - comes from A
+    magdeck = ctx.load_module('magdeck', '4')
+    #deepwell_plate = magdeck.load_labware('nest_96_wellplate_2000ul', 'NEST 96 Deep Well Plate 2 mL') # Change to NEST deepwell plate
+    deepwell_plate = magdeck.load_labware('nest_96_wellplate_2000ul', 'NEST 96 Well Plate 2000 µL') # Change to NEST deepwell plate.
+    magdeck.disengage()
+
+####################################
+    ######## Waste reservoir
+    waste_reservoir = ctx.load_labware('nest_1_reservoir_195ml', '5', 'waste reservoir') # Change to our waste reservoir
+    waste = waste_reservoir.wells()[0] # referenced as reservoir
+
+####################################
+    ######### Load tip_racks
+    tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack')
+        for slot in ['6', '7', '8', '9', '10', '11']]
+    #tips1000 = [ctx.load_labware('opentrons_96_filtertiprack_1000ul', slot, '1000µl filter tiprack')
+    #    for slot in ['10']]
+
+###############################################################################
+    #Declare which reagents are in each reservoir as well as deepwell and elution plate
+    Lysis.reagent_reservoir = reagent_res.rows()[0][:4] # 4 columns
+    VHB.reagent_reservoir   = reagent_res.rows()[0][4:8]
+    SPR.reagent_reservoir   = $spr_reservoir
+    Water.reagent_reservoir = $water_reservoir
+    work_destinations       = deepwell_plate.rows()[0][:Elution.num_wells]
+    final_destinations      = elution_plate.rows()[0][:Elution.num_wells]
+
+    # pipettes. P1000 currently deactivated
+    m300 = ctx.load_instrument('p300_multi_gen2', 'left', tip_racks=tips300) # Load multi pipette
+    #p1000 = ctx.load_instrument('p1000_single_gen2', 'left', tip_racks=tips1000) # load P1000 pipette
+
+    #### used tip counter and set maximum tips available
+    tip_track = {
+        'counts': {m300: 0},
+        'maxes': {m300: 96 * len(m300.tip_racks)}, #96 tips per tiprack * number or tipracks in the layout
+        'total': {m300: 0} # fresh tips of the whole run, counts restarts with every tiprack replacement
+        }
+        #, p1000: len(tips1000)*96}
+
+###############################################################################
+
+    ###############################################################################
+    # STEP ACTIONS: pipetting of the steps of STEPS. The magnet, the waits, the order
+    # and the times of the steps are handled by run_steps
+    ########
+    def mix_beads():
+    ### PREMIX BEADS
+        if not m300.hw_pipette['has_tip']:
+            pick_up(m300) #These tips are reused in the first transfer of beads
+            ctx.comment(' ')
+            ctx.comment('Tip picked up')
+        ctx.comment(' ')
+        ctx.comment('Mixing '+ Beads.name)
+        ctx.comment(' ')
+        #Mixing
+        custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col], vol = 180,
+        rounds = 20, blow_out = False, mix_height = 0, offset = 0)
+        ctx.comment('Finished premixing!')
+        ctx.comment('Now, reagents will be transferred to deepwell plate.')
+        ctx.comment(' ')
+
+    def transfer_lysis():
+        # max_volume_allowed = 160 # Tips allow up to 200uL, but we only allow max_volume_allowed
+        lysis_trips = math.ceil(Lysis.reagent_volume / Lysis.max_volume_allowed)
+        lysis_volume = Lysis.reagent_volume / lysis_trips #136.66
+        lysis_transfer_vol = []
+        for i in range(lysis_trips):
+            lysis_transfer_vol.append(lysis_volume + Lysis.disposal_volume)
+        #ctx.comment(print(lysis_transfer_vol))
+        #lysis_transfer_vol = [lysis_volume + Lysis.disposal_volume, lysis_volume + Lysis.disposal_volume, lysis_volume + Lysis.disposal_volume] # Three rounds of 140 + disposal volume
+        x_offset_source = 0
+        x_offset_dest   = 0
+        rinse = True
+        for i in range(num_cols):
+            ctx.comment("Column: " + str(i))
+            if not m300.hw_pipette['has_tip']:
+                pick_up(m300)
+            for j,transfer_vol in enumerate(lysis_transfer_vol):
+                #Calculate pickup_height based on remaining volume and shape of container
+                [pickup_height, change_col] = calc_height(Lysis, multi_well_rack_area, transfer_vol * 8)
+
+                if change_col == True: #If we switch column because there is not enough volume left in current reservoir column we mix new column
+                    ctx.comment('Mixing new reservoir column: ' + str(Lysis.col))
+                    custom_mix(m300, Lysis, Lysis.reagent_reservoir[Lysis.col],
+                    vol = 180, rounds = 10, blow_out = False, mix_height = mixing_height, offset = 0)
+                ctx.comment('Aspirate from reservoir column: ' + str(Lysis.col))
+                ctx.comment('Pickup height is ' + str(pickup_height))
+                #if j!=0:
+                #    rinse = False
+                move_vol_multi(m300, reagent = Lysis, source = Lysis.reagent_reservoir[Lysis.col],
+                dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 2, blow_out = False)
+                well_volume[i] += transfer_vol - Lysis.disposal_volume
+                #m300.move_to(work_destinations[i].top(0))
+                #m300.air_gap(Lysis.air_gap_vol_bottom) #air gap
+            #m300.aspirate(air_gap_vol_bottom, work_destinations[i].top(10), rate = Lysis.flow_rate_aspirate) #air gap
+            #m300.dispense(disposal_volume + air_gap_vol_bottom, location = Lysis.reagent_reservoir[Lysis.col].top(0), rate = Lysis.flow_rate_dispense)
+            ctx.comment(' ')
+            ctx.comment('Mixing sample ')
+            custom_mix(m300, Lysis, location = work_destinations[i], vol = 180,
+            rounds = 20, blow_out = False, mix_height = mixing_height, offset = 0)
+            m300.move_to(work_destinations[i].top(0))
+            m300.air_gap(Lysis.air_gap_vol_bottom) #air gap
+            if recycle_tip == True:
+                m300.return_tip()
+            else:
+                m300.drop_tip(home_after = False)
+
+    def add_wash(reagent, mix_offset = 0):
+        #max_volume_allowed = 190 # Tips allow up to 200uL, but we only allow max_volume_allowed
+        wash_trips = math.ceil(reagent.reagent_volume / reagent.max_volume_allowed)
+        wash_volume = reagent.reagent_volume / wash_trips #136.66
+        wash_transfer_vol = []
+        for i in range(wash_trips):
+            wash_transfer_vol.append(wash_volume + reagent.disposal_volume)
+        #wash_volume = 166.66
+        #wash_wash_vol = [wash_volume + reagent.disposal_volume, wash_volume + reagent.disposal_volume, wash_volume + reagent.disposal_volume]
+        x_offset_rs = wash_x_offset
+        rinse = False # No rinse needed
+
+        ########
+        # washes
+        for i in range(num_cols):
+            x_offset_source = 0
+            x_offset_dest   = -1 * find_side(i) * x_offset_rs
+            if not m300.hw_pipette['has_tip']:
+                pick_up(m300)
+            for j, transfer_vol in enumerate(wash_transfer_vol):
+                #Calculate pickup_height based on remaining volume and shape of container
+                [pickup_height, change_col] = calc_height(reagent, multi_well_rack_area, transfer_vol*8)
+                ctx.comment('Aspirate from Reservoir column: ' + str(reagent.col))
+                ctx.comment('Pickup height is ' + str(pickup_height))
+                #if i!=0:
+                #    rinse = False
+                # with wash_mix_in_place the last trip dispenses at depth and mixes in place; the
+                # others dispense from the top so the tip goes back clean to the reservoir
+                move_vol_multi(m300, reagent = reagent, source = reagent.reagent_reservoir[reagent.col],
+                dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 2, blow_out = False,
+                mix = wash_mix_in_place == True and j == len(wash_transfer_vol) - 1, mix_offset = mix_offset)
+                well_volume[i] += transfer_vol - reagent.disposal_volume
+            if wash_mix_in_place == False: # validated mix: after the last dispense from the top and its wait
+                custom_mix(m300, reagent, location = work_destinations[i], vol = reagent.mix_volume,
+                    rounds = reagent.mix_rounds, blow_out = False, mix_height = reagent.mix_height, offset = x_offset_dest + mix_offset)
+                m300.move_to(work_destinations[i].top(0))
+                m300.air_gap(reagent.air_gap_vol_bottom) #air gap
+            if recycle_tip == True:
+                m300.return_tip()
+            else:
+                m300.drop_tip(home_after = False)
+
+    def remove_supernatant(reagent):
+        # remove supernatant -> passes are planned from the tracked volume of each column
+        x_offset_rs = 2
+
+        for i in range(num_cols):
+            x_offset_dest   = 0
+            if park_tips == True:
+                pick_up_parked(m300, i)
+            elif not m300.hw_pipette['has_tip']:
+                pick_up(m300)
+            for [transfer_vol, pickup_height, x_offset_source] in plan_supernatant(i, reagent.max_volume_allowed, x_offset_rs):
+                ctx.comment('Aspirate from deep well column: ' + str(i+1))
+                ctx.comment('Pickup height is ' + str(pickup_height))
+                move_vol_multi(m300, reagent = Elution, source = work_destinations[i],
+                dest = waste, vol = transfer_vol + Elution.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+                #m300.air_gap(Elution.air_gap_vol_bottom) #air gap
+            if park_tips == True and STEP < last_supernatant_step:
+                park_tip(m300, i)
+            elif park_tips == True:
+                release_tip(m300, i)
+            elif recycle_tip == True:
+                m300.return_tip()
+            else:
+                m300.drop_tip(home_after = False)
+
+    def add_water():
+        #Water elution
+        #max_volume_allowed = 190 # Tips allow up to 200uL, but we only allow max_volume_allowed
+        water_trips = math.ceil(Water.reagent_volume / Water.max_volume_allowed)
+        water_volume = Water.reagent_volume / water_trips
+        water_wash_vol = []
+        for i in range(water_trips):
+            water_wash_vol.append(water_volume + Elution.disposal_volume)
+        #water_wash_vol = [50 + Water.disposal_volume]
+        x_offset_rs = wash_x_offset
+
+        ########
+        # Water or elution buffer
+        for i in range(num_cols):
+            x_offset_source = 0
+            x_offset_dest   = -1 * find_side(i) * x_offset_rs # Original 0
+            if not m300.hw_pipette['has_tip']:
+                pick_up(m300)
+            for transfer_vol in water_wash_vol:
+                #Calculate pickup_height based on remaining volume and shape of container
+                [pickup_height, change_col] = calc_height(Water, multi_well_rack_area, transfer_vol*8)
+                ctx.comment('Aspirate from Reservoir column: ' + str(Water.col))
+                ctx.comment('Pickup height is ' + str(pickup_height))
+
+                move_vol_multi(m300, reagent = Water, source = Water.reagent_reservoir,
+                dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 0, blow_out = False)
+                well_volume[i] += transfer_vol - Water.disposal_volume
+
+                #m300.move_to(work_destinations[i].top(0))
+                #m300.air_gap(Water.air_gap_vol_bottom) #air gap
+                #m300.aspirate(air_gap_vol_bottom, work_destinations[i].top(10), rate = Water.flow_rate_aspirate) #air gap
+            ctx.comment(' ')
+            ctx.comment('Mixing sample with Water')
+            #Mixing
+            custom_mix(m300, Elution, work_destinations[i], vol = 40, rounds = 20,
+            blow_out = False, mix_height = mixing_height, offset = x_offset_dest)
+            m300.move_to(work_destinations[i].top(0))
+            m300.air_gap(Water.air_gap_vol_bottom) #air gap
+            if recycle_tip == True:
+                m300.return_tip()
+            else:
+                m300.drop_tip(home_after = False)
+
+    def transfer_elution():
+        if set_temp_on == True:
+            wait_temperature(tempdeck, temperature) # elution plate must be cold before transfer
+        #max_volume_allowed = 150 # Tips allow up to 200uL, but we only allow max_volume_allowed
+        elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
+        elution_volume = Elution.reagent_volume / elution_trips
+        elution_vol = []
+        for i in range(elution_trips):
+            elution_vol.append(elution_volume + Elution.disposal_volume)
+        #elution_vol =[50]
+        x_offset_rs = 2
+        for i in range(num_cols):
+            x_offset_source = find_side(i) * x_offset_rs
+            x_offset_dest   = find_side(i) * x_offset_rs
+            if not m300.hw_pipette['has_tip']:
+                pick_up(m300)
+            for transfer_vol in elution_vol:
+                #Pickup_height is fixed here
+                pickup_height = 1
+                ctx.comment('Aspirate from deep well column: ' + str(i+1))
+                ctx.comment('Pickup height is ' + str(pickup_height) +' (fixed)')
+
+                move_vol_multi(m300, reagent = Elution, source = work_destinations[i],
+                dest = final_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+
+                #m300.move_to(final_destinations[i].top(0))
+                #m300.air_gap(Elution.air_gap_vol_bottom) #air gap
+            if recycle_tip == True:
+                m300.return_tip()
+            else:
+                m300.drop_tip(home_after = False)
+
+    actions = {'mix_beads': mix_beads,
+               'transfer_lysis': transfer_lysis,
+               'remove_lysis': lambda: remove_supernatant(Lysis),
+               'add_vhb': lambda: add_wash(VHB, mix_offset = $vhb_mix_offset),
+               'remove_vhb': lambda: remove_supernatant(VHB),
+               'add_spr': lambda: add_wash(SPR),
+               'remove_spr': lambda: remove_supernatant(SPR),
+               'add_water': add_water,
+               'transfer_elution': transfer_elution}
+
+    run_steps()
+
+    '''if not ctx.is_simulating():
+        with open(file_path,'w') as outfile:
+            json.dump(STEPS, outfile)'''
+
+    ctx.comment(' ')
+    ctx.comment('###############################################')
+    ctx.comment('Homing robot')
+    ctx.comment('###############################################')
+    ctx.comment(' ')
+    ctx.home()
+    if $final_disengage == True:
+        magdeck.disengage()
+###############################################################################
+    # Light flash end of program
+    if not ctx.is_simulating():
+        from opentrons.drivers.rpi_drivers import gpio
+        #os.system('mpg123 /etc/audio/speaker-test.mp3')
+        for i in range(3):
+            gpio.set_rail_lights(False)
+            gpio.set_button_light(1,0,0)
+            time.sleep(0.3)
+            gpio.set_rail_lights(True)
+            gpio.set_button_light(0,0,1)
+            time.sleep(0.3)
+        gpio.set_button_light(0,1,0)
+    ctx.comment('Finished! \nMove deepwell plate (slot 5) to Station C for MMIX addition and PCR preparation.')
+    ctx.comment('Used tips in total: '+str(tip_track['total'][m300]))
+    ctx.comment('Used racks in total: '+str(tip_track['total'][m300]/96))
+    ctx.comment('Available tips: '+str(tip_track['maxes'][m300]))
+    if park_tips == True:
+        ctx.comment('Parked tips: '+str(park_track['parked'] * 8)+', fresh tips saved by reusing them: '+str(park_track['reused'] * 8))
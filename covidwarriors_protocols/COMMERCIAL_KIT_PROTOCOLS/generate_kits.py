@@ -0,0 +1,187 @@
+# Station A, B and C scripts of the commercial extraction kits, rendered from the
+# templates of base_scripts/ with the values of each kit in kits. The three
+# stations share one engine (the transfer, tip and timing code of the
+# templates), so the scripts of the kit folders are not edited by hand: change
+# the template or the kit and run this again.
+#
+#   python generate_kits.py                  # every kit
+#   python generate_kits.py MAGMAX OMEGA     # some kits
+#   python generate_kits.py --check          # exit 1 if a kit script is not its rendering
+
+import os
+import re
+import sys
+import argparse
+
+kits_path = os.path.dirname(os.path.abspath(__file__))
+templates_path = os.path.join(kits_path, 'base_scripts')
+stations = ['Station_A', 'Station_B', 'Station_C']
+
+# tubes holding the buffer of station A: [labware, label, diameter, height of the lower cone]
+tubes = {
+    'screwcap': ['opentrons_24_aluminumblock_generic_2ml_screwcap',
+                 'Bloque Aluminio opentrons 24 screwcaps 2000 µL', 8.25, 2.8], # 50 uL cone
+    'falcon': ['opentrons_6_tuberack_falcon_50ml_conical',
+               'Lysis buffer tuberack in Falcon tube', 27, 17.4],
+}
+
+# reservoirs of station B: [labware variable, reservoir number]
+reservoirs = {'reagent_res': 1, 'reagent_res_2': 2}
+reservoir_column_volume = 13000 # uL filled in a reservoir column (the column holds 15000)
+lysis_columns = 4 # reagent_res columns 1 to 4
+vhb_columns = 4 # reagent_res columns 5 to 8
+
+# where the mixes of station B dispense: near the top of the well or 5 mm above the mix height
+mix_dispenses = {'top': 'location.top(z = -5)', 'above': 'location.bottom(z = mix_height + 5)'}
+
+# kit folder: values of the kit; volumes in uL per sample and waits in seconds
+kits = {
+    'MAGMAX': {
+        'kit_name': 'MAGMAX',
+        # station A: samples first, then the internal control with a new p20 tip per well
+        'buffer_name': 'Internal Control', 'buffer_step': 'internal control',
+        'buffer_volume': 10, 'buffer_reservoir_volume': '10*NUM_SAMPLES*1.1',
+        'buffer_tube': 'screwcap', 'buffer_height': -20, 'buffer_first': False,
+        'buffer_pipette': 'p20', 'buffer_tip_per_well': True,
+        'station_a_sample_volume': 300, 'sample_mix_rounds': 0,
+        # station B: the lysis is very dense, it needs slow aspiration and dispensation
+        'sample_volume': 200, 'lysis_volume': 275, 'lysis_flow_rates': [1, 1, 1, 1],
+        'lysis_incubation': True, 'lysis_wait': 600,
+        'wash1_volume': 500, 'wash2_volume': 500, 'second_wash2': False, 'dry_wait': 300,
+        'spr_reservoir': ['reagent_res_2', 0, 8], 'water_reservoir': ['reagent_res', 11],
+        # station B mixing: heights in mm, the VHB mix dispenses 1 mm further from the pellet
+        'mixing_height': 3, 'mix_dispense': 'top', 'wash_x_offset': 2.5, 'vhb_mix_offset': -1,
+        'air_gap_after_dispense': True, 'final_disengage': False,
+    },
+    'OMEGA': {
+        'kit_name': 'OMEGA',
+        # station A: TNA 240 + isopropanol 280 + beads 10, one p1000 tip for the plate
+        'buffer_name': 'TNA+Beads+Isopropanol', 'buffer_step': 'Lysis buffer',
+        'buffer_volume': 530, 'buffer_reservoir_volume': 50000,
+        'buffer_tube': 'falcon', 'buffer_height': 0.5, 'buffer_first': True,
+        'buffer_pipette': 'p1000', 'buffer_tip_per_well': False,
+        'station_a_sample_volume': 200, 'sample_mix_rounds': 2,
+        'sample_volume': 200, 'lysis_volume': 530, 'lysis_flow_rates': [3, 3, 15, 25],
+        'lysis_incubation': True, 'lysis_wait': 900,
+        'wash1_volume': 350, 'wash2_volume': 350, 'second_wash2': True, 'dry_wait': 900,
+        'spr_reservoir': ['reagent_res_2', 0, 8], 'water_reservoir': ['reagent_res', 11],
+        'mixing_height': 1, 'mix_dispense': 'top', 'wash_x_offset': 2.5, 'vhb_mix_offset': 0,
+        'air_gap_after_dispense': False, 'final_disengage': True,
+    },
+    'QIAGEN AL': {
+        'kit_name': 'QIAGEN AL',
+        'buffer_name': 'TNA+Beads+Isopropanol', 'buffer_step': 'Lysis buffer',
+        'buffer_volume': 530, 'buffer_reservoir_volume': 50000,
+        'buffer_tube': 'falcon', 'buffer_height': 0.5, 'buffer_first': True,
+        'buffer_pipette': 'p1000', 'buffer_tip_per_well': False,
+        'station_a_sample_volume': 200, 'sample_mix_rounds': 2,
+        'sample_volume': 200, 'lysis_volume': 410, 'lysis_flow_rates': [3, 3, 15, 25],
+        'lysis_incubation': True, 'lysis_wait': 600,
+        'wash1_volume': 500, 'wash2_volume': 500, 'second_wash2': False, 'dry_wait': 900,
+        'spr_reservoir': ['reagent_res', 8, 12], 'water_reservoir': ['reagent_res_2', 0],
+        'mixing_height': 2, 'mix_dispense': 'above', 'wash_x_offset': 2, 'vhb_mix_offset': 0,
+        'air_gap_after_dispense': False, 'final_disengage': True,
+    },
+    'QIAGEN_RLT': {
+        'kit_name': 'QIAGEN RLT',
+        'buffer_name': 'TNA+Beads+Isopropanol', 'buffer_step': 'Lysis buffer',
+        'buffer_volume': 530, 'buffer_reservoir_volume': 50000,
+        'buffer_tube': 'falcon', 'buffer_height': 0.5, 'buffer_first': True,
+        'buffer_pipette': 'p1000', 'buffer_tip_per_well': False,
+        'station_a_sample_volume': 200, 'sample_mix_rounds': 2,
+        'sample_volume': 150, 'lysis_volume': 640, 'lysis_flow_rates': [3, 3, 15, 25],
+        'lysis_incubation': False, 'lysis_wait': 600,
+        'wash1_volume': 500, 'wash2_volume': 500, 'second_wash2': False, 'dry_wait': 900,
+        'spr_reservoir': ['reagent_res', 8, 12], 'water_reservoir': ['reagent_res_2', 0],
+        'mixing_height': 2, 'mix_dispense': 'above', 'wash_x_offset': 2, 'vhb_mix_offset': 0,
+        'air_gap_after_dispense': False, 'final_disengage': True,
+    },
+}
+
+
+def max_samples(kit):
+    '''
+    Samples of a station B run of [kit] whose lysis, VHB and SPR fit their
+    reservoir columns, (samples + 5) * volume per column of 13000 uL
+    '''
+    [res, first, last] = kit['spr_reservoir']
+    samples = 96
+    for volume, columns in [[kit['lysis_volume'], lysis_columns], [kit['wash1_volume'], vhb_columns],
+                            [kit['wash2_volume'], last - first]]:
+        samples = min(samples, columns * reservoir_column_volume // volume - 5)
+    return samples
+
+
+def placeholders(station, kit):
+    '''
+    {placeholder: text} of the template of [station] for the values of [kit]
+    '''
+    values = {'kit_name': kit['kit_name']}
+    if station == 'Station_A':
+        [labware, label, diameter, cone_height] = tubes[kit['buffer_tube']]
+        values.update({'buffer_labware': labware, 'buffer_label': label,
+                       'buffer_diameter': diameter, 'buffer_cone_height': cone_height,
+                       'sample_volume': kit['station_a_sample_volume']})
+        for key in ['buffer_name', 'buffer_step', 'buffer_volume', 'buffer_reservoir_volume',
+                    'buffer_height', 'buffer_first', 'buffer_pipette', 'buffer_tip_per_well',
+                    'sample_mix_rounds']:
+            values[key] = kit[key]
+    elif station == 'Station_B':
+        for key in ['sample_volume', 'lysis_volume', 'lysis_incubation', 'lysis_wait',
+                    'wash1_volume', 'wash2_volume', 'second_wash2', 'dry_wait', 'mixing_height',
+                    'wash_x_offset', 'vhb_mix_offset', 'air_gap_after_dispense', 'final_disengage']:
+            values[key] = kit[key]
+        values['mix_dispense'] = mix_dispenses[kit['mix_dispense']]
+        values['max_samples'] = max_samples(kit)
+        for name, rate in zip(['aspirate', 'dispense', 'aspirate_mix', 'dispense_mix'],
+                              kit['lysis_flow_rates']):
+            values['lysis_flow_rate_' + name] = rate
+        [res, first, last] = kit['spr_reservoir']
+        values['spr_reservoir'] = '%s.rows()[0][%d:%d]' % (res, first, last)
+        values['spr_position'] = 'well %d in reservoir %d' % (first + 1, reservoirs[res])
+        [res, well] = kit['water_reservoir']
+        values['water_reservoir'] = '%s.rows()[0][%d]' % (res, well)
+        values['water_position'] = 'well %d in reservoir %d' % (well + 1, reservoirs[res])
+    return {key: str(value) for key, value in values.items()}
+
+
+def render(station, kit):
+    '''
+    Script of [station] for [kit]; the placeholders that are not of the kit
+    ($technician, $run_id...) are left for the run generator
+    '''
+    with open(os.path.join(templates_path, station + '_template.py'), encoding='utf-8') as f:
+        template = f.read()
+    values = placeholders(station, kit)
+    return re.sub(r'\$(\w+)', lambda m: values.get(m.group(1), m.group(0)), template)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Station scripts of the commercial extraction kits')
+    parser.add_argument('kits', nargs='*', help='kit folders (all by default)')
+    parser.add_argument('--check', action='store_true', help='only check the scripts are up to date')
+    args = parser.parse_args()
+
+    stale = 0
+    for name in args.kits or sorted(kits):
+        for station in stations:
+            path = os.path.join(kits_path, name, station + '.py')
+            source = render(station, kits[name])
+            if args.check:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        ok = f.read() == source
+                except OSError:
+                    ok = False
+                stale += not ok
+                print('%-40s %s' % (os.path.join(name, station + '.py'), 'OK' if ok else 'STALE'))
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(source)
+                print('%-40s written' % os.path.join(name, station + '.py'))
+    return 1 if stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# Command stream of the offline simulation (protocol_timing.simulate) of a
+# rendered station script, stored next to it as <script>.commands.json. It is
+# not the analysis the OT-2 app makes of an uploaded protocol and does not
+# replace it. The stream is keyed by the hash of the script, its NUM_SAMPLES
+# and the versions (and content) of the custom labware it loads, so checking
+# that a shipped stream still belongs to its script only needs a hash of the
+# files, not a new simulation. The generator (input_file_tecnico) only builds
+# the streams with build_command_streams=True; otherwise run build by hand.
+#
+#   python command_cache.py build run_folder/scripts/*.py    # simulate and store
+#   python command_cache.py check run_folder/scripts/*.py    # exit 1 if a stream is stale
+
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+from labware_registry import labware_path, index
+from fake_context import set_constants
+from protocol_timing import simulate
+
+load_name_re = re.compile(r'''['"]([a-z0-9_]+)['"]''')
+num_samples_re = re.compile(r'^NUM_SAMPLES\s*=\s*(\d+)', re.M)
+
+
+def cache_path(path):
+    return path + '.commands.json'
+
+
+def cache_key(path, constants=None, labware_dirs=None):
+    '''
+    {'script': sha256, 'NUM_SAMPLES': n, 'labware': {load name: [version,
+    sha256 of the definition]}} of the script at [path] run with [constants]
+    '''
+    with open(path, encoding='utf-8') as f:
+        source = set_constants(f.read(), constants or {})
+    found = num_samples_re.search(source)
+    names = set(load_name_re.findall(source))
+    labware = {}
+    for folder in labware_dirs or [labware_path]:
+        for name, versions in index(folder).items():
+            if name in names and name not in labware:
+                definition = versions[max(versions)][1]
+                labware[name] = [max(versions), hashlib.sha256(
+                    json.dumps(definition, sort_keys=True).encode()).hexdigest()]
+    return {'script': hashlib.sha256(source.encode()).hexdigest(),
+            'NUM_SAMPLES': int(found.group(1)) if found else None, 'labware': labware}
+
+
+def load(path, constants=None, labware_dirs=None):
+    '''
+    Cached commands of the script at [path], or None when there are none or
+    they do not match the script, its constants or its labware
+    '''
+    try:
+        with open(cache_path(path), encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('key') != cache_key(path, constants, labware_dirs):
+        return None
+    return cached['commands']
+
+
+def store(path, commands, constants=None, labware_dirs=None):
+    '''
+    Saves the text and level of [commands] (the payloads hold live objects)
+    '''
+    with open(cache_path(path), 'w', encoding='utf-8') as f:
+        json.dump({'key': cache_key(path, constants, labware_dirs),
+                   'commands': [{'text': c['text'], 'level': c.get('level', 0)} for c in commands]},
+                  f, ensure_ascii=False)
+
+
+def cached_simulate(path, constants=None, labware_dirs=None):
+    '''
+    Commands of the script at [path] from its cache, simulating it (and
+    storing them) when the cache is stale
+    '''
+    commands = load(path, constants, labware_dirs)
+    if commands is None:
+        commands = simulate(path, labware_dirs, constants)
+        store(path, commands, constants, labware_dirs)
+    return commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cached command streams of the station scripts')
+    parser.add_argument('action', choices=['build', 'check'])
+    parser.add_argument('scripts', nargs='+')
+    args = parser.parse_args()
+
+    stale = 0
+    for script in args.scripts:
+        if args.action == 'build':
+            try:
+                print('%-70s %d commands' % (script, len(cached_simulate(script))))
+            except Exception as e:
+                print('%-70s FAILED %s' % (script, e))
+                stale += 1
+        else:
+            ok = load(script) is not None
+            stale += not ok
+            print('%-70s %s' % (script, 'OK' if ok else 'STALE'))
+    return 1 if stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# Compare the predicted step durations, tips and aspirated volumes of two
+# versions of a station script and flag the steps that got slower.
+#
+#   python compare_protocol_versions.py old_script.py new_script.py
+#   python compare_protocol_versions.py --rev HEAD~1 KingFisher_viral/KB_station_viral.py
+#
+# The exit status is 1 when a step regresses more than the threshold, so it
+# can be used as a check before a script goes to the robots.
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+from protocol_timing import simulate, step_summary
+
+
+def script_at_revision(rev, path):
+    '''
+    Writes the script as it was at git revision [rev] to a temporary file
+    '''
+    top = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'],
+                                  cwd=os.path.dirname(os.path.abspath(path))).decode().strip()
+    relative = os.path.relpath(os.path.abspath(path), top)
+    source = subprocess.check_output(['git', 'show', rev + ':' + relative], cwd=top)
+    f = tempfile.NamedTemporaryFile(suffix='_' + os.path.basename(path), delete=False)
+    f.write(source)
+    f.close()
+    return f.name
+
+
+def compare(old_steps, new_steps, threshold=0.05, min_seconds=30):
+    '''
+    Rows [step, description, old s, new s, old tips, new tips, old ul, new ul,
+    regression] matched by step number
+    '''
+    old = {s['step']: s for s in old_steps}
+    new = {s['step']: s for s in new_steps}
+    empty = {'description': '', 'seconds': 0, 'tips': 0, 'volume': 0}
+    rows = []
+    for step in sorted(set(old) | set(new)):
+        a, b = old.get(step, empty), new.get(step, empty)
+        slower = b['seconds'] - a['seconds']
+        regression = slower > min_seconds and slower > threshold * a['seconds'] or b['tips'] > a['tips']
+        rows.append([step, b['description'] or a['description'], a['seconds'], b['seconds'],
+                     a['tips'], b['tips'], a['volume'], b['volume'], regression])
+    return rows
+
+
+def print_rows(rows):
+    print('%4s  %-55s %9s %9s %7s %11s %13s' % ('STEP', 'description', 'old (s)', 'new (s)', 'diff', 'tips', 'volume (ul)'))
+    for [step, description, a, b, ta, tb, va, vb, regression] in rows:
+        print('%4d  %-55s %9.0f %9.0f %+7.0f %5d>%-5d %6.0f>%-6.0f%s' % (
+            step, description[:55], a, b, b - a, ta, tb, va, vb, '  <-- REGRESSION' if regression else ''))
+    a, b = sum(r[2] for r in rows), sum(r[3] for r in rows)
+    print('%4s  %-55s %9.0f %9.0f %+7.0f %5d>%-5d' % ('', 'TOTAL', a, b, b - a,
+                                                   sum(r[4] for r in rows), sum(r[5] for r in rows)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare step durations of two versions of a station script')
+    parser.add_argument('scripts', nargs='+', help='old and new script, or one script with --rev')
+    parser.add_argument('--rev', help='git revision of the old version of the script')
+    parser.add_argument('--threshold', type=float, default=0.05, help='relative slowdown flagged (default 5%%)')
+    parser.add_argument('--min_seconds', type=float, default=30, help='absolute slowdown flagged (default 30 s)')
+    args = parser.parse_args()
+
+    if args.rev:
+        old_path, new_path = script_at_revision(args.rev, args.scripts[0]), args.scripts[0]
+    elif len(args.scripts) == 2:
+        old_path, new_path = args.scripts
+    else:
+        parser.error('give two scripts or one script and --rev')
+    rows = compare(step_summary(simulate(old_path)), step_summary(simulate(new_path)),
+                   args.threshold, args.min_seconds)
+    print_rows(rows)
+    if args.rev:
+        os.remove(old_path)
+    return 1 if any(r[-1] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
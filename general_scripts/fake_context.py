@@ -0,0 +1,701 @@
+# Minimal stand-in for the opentrons ProtocolContext, so that the station
+# scripts run offline in milliseconds and without the opentrons package.
+# Labware is loaded from the CWarriors_labware JSONs (and a table of the
+# opentrons labware the scripts use), pipettes track tips and volume like the
+# robot does, and every command is recorded as {'text': ..., 'payload': ...}
+# with the same texts as the opentrons run log, so the output can be used by
+# protocol_timing, virtual_clock and liquid_tracker like a real simulation.
+#
+#   from fake_context import simulate
+#   commands = simulate('../KingFisher_viral/KB_station_viral.py', constants={'NUM_SAMPLES': 48})
+#
+# Only the part of the API used by the station scripts is implemented; the
+# geometry of the opentrons labware and the default flow rates (API 2.0 - 2.5)
+# are approximations. Tip tracking follows the apiLevel of the script: before
+# 2.2 a returned tip is available again and picking up a used tip fails.
+
+import re
+import sys
+import time
+import types
+import contextlib
+import collections
+
+from labware_registry import labware_path, lookup
+
+# slot origins of the OT-2 deck (mm)
+slot_origins = {str(n): ((n - 1) % 3 * 132.5, (n - 1) // 3 * 90.5, 0) for n in range(1, 13)}
+
+# model: channels, max volume, min volume, default flow rate (µl/s)
+pipette_models = {
+    'p20_single_gen2': [1, 20, 1, 3.78],
+    'p20_multi_gen2': [8, 20, 1, 3.78],
+    'p300_single_gen2': [1, 300, 20, 46.43],
+    'p300_multi_gen2': [8, 300, 20, 46.43],
+    'p1000_single_gen2': [1, 1000, 100, 137.35],
+    'p10_single': [1, 10, 1, 5],
+    'p10_multi': [8, 10, 1, 5],
+    'p50_single': [1, 50, 5, 25],
+    'p50_multi': [8, 50, 5, 25],
+    'p300_single': [1, 300, 30, 150],
+    'p300_multi': [8, 300, 30, 150],
+    'p1000_single': [1, 1000, 100, 500],
+}
+
+# module: display name, offset of its labware from the slot (mm)
+module_models = {
+    'magdeck': ['Magnetic Module GEN1', (0.125, -0.125, 82.25)],
+    'tempdeck': ['Temperature Module GEN1', (-0.15, -0.15, 80.09)],
+}
+
+# opentrons labware used by the station scripts: display name, rows, columns,
+# A1 x, A1 y, x pitch, y pitch, well bottom z, depth, volume, height, diameter
+# (circular wells) or [x, y] (rectangular wells), tip rack
+standard_labware = {
+    'opentrons_96_filtertiprack_20ul': ['Opentrons 96 Filter Tip Rack 20 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                        25.49, 39.2, 20, 64.69, 3.27, True],
+    'opentrons_96_filtertiprack_200ul': ['Opentrons 96 Filter Tip Rack 200 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                         5.39, 59.3, 200, 64.69, 5.59, True],
+    'opentrons_96_tiprack_300ul': ['Opentrons 96 Tip Rack 300 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                   5.39, 59.3, 300, 64.49, 5.23, True],
+    'opentrons_96_tiprack_20ul': ['Opentrons 96 Tip Rack 20 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                  25.49, 39.2, 20, 64.69, 3.27, True],
+    'opentrons_96_tiprack_10ul': ['Opentrons 96 Tip Rack 10 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                  25.49, 39.2, 10, 64.69, 3.27, True],
+    'opentrons_96_filtertiprack_1000ul': ['Opentrons 96 Filter Tip Rack 1000 µL', 8, 12, 14.38, 74.38, 9, 9,
+                                          9.47, 88, 1000, 97.47, 7.62, True],
+    'nest_12_reservoir_15ml': ['NEST 12 Well Reservoir 15 mL', 1, 12, 14.38, 42.78, 9, 0,
+                               4.55, 26.85, 15000, 31.4, [8.2, 71.2], False],
+    'nest_1_reservoir_195ml': ['NEST 1 Well Reservoir 195 mL', 1, 1, 63.88, 42.74, 0, 0,
+                               4.55, 25, 195000, 31.4, [106.8, 71.2], False],
+    'agilent_1_reservoir_290ml': ['Agilent 1 Well Reservoir 290 mL', 1, 1, 63.88, 42.74, 0, 0,
+                                  4.82, 39.22, 290000, 44.04, [108, 72], False],
+    'nest_96_wellplate_100ul_pcr_full_skirt': ['NEST 96 Well Plate 100 µL PCR Full Skirt', 8, 12, 14.38, 74.24, 9, 9,
+                                               0.92, 14.78, 100, 15.7, 5.34, False],
+    'opentrons_96_aluminumblock_nest_wellplate_100ul': ['Opentrons 96 Well Aluminum Block with NEST Well Plate 100 µL',
+                                                        8, 12, 14.38, 74.24, 9, 9,
+                                                        3.38, 14.78, 100, 18.16, 5.34, False],
+    'opentrons_24_aluminumblock_generic_2ml_screwcap': ['Opentrons 24 Well Aluminum Block with Generic 2 mL Screwcap',
+                                                        4, 6, 20.75, 68.63, 17.25, 17.25,
+                                                        6.7, 42, 2000, 48.7, 8.5, False],
+    'opentrons_24_tuberack_generic_2ml_screwcap': ['Opentrons 24 Tube Rack with Generic 2 mL Screwcap',
+                                                   4, 6, 18.21, 75.43, 19.89, 19.28,
+                                                   42.6, 42, 2000, 84.6, 8.5, False],
+    'opentrons_6_tuberack_falcon_50ml_conical': ['Opentrons 6 Tube Rack with Falcon 50 mL Conical', 2, 3, 35.5, 60.5, 35, 35,
+                                                 6.85, 112.85, 50000, 119.7, 26.45, False],
+    'opentrons_1_trash_1100ml_fixed': ['Opentrons Fixed Trash', 1, 1, 82.84, 80, 0, 0,
+                                       5.39, 77, 1100000, 82, [172.86, 165.86], False],
+}
+
+# command names of opentrons.commands.types
+command_names = ['COMMAND', 'ASPIRATE', 'DISPENSE', 'MIX', 'AIR_GAP', 'BLOW_OUT', 'TOUCH_TIP', 'PICK_UP_TIP',
+                 'DROP_TIP', 'RETURN_TIP', 'MOVE_TO', 'DELAY', 'PAUSE', 'RESUME', 'COMMENT', 'HOME',
+                 'MAGDECK_ENGAGE', 'MAGDECK_DISENGAGE', 'TEMPDECK_SET_TEMP', 'TEMPDECK_AWAIT_TEMP',
+                 'TEMPDECK_DEACTIVATE']
+
+
+class OutOfTipsError(Exception):
+    pass
+
+
+class Point(collections.namedtuple('Point', ['x', 'y', 'z'])):
+    def __new__(cls, x=0.0, y=0.0, z=0.0):
+        return super().__new__(cls, x, y, z)
+
+    def __add__(self, other):
+        return Point(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return Point(self.x - other.x, self.y - other.y, self.z - other.z)
+
+
+class Location(collections.namedtuple('Location', ['point', 'labware'])):
+    def move(self, point):
+        return Location(self.point + point, self.labware)
+
+    def __str__(self):
+        return str(self.labware)
+
+
+def grid_definition(load_name, display_name, rows, columns, a1_x, a1_y, pitch_x, pitch_y,
+                    z, depth, volume, height, size, tiprack):
+    '''
+    Labware definition (same schema as the CWarriors_labware JSONs) of a
+    regular grid of wells
+    '''
+    wells = {}
+    ordering = []
+    for c in range(columns):
+        ordering.append([])
+        for r in range(rows):
+            name = 'ABCDEFGHIJKLMNOP'[r] + str(c + 1)
+            well = {'depth': depth, 'totalLiquidVolume': volume, 'x': a1_x + c * pitch_x,
+                    'y': a1_y - r * pitch_y, 'z': z}
+            if isinstance(size, list):
+                well.update({'shape': 'rectangular', 'xDimension': size[0], 'yDimension': size[1]})
+            else:
+                well.update({'shape': 'circular', 'diameter': size})
+            wells[name] = well
+            ordering[-1].append(name)
+    return {'metadata': {'displayName': display_name}, 'dimensions': {'zDimension': height},
+            'parameters': {'loadName': load_name, 'isTiprack': tiprack, 'tipLength': depth},
+            'cornerOffsetFromSlot': {'x': 0, 'y': 0, 'z': 0}, 'ordering': ordering, 'wells': wells}
+
+
+def load_definition(load_name, labware_dirs=None):
+    '''
+    Definition of [load_name] from the labware folders (labware_registry), or
+    from the table of opentrons labware
+    '''
+    definition = lookup(load_name, labware_dirs=labware_dirs)
+    if definition is not None:
+        return definition
+    if load_name in standard_labware:
+        return grid_definition(load_name, *standard_labware[load_name])
+    raise KeyError('Unknown labware ' + load_name)
+
+
+class Well:
+    def __init__(self, name, geometry, parent):
+        self._name = name
+        self._geometry = geometry
+        self.parent = parent
+        self.has_tip = parent.is_tiprack
+        self.max_volume = geometry['totalLiquidVolume']
+        self.depth = geometry['depth']
+        self.diameter = geometry.get('diameter')
+        offset = parent._offset
+        self._bottom = Point(offset.x + geometry['x'], offset.y + geometry['y'], offset.z + geometry['z'])
+
+    @property
+    def well_name(self):
+        return self._name
+
+    def top(self, z=0.0):
+        return Location(self._bottom + Point(0, 0, self.depth + z), self)
+
+    def bottom(self, z=0.0):
+        return Location(self._bottom + Point(0, 0, z), self)
+
+    def center(self):
+        return Location(self._bottom + Point(0, 0, self.depth / 2), self)
+
+    def __repr__(self):
+        return self._name + ' of ' + str(self.parent)
+
+
+class Labware:
+    def __init__(self, definition, parent, offset, label=None, api_version=(2, 0)):
+        self._definition = definition
+        self._api_version = api_version
+        self.parent = parent
+        self._offset = offset + Point(**definition['cornerOffsetFromSlot'])
+        self.name = definition['parameters']['loadName']
+        self.load_name = self.name
+        self.is_tiprack = definition['parameters'].get('isTiprack', False)
+        self.tip_length = definition['parameters'].get('tipLength', 0)
+        self._display_name = (label or definition['metadata']['displayName']) + ' on ' + str(parent)
+        self._wells = {name: Well(name, geometry, self) for name, geometry in definition['wells'].items()}
+        self._columns = [[self._wells[name] for name in column] for column in definition['ordering']]
+        rows = sorted(set(name[0] for name in definition['wells']))
+        self._rows = [[w for column in self._columns for w in column if w._name[0] == row] for row in rows]
+
+    def wells(self, *names):
+        if names:
+            return [self._wells[name] for name in names]
+        return [w for column in self._columns for w in column]
+
+    def wells_by_name(self):
+        return dict(self._wells)
+
+    def rows(self):
+        return self._rows
+
+    def columns(self):
+        return self._columns
+
+    def rows_by_name(self):
+        return {row[0]._name[0]: row for row in self._rows}
+
+    def columns_by_name(self):
+        return {column[0]._name[1:]: column for column in self._columns}
+
+    def __getitem__(self, name):
+        return self._wells[name]
+
+    def top(self, z=0.0):
+        return self.wells()[0].top(z)
+
+    def bottom(self, z=0.0):
+        return self.wells()[0].bottom(z)
+
+    @property
+    def highest_z(self):
+        return self._offset.z + self._definition['dimensions']['zDimension']
+
+    def next_tip(self, num_tips=1):
+        '''
+        First well with [num_tips] tips available down its column
+        '''
+        for column in self._columns:
+            for i in range(len(column) - num_tips + 1):
+                if all(w.has_tip for w in column[i:i + num_tips]):
+                    return column[i]
+        return None
+
+    def _tips_from(self, start_well, num_channels):
+        column = next(c for c in self._columns if start_well in c)
+        i = column.index(start_well)
+        return column[i:i + num_channels]
+
+    def use_tips(self, start_well, num_channels=1):
+        wells = self._tips_from(start_well, num_channels)
+        # before API 2.2 picking up from a well without tips is an error
+        if self._api_version < (2, 2):
+            assert all(w.has_tip for w in wells), '{} is out of tips'.format(self)
+        for w in wells:
+            w.has_tip = False
+
+    def return_tips(self, start_well, num_channels=1):
+        wells = self._tips_from(start_well, num_channels)
+        assert not any(w.has_tip for w in wells), 'Cannot return tips to a tiprack that has tips'
+        for w in wells:
+            w.has_tip = True
+
+    def reset(self):
+        for w in self._wells.values():
+            w.has_tip = self.is_tiprack
+
+    def __repr__(self):
+        return self._display_name
+
+
+class FlowRates:
+    def __init__(self, rate):
+        self.aspirate = rate
+        self.dispense = rate
+        self.blow_out = rate
+
+
+class Clearances:
+    def __init__(self):
+        self.aspirate = 1.0
+        self.dispense = 1.0
+
+
+class InstrumentContext:
+    def __init__(self, ctx, model, mount, tip_racks):
+        [self.channels, self.max_volume, self.min_volume, rate] = pipette_models[model]
+        self._ctx = ctx
+        self.name = model
+        self.model = model
+        self.mount = mount
+        self.tip_racks = list(tip_racks or [])
+        self.type = 'multi' if self.channels > 1 else 'single'
+        self.flow_rate = FlowRates(rate)
+        self.well_bottom_clearance = Clearances()
+        self.starting_tip = None
+        self.default_speed = 400
+        self.current_volume = 0
+        self._has_tip = False
+        self._last_tip_picked_up_from = None
+        self._location = None
+
+    @property
+    def hw_pipette(self):
+        return {'has_tip': self._has_tip, 'channels': self.channels, 'max_volume': self.max_volume,
+                'current_volume': self.current_volume, 'name': self.name}
+
+    @property
+    def has_tip(self):
+        return self._has_tip
+
+    def _resolve(self, location, clearance):
+        if location is None:
+            if self._location is None:
+                raise RuntimeError('No previous location and no location given')
+            return self._location
+        if isinstance(location, Well):
+            return location.bottom(clearance)
+        if isinstance(location, Labware):
+            return location.wells()[0].top()
+        return location
+
+    def _publish(self, name, text, **payload):
+        payload.update({'instrument': self, 'text': text})
+        return self._ctx._publish(name, payload)
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        location = self._resolve(location, self.well_bottom_clearance.aspirate)
+        if not self._has_tip:
+            raise RuntimeError('Cannot aspirate without a tip attached')
+        if volume is None or volume == 0:
+            volume = self.max_volume - self.current_volume
+        assert self.current_volume + volume <= self.max_volume + 1e-9, \
+            'Cannot aspirate more than pipette max volume'
+        with self._publish('ASPIRATE', 'Aspirating {} uL from {} at {} uL/sec'.format(
+                float(volume), location, rate * self.flow_rate.aspirate),
+                volume=volume, location=location, rate=rate):
+            self._location = location
+            self.current_volume += volume
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0):
+        location = self._resolve(location, self.well_bottom_clearance.dispense)
+        if volume is None or volume == 0:
+            volume = self.current_volume
+        volume = min(volume, self.current_volume)
+        with self._publish('DISPENSE', 'Dispensing {} uL into {} at {} uL/sec'.format(
+                float(volume), location, rate * self.flow_rate.dispense),
+                volume=volume, location=location, rate=rate):
+            self._location = location
+            self.current_volume -= volume
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        volume = volume or self.max_volume
+        with self._publish('MIX', 'Mixing {} times with a volume of {} ul'.format(repetitions, float(volume)),
+                           volume=volume, location=location, repetitions=repetitions):
+            self.aspirate(volume, location, rate)
+            for _ in range(repetitions - 1):
+                self.dispense(volume, rate=rate)
+                self.aspirate(volume, rate=rate)
+            self.dispense(volume, rate=rate)
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        if self._location is None or not isinstance(self._location.labware, Well):
+            raise RuntimeError('No previous Well cached to perform air gap')
+        with self._publish('AIR_GAP', 'Air gap', volume=volume, height=height):
+            self.move_to(self._location.labware.top(5 if height is None else height))
+            self.aspirate(volume)
+        return self
+
+    def blow_out(self, location=None):
+        location = self._resolve(location.top() if isinstance(location, Well) else location, 0)
+        with self._publish('BLOW_OUT', 'Blowing out at {}'.format(location), location=location):
+            self._location = location
+            self.current_volume = 0
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        if not self._has_tip:
+            raise RuntimeError('Attempted to touch tip without a tip attached')
+        well = location if isinstance(location, Well) else self._location.labware
+        with self._publish('TOUCH_TIP', 'Touching tip', location=well.top(v_offset),
+                           radius=radius, v_offset=v_offset, speed=speed):
+            self._location = well.top(v_offset)
+        return self
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None, speed=None):
+        with self._publish('MOVE_TO', 'Moving to {}'.format(location), location=location):
+            self._location = location
+        return self
+
+    def pick_up_tip(self, location=None, presses=None, increment=None):
+        if location is None:
+            for rack in self.tip_racks:
+                location = rack.next_tip(self.channels)
+                if location is not None:
+                    break
+            else:
+                raise OutOfTipsError('No tips left in the tip racks of ' + str(self))
+        well = location if isinstance(location, Well) else location.labware
+        assert not self._has_tip, 'Tip already attached'
+        with self._publish('PICK_UP_TIP', 'Picking up tip from {}'.format(well), location=well):
+            well.parent.use_tips(well, self.channels)
+            self._location = well.top()
+            self._has_tip = True
+            self._last_tip_picked_up_from = well
+        return self
+
+    def drop_tip(self, location=None, home_after=True):
+        if location is None:
+            location = self._ctx.fixed_trash.wells()[0]
+        well = location if isinstance(location, Well) else location.labware
+        assert self._has_tip, 'Cannot drop tip without a tip attached'
+        with self._publish('DROP_TIP', 'Dropping tip into {}'.format(well), location=location):
+            self._location = well.top()
+            self._has_tip = False
+            self.current_volume = 0
+        return self
+
+    def return_tip(self, home_after=True):
+        well = self._last_tip_picked_up_from
+        if not self._has_tip or well is None:
+            raise RuntimeError('Pipette has no tip to return')
+        with self._publish('RETURN_TIP', 'Returning tip', location=well):
+            self.drop_tip(well, home_after)
+            # from API 2.2 on a returned tip stays used and is not picked up again by next_tip
+            if self._ctx.api_version < (2, 2):
+                well.parent.return_tips(well, self.channels)
+        return self
+
+    def reset_tipracks(self):
+        for rack in self.tip_racks:
+            rack.reset()
+
+    def home(self):
+        with self._publish('HOME', 'Homing pipette plunger on mount ' + self.mount):
+            self._location = None
+        return self
+
+    def __repr__(self):
+        return '{} on {} mount'.format(self.name, self.mount)
+
+
+class Module:
+    def __init__(self, ctx, model, slot):
+        [self._display_name, offset] = module_models[model]
+        self._ctx = ctx
+        self.model = model
+        self._slot = str(slot)
+        self._offset = Point(*slot_origins[self._slot]) + Point(*offset)
+        self.labware = None
+
+    def load_labware(self, load_name, label=None):
+        self.labware = self._ctx._labware(load_name, self, self._offset, label)
+        return self.labware
+
+    def _publish(self, name, text):
+        return self._ctx._publish(name, {'text': text, 'module': self})
+
+    def __str__(self):
+        return self._display_name + ' on ' + self._slot
+
+
+class MagneticModule(Module):
+    def __init__(self, ctx, model, slot):
+        super().__init__(ctx, model, slot)
+        self.status = 'disengaged'
+
+    def engage(self, height=None, offset=None, height_from_base=None):
+        with self._publish('MAGDECK_ENGAGE', 'Engaging Magnetic Module'):
+            self.status = 'engaged'
+
+    def disengage(self):
+        with self._publish('MAGDECK_DISENGAGE', 'Disengaging Magnetic Module'):
+            self.status = 'disengaged'
+
+
+class TemperatureModule(Module):
+    def __init__(self, ctx, model, slot):
+        super().__init__(ctx, model, slot)
+        self.target = None
+        self.temperature = 25
+        self.status = 'idle'
+
+    def set_temperature(self, celsius):
+        self.start_set_temperature(celsius)
+        self.await_temperature(celsius)
+
+    def start_set_temperature(self, celsius):
+        with self._publish('TEMPDECK_SET_TEMP', 'Setting Temperature Module temperature to {} °C '
+                           '(rounded off to nearest integer)'.format(round(celsius))):
+            self.target = celsius
+            self.status = 'holding at target'
+
+    def await_temperature(self, celsius):
+        with self._publish('TEMPDECK_AWAIT_TEMP', 'Waiting for Temperature Module to reach temperature {} °C '
+                           '(rounded off to nearest integer)'.format(round(celsius))):
+            self.temperature = celsius
+
+    def deactivate(self):
+        with self._publish('TEMPDECK_DEACTIVATE', 'Deactivating Temperature Module'):
+            self.target = None
+            self.status = 'idle'
+
+
+class Broker:
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, topic, handler):
+        self._subscribers.append(handler)
+        return lambda: self._subscribers.remove(handler)
+
+    def publish(self, topic, message):
+        for handler in list(self._subscribers):
+            handler(message)
+
+
+class Hardware:
+    '''
+    Lights and buttons of the robot, which do nothing offline
+    '''
+    def set_lights(self, button=None, rails=None):
+        pass
+
+    def set_button_light(self, red=False, green=False, blue=False):
+        pass
+
+
+class _Command:
+    '''
+    Records a command and sends its before / after messages to the broker
+    '''
+    def __init__(self, ctx, name, payload):
+        self._ctx = ctx
+        self._message = {'name': 'command.' + name, 'payload': payload}
+
+    def __enter__(self):
+        self._ctx.commands.append({'text': self._message['payload']['text'], 'payload': self._message['payload'],
+                                   'level': self._ctx._level})
+        self._ctx._level += 1
+        self._ctx.broker.publish('command', dict(self._message, **{'$': 'before'}))
+        return self
+
+    def __exit__(self, *error):
+        self._ctx._level -= 1
+        self._ctx.broker.publish('command', dict(self._message, **{'$': 'after', 'error': error[1]}))
+        return False
+
+
+class ProtocolContext:
+    def __init__(self, labware_dirs=None, api_version=(2, 0)):
+        self._labware_dirs = labware_dirs or [labware_path]
+        self.api_version = api_version
+        self._definitions = {}
+        self._level = 0
+        self.commands = []
+        self.broker = Broker()
+        self._hw_manager = types.SimpleNamespace(hardware=Hardware())
+        self.max_speeds = {}
+        self.loaded_instruments = {}
+        self.fixed_trash = self._labware('opentrons_1_trash_1100ml_fixed', '12', Point(*slot_origins['12']))
+
+    def _labware(self, load_name, parent, offset, label=None):
+        if load_name not in self._definitions:
+            self._definitions[load_name] = load_definition(load_name, self._labware_dirs)
+        return Labware(self._definitions[load_name], parent, offset, label, self.api_version)
+
+    def _publish(self, name, payload):
+        return _Command(self, name, payload)
+
+    def is_simulating(self):
+        return True
+
+    def load_labware(self, load_name, location, label=None, namespace=None, version=None):
+        return self._labware(load_name, str(location), Point(*slot_origins[str(location)]), label)
+
+    def load_labware_from_definition(self, labware_def, location, label=None):
+        return Labware(labware_def, str(location), Point(*slot_origins[str(location)]), label, self.api_version)
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, replace=False):
+        self.loaded_instruments[mount] = InstrumentContext(self, instrument_name, mount, tip_racks)
+        return self.loaded_instruments[mount]
+
+    def load_module(self, module_name, location=None, configuration=None):
+        model = 'magdeck' if 'mag' in module_name.lower() else 'tempdeck'
+        return (MagneticModule if model == 'magdeck' else TemperatureModule)(self, model, location)
+
+    def comment(self, msg):
+        with self._publish('COMMENT', {'text': msg}):
+            pass
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        total = minutes * 60 + seconds
+        text = 'Delaying for {} minutes and {} seconds'.format(int(total // 60), total % 60)
+        with self._publish('DELAY', {'text': text + ('. ' + msg if msg else ''),
+                                     'minutes': int(total // 60), 'seconds': total % 60}):
+            pass
+
+    def pause(self, msg=None):
+        with self._publish('PAUSE', {'text': 'Pausing robot operation' + (': ' + msg if msg else '')}):
+            pass
+
+    def resume(self):
+        pass
+
+    def home(self):
+        with self._publish('HOME', {'text': 'Homing'}):
+            pass
+
+
+def opentrons_modules():
+    '''
+    The opentrons modules imported by the station scripts, backed by this file
+    '''
+    modules = {name: types.ModuleType(name) for name in
+               ['opentrons', 'opentrons.protocol_api', 'opentrons.types', 'opentrons.commands',
+                'opentrons.commands.types', 'opentrons.drivers', 'opentrons.drivers.rpi_drivers',
+                'opentrons.drivers.rpi_drivers.gpio']}
+    for name, module in modules.items():
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(modules[parent], child, module)
+        module.__path__ = []
+    # gpio (buttons and lights) is only used on the robot; every call does nothing
+    modules['opentrons.drivers.rpi_drivers.gpio'].__getattr__ = lambda name: (lambda *args, **kwargs: None)
+    modules['opentrons.protocol_api'].ProtocolContext = ProtocolContext
+    modules['opentrons.protocol_api'].InstrumentContext = InstrumentContext
+    modules['opentrons.protocol_api'].Labware = Labware
+    modules['opentrons.protocol_api'].Well = Well
+    modules['opentrons.protocol_api'].MagneticModuleContext = MagneticModule
+    modules['opentrons.protocol_api'].TemperatureModuleContext = TemperatureModule
+    modules['opentrons.types'].Point = Point
+    modules['opentrons.types'].Location = Location
+    for name in command_names:
+        setattr(modules['opentrons.commands.types'], name, 'command' if name == 'COMMAND' else 'command.' + name)
+    return modules
+
+
+def set_constants(source, constants):
+    '''
+    Replaces the module level assignment of every constant in the script, so
+    the values derived from them (num_cols...) follow
+    '''
+    for name, value in constants.items():
+        source, found = re.subn(r'^' + re.escape(name) + r'\s*=.*$', name + ' = ' + repr(value), source,
+                                count=1, flags=re.M)
+        if not found:
+            raise KeyError(name + ' is not defined in the script')
+    return source
+
+
+@contextlib.contextmanager
+def opentrons_installed():
+    '''
+    Makes the opentrons modules of opentrons_modules() importable while it lasts
+    '''
+    modules = opentrons_modules()
+    saved = {name: sys.modules.get(name) for name in modules}
+    sys.modules.update(modules)
+    try:
+        yield
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def load_script(path, constants=None):
+    '''
+    Module level namespace of the station script at [path] (settings,
+    recipes and run) without running it
+    '''
+    with open(path) as f:
+        source = set_constants(f.read(), constants or {})
+    namespace = {'__name__': 'protocol', '__file__': path}
+    with opentrons_installed():
+        exec(compile(source, path, 'exec'), namespace)
+    if namespace.get('time') is time:
+        # the light blinking at the end of the scripts sleeps in real time
+        namespace['time'] = types.SimpleNamespace(**dict(vars(time), sleep=lambda seconds: None))
+    return namespace
+
+
+def simulate(path, constants=None, labware_dirs=None):
+    '''
+    Runs the station script at [path] on a fake ProtocolContext and returns
+    its commands as a list of {'text': ..., 'payload': ..., 'level': ...};
+    [constants] replace module level values such as NUM_SAMPLES
+    '''
+    namespace = load_script(path, constants)
+    api_level = namespace.get('metadata', {}).get('apiLevel', '2.0')
+    ctx = ProtocolContext(labware_dirs, tuple(int(n) for n in api_level.split('.')))
+    with opentrons_installed():
+        namespace['run'](ctx)
+    return ctx.commands
@@ -1,9 +1,8 @@
-import os
-import json
+import sys
 
-path=r'/Users/covid19warriors/Desktop/labware2'
+from labware_registry import labware_path, load_names
 
-for files in os.listdir(path):
-    with open(os.path.join(path,files)) as file:
-        a=json.load(file)
-        print(a['parameters']['loadName'])
+path = sys.argv[1] if len(sys.argv) > 1 else labware_path
+
+for name in load_names([path]):
+    print(name)
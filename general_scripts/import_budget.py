@@ -0,0 +1,130 @@
+# Import and analysis time of the station scripts, as the robot pays it when a
+# protocol is uploaded: every script is loaded in a fresh interpreter (so the
+# modules it imports are not cached yet), with the opentrons modules of
+# fake_context.py, and its run() is simulated. The times are scaled by
+# cpu_factor to a Raspberry Pi class CPU, and the exit status is 1 when a
+# script goes over the budget or imports a heavy module it does not need;
+# the scripts that can not be simulated offline are reported and skipped.
+#
+#   python import_budget.py                      # every station script
+#   python import_budget.py script.py --budget 1.5 --cpu-factor 8
+
+import os
+import sys
+import ast
+import json
+import glob
+import argparse
+import subprocess
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+cpu_factor = 8 # a Raspberry Pi 3 B+ (OT-2) against a desktop CPU, single thread
+budget = 1.0 # seconds of import + analysis on the robot
+heavy_modules = ['numpy', 'pandas', 'scipy', 'matplotlib']
+
+# skipped when looking for the station scripts
+skip_folders = ['eprecated', 'general_scripts', 'Automation', 'CWarriors_labware']
+
+# run in the fresh interpreter: prints the seconds of the module level code,
+# of run() and the modules imported by the script (-X importtime)
+probe = '''
+import sys, time, json
+sys.path.insert(0, %r)
+import fake_context
+sys.stderr.write('-- script --\\n')
+start = time.perf_counter()
+namespace = fake_context.load_script(%r)
+loaded = time.perf_counter()
+# the api level of the script decides how its tips are tracked (return_tip)
+api_level = namespace.get('metadata', {}).get('apiLevel', '2.0')
+ctx = fake_context.ProtocolContext(None, tuple(int(n) for n in api_level.split('.')))
+with fake_context.opentrons_installed():
+    namespace['run'](ctx)
+print(json.dumps([loaded - start, time.perf_counter() - loaded]))
+'''
+
+
+def station_scripts():
+    scripts = []
+    for path in sorted(glob.glob(os.path.join(repo_path, '**', '*.py'), recursive=True)):
+        if any(folder in path for folder in skip_folders):
+            continue
+        with open(path, encoding='utf-8', errors='replace') as f:
+            source = f.read()
+        if 'def run(' in source and 'apiLevel' in source:
+            try:
+                compile(source, path, 'exec')
+            except SyntaxError:
+                continue # templates of the generator ($num_samples...)
+            scripts.append(path)
+    return scripts
+
+
+def unused_imports(source):
+    '''
+    Module level imports of [source] whose name is never used
+    '''
+    tree = ast.parse(source)
+    imported = {}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                name = (alias.asname or alias.name).split('.')[0]
+                imported[name] = alias.name if isinstance(node, ast.Import) else node.module
+    used = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    return sorted(module for name, module in imported.items() if name not in used)
+
+
+def measure(path):
+    '''
+    [seconds of the module level code, seconds of run(), {module: seconds}]
+    of the script at [path], in a fresh interpreter
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             probe % (os.path.dirname(os.path.abspath(__file__)), path)],
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    [load, run] = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = {}
+    lines = result.stderr.split('-- script --\n', 1)[1].splitlines()
+    for line in lines:
+        if line.startswith('import time:') and '|' in line:
+            [_, cumulative, name] = line.split('|')
+            if not name.startswith('  ') and cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative) / 1e6
+    return [load, run, modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import and analysis time of the station scripts')
+    parser.add_argument('scripts', nargs='*', help='station scripts (all by default)')
+    parser.add_argument('--budget', type=float, default=budget, help='seconds on the robot')
+    parser.add_argument('--cpu-factor', type=float, default=cpu_factor)
+    args = parser.parse_args()
+
+    failed = 0
+    print('%-70s %9s %9s  %s' % ('script (seconds on the robot)', 'import', 'analysis', 'slowest imports'))
+    for path in args.scripts or station_scripts():
+        name = os.path.relpath(path, repo_path)
+        with open(path, encoding='utf-8') as f:
+            unused = [m for m in unused_imports(f.read()) if m.split('.')[0] in heavy_modules]
+        try:
+            [load, run, modules] = measure(path)
+        except Exception as e:
+            # the scripts that do not run offline are reported, not failed
+            print('%-70s SKIPPED %s' % (name[:70], e))
+            continue
+        load, run = load * args.cpu_factor, run * args.cpu_factor
+        slowest = sorted(modules.items(), key=lambda item: -item[1])[:3]
+        problems = (['OVER BUDGET'] if load + run > args.budget else []) + ['unused ' + m for m in unused]
+        failed += bool(problems)
+        print('%-70s %9.2f %9.2f  %s%s' % (name[:70], load, run,
+                                          ', '.join('%s %.2f' % (m, s * args.cpu_factor) for m, s in slowest),
+                                          '  <-- ' + ', '.join(problems) if problems else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# Volume <-> height of the liquid in the wells of every labware, derived from
+# its definition (CWarriors_labware JSONs, or the table of opentrons labware
+# of fake_context.py) instead of the cross sections and cone volumes entered by
+# hand in the station scripts (multi_well_rack_area, v_fondo, volume_cone...).
+#
+# A well is a prism (rectangular) or a cylinder (circular) over a bottom of
+# the shape in the wellBottomShape of its group:
+#   - 'flat': no bottom section
+#   - 'v':    a cone (circular wells) or a V groove along the well (rectangular
+#             wells, the reservoir columns)
+#   - 'u':    a spherical cap
+# The height of the bottom section is the one that makes the well hold its
+# totalLiquidVolume when filled to the depth, unless it was measured (see
+# bottom_heights).
+#
+#   python labware_geometry.py                       # every labware
+#   python labware_geometry.py nest_12_reservoir_15ml --volume 5000 --volume 700
+
+import sys
+import math
+import argparse
+import functools
+
+from fake_context import load_definition, standard_labware
+from labware_registry import load_names as custom_load_names
+
+# wellBottomShape of the opentrons labware, which fake_context.py does not store
+standard_bottoms = {
+    'nest_12_reservoir_15ml': 'v', 'nest_1_reservoir_195ml': 'v', 'agilent_1_reservoir_290ml': 'flat',
+    'nest_96_wellplate_100ul_pcr_full_skirt': 'v', 'opentrons_24_aluminumblock_generic_2ml_screwcap': 'v',
+    'opentrons_24_tuberack_generic_2ml_screwcap': 'v', 'opentrons_6_tuberack_falcon_50ml_conical': 'v',
+    'opentrons_1_trash_1100ml_fixed': 'flat',
+}
+
+# measured height of the bottom section (mm) of the labware whose nominal
+# volume is well below the volume to the brim: the 2 ml screwcaps have a 50 ul
+# cone (volume_cone in the station scripts)
+bottom_heights = {
+    'opentrons_24_aluminumblock_generic_2ml_screwcap': 2.8, 'opentrons_24_tuberack_generic_2ml_screwcap': 2.8,
+    'bloquealuminio_covidW_24_screwcaps_2000ul': 2.8, 'covidwarriors_aluminumblock_24_screwcap_2000ul': 2.8,
+    'alu_block': 2.8,
+}
+
+
+def bisect(function, target, low, high, iterations=60):
+    '''
+    x in [low, high] where the increasing [function] reaches [target]
+    '''
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        if function(middle) < target:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class WellGeometry:
+    def __init__(self, well, bottom='flat', bottom_height=None):
+        self.depth = well['depth']
+        if well['shape'] == 'circular':
+            self.area = math.pi * well['diameter']**2 / 4
+            self.width = well['diameter']
+        else:
+            self.area = well['xDimension'] * well['yDimension']
+            self.width = min(well['xDimension'], well['yDimension'])
+        if bottom == 'v':
+            bottom = 'cone' if well['shape'] == 'circular' else 'groove'
+        elif bottom == 'u':
+            bottom = 'cap'
+        self.bottom = bottom
+        self.nominal_volume = well['totalLiquidVolume']
+        if bottom == 'flat':
+            self.bottom_height = 0
+        elif bottom_height is not None:
+            self.bottom_height = bottom_height
+        else:
+            # the bottom takes away the difference between the prism and the
+            # nominal volume; at most as high as the well is wide
+            self.bottom_height = bisect(lambda h: self.area * h - self._bottom_volume(h, h),
+                                        self.area * self.depth - self.nominal_volume,
+                                        0, min(self.depth, self.width))
+
+    def _bottom_volume(self, height, bottom_height):
+        '''
+        Volume below [height] (mm) of a bottom section [bottom_height] high
+        '''
+        if bottom_height <= 0:
+            return 0
+        x = min(height, bottom_height)
+        if self.bottom == 'cone':
+            return self.area * x**3 / (3 * bottom_height**2)
+        if self.bottom == 'groove':
+            return self.area * x**2 / (2 * bottom_height)
+        # spherical cap through the rim of the well, scaled to its cross section
+        radius = self.width / 2
+        sphere = (radius**2 + bottom_height**2) / (2 * bottom_height)
+        return self.area / (math.pi * radius**2) * math.pi * x**2 * (3 * sphere - x) / 3
+
+    @property
+    def bottom_volume(self):
+        return self._bottom_volume(self.bottom_height, self.bottom_height)
+
+    @property
+    def max_volume(self):
+        return self.volume(self.depth)
+
+    def volume(self, height):
+        '''
+        µl in the well when the liquid is [height] mm over its bottom
+        '''
+        height = max(0, height)
+        return (self._bottom_volume(height, self.bottom_height)
+                + self.area * max(0, height - self.bottom_height))
+
+    def height(self, volume):
+        '''
+        Height (mm over the bottom of the well) of [volume] µl of liquid
+        '''
+        if volume <= 0:
+            return 0
+        if volume >= self.bottom_volume:
+            return self.bottom_height + (volume - self.bottom_volume) / self.area
+        return bisect(self.volume, volume, 0, self.bottom_height)
+
+
+def bottom_shape(definition, well):
+    for group in definition.get('groups', []):
+        if well in group.get('wells', []):
+            return group.get('metadata', {}).get('wellBottomShape', 'flat')
+    return standard_bottoms.get(definition['parameters']['loadName'], 'flat')
+
+
+@functools.lru_cache(maxsize=None)
+def geometry(load_name, well='A1', labware_dirs=None):
+    '''
+    WellGeometry of [well] of [load_name]; [labware_dirs] is a tuple of
+    folders with definitions (CWarriors_labware by default)
+    '''
+    definition = load_definition(load_name, list(labware_dirs) if labware_dirs else None)
+    return WellGeometry(definition['wells'][well], bottom_shape(definition, well), bottom_heights.get(load_name))
+
+
+def load_names(labware_dirs=None):
+    '''
+    Load names of the labware with wells (no tip racks)
+    '''
+    return (custom_load_names(labware_dirs, tipracks=False)
+            + [name for name, row in standard_labware.items() if not row[-1]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Volume <-> height of the wells of the labware')
+    parser.add_argument('load_names', nargs='*', help='labware (all by default)')
+    parser.add_argument('--volume', type=float, action='append', default=[], help='print the height of this volume')
+    args = parser.parse_args()
+
+    print('%-48s %-7s %9s %7s %8s %9s %10s%s' % ('labware', 'bottom', 'area mm2', 'h bott', 'v bott', 'nominal',
+                                                 'to brim', ''.join(' %10s' % ('h(%g)' % v) for v in args.volume)))
+    for name in args.load_names or load_names():
+        g = geometry(name)
+        print('%-48s %-7s %9.2f %7.2f %8.1f %9.0f %10.0f%s' % (
+            name[:48], g.bottom, g.area, g.bottom_height, g.bottom_volume, g.nominal_volume, g.max_volume,
+            ''.join(' %10.2f' % g.height(v) for v in args.volume)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Index of the custom labware definitions by loadName and version. The parsed
+# and validated definitions of a folder are kept in a pickled bundle next to
+# this script, which is used while no json of the folder has changed (same
+# names, sizes and modification times), so the simulations and the geometry
+# model do not read and parse every json again.
+#
+#   python labware_registry.py [folder ...]     # load names, versions and files
+
+import os
+import sys
+import glob
+import json
+import pickle
+import argparse
+
+labware_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CWarriors_labware')
+bundle_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labware_registry.pickle')
+
+# folder: [signature, {load name: {version: [file name, definition]}}]
+_indexes = {}
+
+
+class LabwareDefinitionError(Exception):
+    pass
+
+
+def validate(definition, filename):
+    '''
+    Raises LabwareDefinitionError when [definition] lacks what the
+    simulations and the geometry model read
+    '''
+    try:
+        definition['parameters']['loadName']
+        definition['metadata']['displayName']
+        definition['dimensions']['zDimension']
+        wells = definition['wells']
+        for column in definition['ordering']:
+            for name in column:
+                well = wells[name]
+                for key in ('depth', 'totalLiquidVolume', 'x', 'y', 'z', 'shape'):
+                    well[key]
+                if well['shape'] == 'circular':
+                    well['diameter']
+                else:
+                    well['xDimension'], well['yDimension']
+    except (KeyError, TypeError) as e:
+        raise LabwareDefinitionError(filename + ': missing ' + str(e))
+
+
+def signature(folder):
+    '''
+    (file name, size, modification time) of every json of [folder]
+    '''
+    files = []
+    for path in sorted(glob.glob(os.path.join(folder, '*.json'))):
+        stat = os.stat(path)
+        files.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
+
+
+def build(folder):
+    '''
+    {load name: {version: [file name, definition]}} of the jsons of [folder]
+    '''
+    index = {}
+    for path in sorted(glob.glob(os.path.join(folder, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            definition = json.load(f)
+        validate(definition, os.path.basename(path))
+        index.setdefault(definition['parameters']['loadName'], {})[definition.get('version', 1)] = [
+            os.path.basename(path), definition]
+    return index
+
+
+def _load_bundle():
+    try:
+        with open(bundle_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def index(folder=labware_path):
+    '''
+    Index of [folder], from memory, the bundle or the jsons (and then saved
+    in the bundle), whichever is up to date first
+    '''
+    folder = os.path.abspath(folder)
+    current = signature(folder)
+    if folder in _indexes and _indexes[folder][0] == current:
+        return _indexes[folder][1]
+    bundle = _load_bundle()
+    if folder not in bundle or bundle[folder][0] != current:
+        bundle[folder] = [current, build(folder)]
+        try:
+            with open(bundle_path + '.tmp', 'wb') as f:
+                pickle.dump(bundle, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(bundle_path + '.tmp', bundle_path)
+        except OSError:
+            pass # read only checkout, the index is still kept in memory
+    _indexes[folder] = bundle[folder]
+    return bundle[folder][1]
+
+
+def lookup(load_name, version=None, labware_dirs=None):
+    '''
+    Definition of [load_name] ([version], or the latest one) in the first of
+    [labware_dirs] that has it, or None
+    '''
+    for folder in labware_dirs or [labware_path]:
+        versions = index(folder).get(load_name)
+        if versions:
+            return versions[version if version is not None else max(versions)][1]
+    return None
+
+
+def load_names(labware_dirs=None, tipracks=True):
+    names = []
+    for folder in labware_dirs or [labware_path]:
+        for name, versions in sorted(index(folder).items()):
+            if tipracks or not versions[max(versions)][1]['parameters'].get('isTiprack'):
+                names.append(name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load names of the custom labware definitions')
+    parser.add_argument('folders', nargs='*', help='labware folders (CWarriors_labware by default)')
+    args = parser.parse_args()
+
+    for folder in args.folders or [labware_path]:
+        for name, versions in sorted(index(folder).items()):
+            for version, [filename, definition] in sorted(versions.items()):
+                print('%-60s v%-3s %s' % (name, version, filename))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
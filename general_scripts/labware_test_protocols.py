@@ -0,0 +1,222 @@
+# Calibration protocols for every custom labware definition, like the test_*.py
+# of CWarriors_labware (written with the Labware Creator for a few of them).
+# Each protocol checks the calibration crosses, then visits the corner wells
+# of the labware: the top at TOP_OFFSET, the four edges and the bottom at
+# BOTTOM_OFFSET, pausing at every position, and comments the time spent in
+# each well.
+#
+# The definitions are checked before writing (wells outside the labware,
+# deeper than it or holding more than their cylinder / prism), and with
+# --simulate every protocol is also simulated (offline without opentrons), so
+# the whole folder can be validated in one go.
+#
+#   python labware_test_protocols.py [--out folder] [--simulate] [load names...]
+
+import os
+import sys
+import json
+import argparse
+
+from labware_registry import labware_path, index
+from labware_geometry import WellGeometry
+from protocol_timing import simulate, command_cost, move_time
+
+pipettes = {'p20_single_gen2': 'opentrons_96_filtertiprack_20ul',
+            'p300_single_gen2': 'opentrons_96_filtertiprack_200ul'}
+
+template = '''import json
+import time
+from opentrons import protocol_api, types
+
+CALIBRATION_CROSS_COORDS = {
+    '1': {'x': 12.13, 'y': 9.0, 'z': 0.0},
+    '3': {'x': 380.87, 'y': 9.0, 'z': 0.0},
+    '7': {'x': 12.13, 'y': 258.0, 'z': 0.0}
+}
+CALIBRATION_CROSS_SLOTS = ['1', '3', '7']
+TEST_LABWARE_SLOT = '3'
+
+RATE = 0.25  # % of default speeds
+SLOWER_RATE = 0.1
+
+TOP_OFFSET = $top_offset  # mm over the top of the wells
+BOTTOM_OFFSET = $bottom_offset  # mm over the bottom of the wells
+EDGE_MARGIN = 0.5  # mm inside the walls of the wells
+
+PIPETTE_MOUNT = 'right'
+PIPETTE_NAME = '$pipette'
+
+TIPRACK_SLOT = '5'
+TIPRACK_LOADNAME = '$tiprack'
+
+LABWARE_DEF_JSON = r"""$definition"""
+LABWARE_DEF = json.loads(LABWARE_DEF_JSON)
+LABWARE_LABEL = LABWARE_DEF.get('metadata', {}).get(
+    'displayName', 'test labware')
+
+metadata = {'apiLevel': '2.0'}
+
+
+def uniq(l):
+    res = []
+    for i in l:
+        if i not in res:
+            res.append(i)
+    return res
+
+def run(protocol: protocol_api.ProtocolContext):
+    tiprack = protocol.load_labware(TIPRACK_LOADNAME, TIPRACK_SLOT)
+    pipette = protocol.load_instrument(
+        PIPETTE_NAME, PIPETTE_MOUNT, tip_racks=[tiprack])
+
+    test_labware = protocol.load_labware_from_definition(
+        LABWARE_DEF,
+        TEST_LABWARE_SLOT,
+        LABWARE_LABEL,
+    )
+
+    ordering = LABWARE_DEF['ordering']
+    well_locs = uniq([
+        ordering[0][0], ordering[0][-1], ordering[-1][0], ordering[-1][-1]])
+
+    pipette.pick_up_tip()
+
+    def set_speeds(rate):
+        protocol.max_speeds.update({
+            'X': (600 * rate),
+            'Y': (400 * rate),
+            'Z': (125 * rate),
+            'A': (125 * rate),
+        })
+
+        speed_max = max(protocol.max_speeds.values())
+
+        for instr in protocol.loaded_instruments.values():
+            instr.default_speed = speed_max
+
+    set_speeds(RATE)
+
+    for slot in CALIBRATION_CROSS_SLOTS:
+        coordinate = CALIBRATION_CROSS_COORDS[slot]
+        location = types.Location(point=types.Point(**coordinate),
+                                  labware=None)
+        pipette.move_to(location)
+        protocol.pause(
+            f"Confirm {PIPETTE_MOUNT} pipette is at slot {slot} calibration cross")
+
+    pipette.home()
+    protocol.pause(f"Place your labware in Slot {TEST_LABWARE_SLOT}")
+
+    start = time.monotonic()
+    for well_loc in well_locs:
+        well_start = time.monotonic()
+        well = test_labware.wells_by_name()[well_loc]
+        geometry = LABWARE_DEF['wells'][well_loc]
+        if geometry['shape'] == 'circular':
+            half_x = half_y = geometry['diameter'] / 2
+        else:
+            half_x, half_y = geometry['xDimension'] / 2, geometry['yDimension'] / 2
+        top = well.top(TOP_OFFSET)
+        all_4_edges = [
+            [top.move(types.Point(x=EDGE_MARGIN - half_x)), 'left'],
+            [top.move(types.Point(x=half_x - EDGE_MARGIN)), 'right'],
+            [top.move(types.Point(y=EDGE_MARGIN - half_y)), 'front'],
+            [top.move(types.Point(y=half_y - EDGE_MARGIN)), 'back']
+        ]
+
+        set_speeds(RATE)
+        pipette.move_to(top)
+        protocol.pause(f"Moved to the top of {well_loc}")
+
+        for edge_location, edge_name in all_4_edges:
+            set_speeds(SLOWER_RATE)
+            pipette.move_to(edge_location)
+            protocol.pause(f'Moved to {edge_name} edge')
+
+        set_speeds(RATE)
+        pipette.move_to(well.bottom(BOTTOM_OFFSET))
+        protocol.pause(f"Moved to the bottom of {well_loc}")
+
+        pipette.blow_out(well)
+        protocol.comment(f"{well_loc} checked in {time.monotonic() - well_start:.1f} s")
+
+    protocol.comment(f"Labware checked in {time.monotonic() - start:.1f} s")
+    set_speeds(1.0)
+    pipette.return_tip()
+'''
+
+
+def check_definition(definition):
+    '''
+    List of the problems of a labware definition: wells outside the
+    footprint, deeper than the labware or with a volume that does not fit
+    '''
+    problems = []
+    dimensions = definition['dimensions']
+    for name, well in definition['wells'].items():
+        if well['shape'] == 'circular':
+            half_x = half_y = well['diameter'] / 2
+        else:
+            half_x, half_y = well['xDimension'] / 2, well['yDimension'] / 2
+        if (well['x'] - half_x < 0 or well['x'] + half_x > dimensions['xDimension']
+                or well['y'] - half_y < 0 or well['y'] + half_y > dimensions['yDimension']):
+            problems.append(name + ' is outside the footprint')
+        if well['depth'] <= 0 or well['z'] + well['depth'] > dimensions['zDimension'] + 0.01:
+            problems.append(name + ' is deeper than the labware')
+        if well['totalLiquidVolume'] > WellGeometry(well).max_volume * 1.01:
+            problems.append(name + ' holds more than its %s' % ('cylinder' if well['shape'] == 'circular'
+                                                               else 'prism'))
+    # report each kind of problem once, with the first well that has it
+    seen = {}
+    for problem in problems:
+        seen.setdefault(problem.split(' ', 1)[1], problem)
+    return list(seen.values())
+
+
+def render(definition, pipette='p20_single_gen2', top_offset=0, bottom_offset=1):
+    source = template
+    for key, value in [('$definition', json.dumps(definition, separators=(',', ':'))),
+                       ('$pipette', pipette), ('$tiprack', pipettes[pipette]),
+                       ('$top_offset', repr(top_offset)), ('$bottom_offset', repr(bottom_offset))]:
+        source = source.replace(key, value)
+    return source
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibration protocols for the custom labware definitions')
+    parser.add_argument('load_names', nargs='*', help='labware (all but the tip racks by default)')
+    parser.add_argument('--labware', default=labware_path, help='folder of the definitions')
+    parser.add_argument('--out', default=os.path.join(labware_path, 'calibration'))
+    parser.add_argument('--pipette', default='p20_single_gen2', choices=sorted(pipettes))
+    parser.add_argument('--top-offset', type=float, default=0)
+    parser.add_argument('--bottom-offset', type=float, default=1)
+    parser.add_argument('--simulate', action='store_true', help='simulate every protocol')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    failed = 0
+    for name, versions in sorted(index(args.labware).items()):
+        [filename, definition] = versions[max(versions)]
+        if (args.load_names and name not in args.load_names) or (
+                not args.load_names and definition['parameters'].get('isTiprack')):
+            continue
+        path = os.path.join(args.out, 'test_' + os.path.splitext(filename)[0] + '.py')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(render(definition, args.pipette, args.top_offset, args.bottom_offset))
+        problems = check_definition(definition)
+        result = ''
+        if args.simulate:
+            try:
+                commands = simulate(path)
+                moves = sum(c['text'].startswith('Moving to') for c in commands)
+                seconds = sum(command_cost(c['text'])[1] for c in commands) + moves * move_time
+                result = '%d positions, %.0f s without pauses' % (moves, seconds)
+            except Exception as e:
+                problems.append('simulation failed: %s' % e)
+        failed += bool(problems)
+        print('%-60s %s' % (name, '; '.join(problems) if problems else 'OK ' + result))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
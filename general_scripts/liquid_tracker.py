@@ -0,0 +1,119 @@
+# Follow the liquid of every reservoir column, tube and plate well through a
+# simulated run. Each well starts empty and every aspirate / dispense of the
+# run log is applied to it, so the lowest point a source reaches is the volume
+# it must start with. The report gives, per source, the volume drawn, the
+# minimum fill (that plus the dead volume of the labware) and, when the planned
+# fills are given, the sources that would run dry.
+#
+#   python liquid_tracker.py ../KingFisher_viral/KB_station_viral.py
+#   python liquid_tracker.py script.py --fill fills.json   # {"A1 of NEST 12 Well Reservoir 15 mL on 5": 5400}
+
+import re
+import sys
+import json
+import argparse
+
+from protocol_timing import simulate, volume_re
+
+# volume that can not be aspirated from each kind of labware (µl); the first
+# match in the labware name is used
+dead_volumes = [['reservoir', 600], ['deepwell', 50], ['2400', 50], ['tube', 30], ['screwcap', 30], ['', 10]]
+
+location_re = re.compile(r'labware=(.*)\)$')
+
+
+def well_name(location):
+    '''
+    'A1 of NEST 12 Well Reservoir 15 mL on 5' from the location of a command;
+    locations moved from a well are printed as Location(point=..., labware=...)
+    '''
+    found = location_re.search(location)
+    return found.group(1) if found else location
+
+
+def dead_volume(name):
+    for [key, volume] in dead_volumes:
+        if key in name.lower():
+            return volume
+
+
+def channels_of(payload):
+    instrument = payload.get('instrument')
+    return getattr(instrument, 'channels', 1) if instrument is not None else 1
+
+
+def track(commands):
+    '''
+    Returns {well: {'volume', 'lowest', 'highest', 'drawn', 'max_volume'}};
+    a multichannel command on a single row labware (reservoir) moves all its
+    channels through the one well, otherwise the volumes are per well of the column
+    '''
+    wells = {}
+    for command in commands:
+        found = volume_re.match(command['text'])
+        if not found:
+            continue
+        payload = command.get('payload') or {}
+        name = well_name(found.group(3))
+        volume = float(found.group(2))
+        if 'reservoir' in name.lower():
+            volume *= channels_of(payload)
+        well = wells.setdefault(name, {'volume': 0, 'lowest': 0, 'highest': 0, 'drawn': 0,
+                                       'max_volume': None})
+        location = payload.get('location')
+        labware = getattr(location, 'labware', location)
+        if getattr(labware, 'max_volume', None):
+            well['max_volume'] = labware.max_volume
+        if found.group(1) == 'Aspirating':
+            well['volume'] -= volume
+            well['drawn'] += volume
+        else:
+            well['volume'] += volume
+        well['lowest'] = min(well['lowest'], well['volume'])
+        well['highest'] = max(well['highest'], well['volume'])
+    return wells
+
+
+def report(wells, fills=None):
+    '''
+    Rows [well, drawn, minimum fill, planned fill, problem]; problem is 'DRY'
+    when the planned fill is below the minimum and 'OVERFLOW' when a well would
+    hold more than its maximum volume
+    '''
+    fills = fills or {}
+    rows = []
+    for name, well in sorted(wells.items()):
+        problem = ''
+        minimum = None
+        if well['lowest'] < 0:
+            minimum = -well['lowest'] + dead_volume(name)
+            planned = fills.get(name)
+            if planned is not None and planned < minimum:
+                problem = 'DRY'
+        if well['max_volume'] and well['highest'] + fills.get(name, 0) > well['max_volume']:
+            problem = 'OVERFLOW'
+        if minimum is not None or problem:
+            rows.append([name, well['drawn'], minimum, fills.get(name), problem])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Liquid volumes of every source through a simulated run')
+    parser.add_argument('script')
+    parser.add_argument('--fill', help='json with the planned volume of each source well')
+    args = parser.parse_args()
+
+    fills = {}
+    if args.fill:
+        with open(args.fill) as f:
+            fills = json.load(f)
+    rows = report(track(simulate(args.script)), fills)
+    print('%-60s %10s %12s %12s' % ('source', 'drawn (ul)', 'min fill', 'planned'))
+    for [name, drawn, minimum, planned, problem] in rows:
+        print('%-60s %10.0f %12s %12s  %s' % (name[:60], drawn, '%.0f' % minimum if minimum is not None else '',
+                                              '%.0f' % planned if planned is not None else '', problem))
+    return 1 if any(r[-1] for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# Assembly plan of the master mixes of the station C scripts ('Make MMIX').
+# The step adds every component of MMIX_recipe to the MMIX tube with a fresh
+# p300 tip per component, in chunks of pipette_allowed_capacity. The plan
+# instead:
+#   - adds the components that can not contaminate others (water) first, so
+#     their tip goes on to serve the next component,
+#   - makes the minimum number of trips the tip allows with the air gap,
+#   - splits the mix in several tubes when it does not fit in one, every
+#     trip dispensing from the top into as many tubes as its volume covers, and
+#   - moves with the p20 the components below the p300 minimum volume, when
+#     that is faster.
+# The tips, trips and time (with the cost model of protocol_timing) of the
+# current step and of the plan are reported for every recipe of the script;
+# the plan falls back to the current order of work wherever it would not be
+# faster. When a mix does not fit in one tube, the cost of just splitting the
+# current step is reported on its own line, apart from the savings of the plan.
+#
+#   python mmix_planner.py ../KingFisher_viral/KC_qPCR_singledispense.py [--samples 48] [--clean Seegene:4] [--detail]
+
+import re
+import sys
+import math
+import argparse
+
+from fake_context import load_script, pipette_models
+from protocol_timing import move_time, pick_up_time, drop_tip_time, blow_out_time, touch_tip_time
+
+tube_volume = 2000 # µl of the MMIX screwcap tube
+tip_volume = {'p300_single_gen2': 200, 'p20_single_gen2': 20} # filter tips used in station C
+
+clean_names = ['water'] # components that do not contaminate the others
+
+
+def divide_volume(volume, max_vol):
+    '''
+    Same split as divide_volume in the station scripts
+    '''
+    num_transfers = math.ceil(volume / max_vol)
+    vol_roundup = math.ceil(volume / num_transfers)
+    return [vol_roundup] * (num_transfers - 1) + [volume - vol_roundup * (num_transfers - 1)]
+
+
+def air_gap_of(model, air_gap):
+    '''
+    Air gap of the script, at most a tenth of the tip (2 ul with the p20)
+    '''
+    return min(air_gap, tip_volume[model] / 10)
+
+
+def trip_time(volumes, air_gap, model):
+    '''
+    Seconds of one trip: aspirate, air gap, a dispense per tube in
+    [volumes], blow out and touch tip
+    '''
+    rate = pipette_models[model][3]
+    air_gap = air_gap_of(model, air_gap)
+    return ((2 + len(volumes)) * move_time + (2 * sum(volumes) + 2 * air_gap) / rate
+            + blow_out_time + touch_tip_time)
+
+
+def recipe_components(path):
+    '''
+    Names of the MMIX_components of the script, in MMIX_recipe order: every
+    recipe uses the first len(recipe) of them
+    '''
+    with open(path) as f:
+        source = f.read()
+    found = re.search(r'MMIX_components\s*=\s*\[([^\]]*)\]', source)
+    if not found:
+        return []
+    names = []
+    for variable in found.group(1).split(','):
+        reagent = re.search(variable.strip() + r"\s*=\s*Reagent\(\s*name\s*=\s*'([^']*)'", source)
+        names.append(reagent.group(1) if reagent else variable.strip())
+    return names
+
+
+def tubes_needed(volumes):
+    return math.ceil(sum(volumes) / tube_volume)
+
+
+def fill_tubes(component, model, chunks, tubes, new_tip):
+    '''
+    Trips of the [chunks] of a component shared evenly by [tubes], every trip
+    dispensing into as many tubes as its volume covers. A part below the
+    minimum volume of the pipette is never dispensed: it stays in the tube
+    being filled and the next tube takes that much less (or more), so the
+    tubes differ by less than that minimum
+    '''
+    minimum = pipette_models[model][2]
+    demands = [[tube, sum(chunks) / tubes] for tube in range(tubes)]
+    transfers = []
+    for volume in chunks:
+        dispenses = []
+        while volume > 1e-6 and demands:
+            part = min(volume, demands[0][1])
+            if len(demands) > 1 and 1e-6 < volume - part < minimum:
+                part = volume # the rest of the trip would be a sliver for the next tube
+            dispenses.append([demands[0][0], part])
+            volume -= part
+            demands[0][1] -= part
+            if len(demands) > 1 and demands[0][1] < minimum:
+                demands[1][1] += demands.pop(0)[1] # a sliver (or excess) left goes to the next tube
+            elif demands[0][1] < 1e-6:
+                demands.pop(0)
+        transfers.append([component, model, dispenses, new_tip])
+        new_tip = False
+    return transfers
+
+
+def current_plan(volumes, capacity, air_gap, tubes=1):
+    '''
+    Trips of the 'Make MMIX' step as written: a fresh p300 tip per component
+    in recipe order, in chunks of [capacity]; with [tubes] > 1 the same work
+    is only split between the tubes
+    '''
+    transfers = []
+    for i, volume in enumerate(volumes):
+        chunks = divide_volume(volume, capacity) if volume + air_gap > capacity else [volume]
+        transfers += fill_tubes(i, 'p300_single_gen2', chunks, tubes, True)
+    return transfers
+
+
+def plan(volumes, clean, air_gap, tubes=1, p20=True):
+    '''
+    Ordered list of [component, pipette, [[tube, volume]...], new tip]
+    trips; [clean] are the indexes of the components that do not contaminate
+    others
+    '''
+    order = sorted(range(len(volumes)), key=lambda i: (i not in clean, -volumes[i]))
+    transfers = []
+    tip_clean = {} # pipette: its tip has only touched clean components
+    for i in order:
+        small = volumes[i] / tubes < pipette_models['p300_single_gen2'][2]
+        model = 'p20_single_gen2' if p20 and small else 'p300_single_gen2'
+        new_tip = not tip_clean.get(model, False)
+        tip_clean[model] = i in clean
+        chunks = divide_volume(volumes[i], tip_volume[model] - air_gap_of(model, air_gap))
+        transfers += fill_tubes(i, model, chunks, tubes, new_tip)
+    return transfers
+
+
+def best_plan(volumes, clean, air_gap, capacity):
+    '''
+    Fastest of the plans with and without the p20 and of the current step
+    itself, in as many tubes as the mix needs: never slower than the current
+    step split between those tubes
+    '''
+    tubes = tubes_needed(volumes)
+    candidates = [plan(volumes, clean, air_gap, tubes, p20) for p20 in (True, False)]
+    candidates.append(current_plan(volumes, capacity, air_gap, tubes))
+    return min(candidates, key=lambda transfers: plan_cost(transfers, air_gap)[::-1])
+
+
+def plan_cost(transfers, air_gap):
+    '''
+    [tips, trips, seconds] of a plan
+    '''
+    tips = sum(t[3] for t in transfers)
+    seconds = tips * (pick_up_time + drop_tip_time)
+    seconds += sum(trip_time([v for [tube, v] in dispenses], air_gap, model)
+                   for [i, model, dispenses, new_tip] in transfers)
+    return [tips, len(transfers), seconds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assembly plan of the master mixes of a station C script')
+    parser.add_argument('scripts', nargs='+')
+    parser.add_argument('--samples', type=int, help='NUM_SAMPLES of the script')
+    parser.add_argument('--clean', action='append', default=[],
+                        help='recipe:component (1 based) that does not contaminate others besides the '
+                             'water of the script, e.g. Seegene:4')
+    parser.add_argument('--detail', action='store_true', help='print the plan of the selected recipe')
+    args = parser.parse_args()
+
+    extra_clean = {}
+    for item in args.clean:
+        name, component = item.rsplit(':', 1)
+        extra_clean.setdefault(name, []).append(int(component) - 1)
+    for script in args.scripts:
+        settings = load_script(script, {'NUM_SAMPLES': args.samples} if args.samples else None)
+        print(script + ' (' + str(settings.get('NUM_SAMPLES', '?')) + ' samples)')
+        if 'MMIX_make' not in settings:
+            print('  not supported: the script has no MMIX_make recipes (no \'Make MMIX\' step)')
+            continue
+        air_gap = settings.get('air_gap_vol', 0)
+        # scripts without it move a whole tip less the air gap per trip
+        capacity = settings.get('pipette_allowed_capacity',
+                                tip_volume['p300_single_gen2'] - air_gap_of('p300_single_gen2', air_gap))
+        components = recipe_components(script)
+        print('  %-14s %-22s %9s %9s %15s' % ('recipe', 'strategy', 'tips', 'trips', 'time (s)'))
+        overflows = []
+        for key, volumes in settings['MMIX_make'].items():
+            name = settings['MMIX_available'][key]
+            indexes = [i for i, component in enumerate(components[:len(volumes)])
+                       if any(word in component.lower() for word in clean_names)] + extra_clean.get(name, [])
+            tubes = tubes_needed(volumes)
+            transfers = best_plan(volumes, indexes, air_gap, capacity)
+            mounts = sorted(set(t[1].split('_')[0] for t in transfers))
+            # the savings are against the current step in the tubes the mix needs anyway
+            before = plan_cost(current_plan(volumes, capacity, air_gap, tubes), air_gap)
+            after = plan_cost(transfers, air_gap)
+            print('  %-14s %-22s %4d > %-3d %4d > %-3d %6.0f > %-6.0f %+5.0f s' % (
+                name, str(tubes) + ' tube(s), ' + '+'.join(mounts), before[0], after[0], before[1], after[1],
+                before[2], after[2], after[2] - before[2]))
+            if tubes > 1:
+                overflows.append([name, sum(volumes), tubes, before[2] -
+                                  plan_cost(current_plan(volumes, capacity, air_gap), air_gap)[2]])
+            if args.detail and key == settings['mmix_selection']:
+                for [i, model, dispenses, new_tip] in transfers:
+                    print('      %s component %d  %s: %s' % (
+                        'new tip ' if new_tip else 'same tip', i + 1, model,
+                        ', '.join('%.1f ul to tube %d' % (v, tube + 1) for [tube, v] in dispenses)))
+        for [name, volume, tubes, seconds] in overflows:
+            print('  %s: %.0f ul do not fit in one %d ul tube, splitting the current step in %d tubes costs %+.0f s' % (
+                name, volume, tube_volume, tubes, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
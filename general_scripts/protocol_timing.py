@@ -0,0 +1,125 @@
+# Predicted duration, tips and liquid of every step of a station script.
+# The script is simulated and each command of the run log is costed with a
+# simple model (approach and retract per liquid handling command, volume over
+# flow rate, tip handling and delays). The run log is split in steps by the
+# 'Step N: description' comments that all the station scripts print.
+
+import io
+import os
+import re
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+labware_path = os.path.join(repo_path, 'CWarriors_labware')
+
+# cost model (seconds)
+move_time = 1.5 # approach and retract for every aspirate / dispense
+pick_up_time = 5
+drop_tip_time = 4
+blow_out_time = 1
+touch_tip_time = 2
+module_time = 2 # engage / disengage / set temperature
+
+volume_re = re.compile(r'^(Aspirating|Dispensing) ([\d.]+) uL (?:from|into) (.*) at ([\d.]+) uL/sec')
+delay_re = re.compile(r'^Delaying for (\d+) minutes and ([\d.]+) seconds')
+step_re = re.compile(r'^Step (\d+): (.*)$')
+
+
+def simulate(path, labware_dirs=None, constants=None, offline=False):
+    '''
+    Simulates the station script at [path] and returns its run log as a list
+    of {'text': ..., 'payload': ...}; with opentrons, or with the fake context
+    of fake_context.py when [offline] or opentrons is not installed.
+    [constants] replace module level values of the script such as NUM_SAMPLES
+    '''
+    import fake_context
+    if not offline:
+        try:
+            import opentrons.simulate
+        except ImportError:
+            offline = True
+    if offline:
+        return fake_context.simulate(path, constants, labware_dirs)
+    with open(path) as f:
+        source = fake_context.set_constants(f.read(), constants or {})
+    runlog, _bundle = opentrons.simulate.simulate(
+        io.StringIO(source), file_name=os.path.basename(path),
+        custom_labware_paths=labware_dirs or [labware_path])
+    return [{'text': entry['payload']['text'], 'payload': entry['payload']} for entry in runlog]
+
+
+def command_cost(text):
+    '''
+    Returns [kind, seconds, volume] of a run log command; parent commands
+    such as mix or transfer cost nothing because their children are costed
+    '''
+    found = volume_re.match(text)
+    if found:
+        volume, rate = float(found.group(2)), float(found.group(4))
+        kind = 'aspirate' if found.group(1) == 'Aspirating' else 'dispense'
+        return [kind, move_time + (volume / rate if rate else 0), volume]
+    found = delay_re.match(text)
+    if found:
+        return ['delay', int(found.group(1)) * 60 + float(found.group(2)), 0]
+    if text.startswith('Picking up tip'):
+        return ['pick_up', pick_up_time, 0]
+    if text.startswith('Dropping tip'):
+        # also the child of 'Returning tip', which costs nothing itself
+        return ['drop_tip', drop_tip_time, 0]
+    if text.startswith('Blowing out'):
+        return ['blow_out', blow_out_time, 0]
+    if text.startswith('Touching tip'):
+        return ['touch_tip', touch_tip_time, 0]
+    if text.startswith('Pausing'):
+        return ['pause', 0, 0]
+    if re.match(r'^(Engaging|Disengaging|Setting Temperature|Waiting for Temperature)', text):
+        return ['module', module_time, 0]
+    return ['other', 0, 0]
+
+
+def step_summary(commands):
+    '''
+    Ordered list of {'step', 'description', 'seconds', 'tips', 'volume',
+    'commands'} per step of the run; commands before the first step are step 0.
+    A step starts at its 'Step N: description' comment and ends at its
+    'Step N: description took ...' one; scripts that only print the latter
+    (the C stations) get the commands since the previous step
+    '''
+    def bucket(step, description):
+        return {'step': step, 'description': description, 'seconds': 0, 'tips': 0, 'volume': 0, 'commands': 0}
+
+    def merge(unclaimed):
+        # commands after a step ended and before the next one started
+        if not steps:
+            steps.append(dict(unclaimed, step=0, description='Setup'))
+        else:
+            for key in ('seconds', 'tips', 'volume', 'commands'):
+                steps[-1][key] += unclaimed[key]
+
+    steps = []
+    current = bucket(None, None)
+    for command in commands:
+        text = command['text']
+        found = step_re.match(text)
+        if found:
+            number = int(found.group(1))
+            if ' took ' not in text:
+                if current['step'] != number:
+                    if current['step'] is None:
+                        merge(current)
+                    current = bucket(number, found.group(2))
+                    steps.append(current)
+                continue
+            if current['step'] is None:
+                current.update(step=number, description=found.group(2).rsplit(' took ', 1)[0])
+                steps.append(current)
+            current = bucket(None, None)
+            continue
+        [kind, seconds, volume] = command_cost(text)
+        current['seconds'] += seconds
+        current['commands'] += kind != 'other'
+        current['tips'] += kind == 'pick_up'
+        if kind == 'aspirate':
+            current['volume'] += volume
+    if current['step'] is None:
+        merge(current)
+    return [s for s in steps if s['step'] != 0 or s['commands']]
@@ -0,0 +1,125 @@
+# Aspiration heights and remaining volumes of every reagent / labware case for
+# every number of samples (1 to 96), computed in one vectorized pass with the
+# same rules as calc_height in the station scripts: a tube or reservoir column
+# is changed when it holds less than the next transfer plus extra_volume, and
+# the height is (remaining volume - cone volume) / cross section (minus the cone
+# height in form 2), never below min_height. The height of the same volume in
+# the labware geometry (labware_geometry.py) is saved next to it.
+#
+# The result is saved as a compressed npz file and plotted for 96 samples,
+# replacing simulate_volume_height*.py and plot_simulation*.R.
+#
+#   python sweep_volume_height.py [--out sweep.npz] [--plots .]
+
+import sys
+import math
+import argparse
+import numpy as np
+
+from labware_geometry import geometry
+
+total_NUM_SAMPLES = 96
+
+area_screwcap = (math.pi * 8.25**2) / 4 # Diameter of the screwcap 8.25 mm
+multi_well_rack_area = 8.2 * 71.2 # Cross section of the 12 well reservoir
+
+# name: transfer volume (per transfer), transfers per column (multichannel) or
+# per sample, cross section, cone volume, subtract cone height (form 2),
+# well capacity, overfill factor, extra volume per well, min_height, extra_volume
+# and the labware of the tube or reservoir
+cases = {
+    'mmix_screwcap': dict(volume=20, per_column=False, area=area_screwcap, v_cone=50, form2=False,
+                          capacity=2000, overfill=1.1, extra_fill=50, min_height=0.5, extra_volume=50,
+                          labware='opentrons_24_aluminumblock_generic_2ml_screwcap'),
+    'mmix_screwcap_form2': dict(volume=20, per_column=False, area=area_screwcap, v_cone=50, form2=True,
+                                capacity=2000, overfill=1.1, extra_fill=50, min_height=0.5, extra_volume=50,
+                                labware='opentrons_24_aluminumblock_generic_2ml_screwcap'),
+    'beads_reservoir': dict(volume=20 * 8, per_column=True, area=multi_well_rack_area, v_cone=695, form2=False,
+                            capacity=13300, overfill=1.1, extra_fill=600, min_height=0.3, extra_volume=10,
+                            labware='nest_12_reservoir_15ml'),
+    'lysis_reservoir': dict(volume=260 * 8, per_column=True, area=multi_well_rack_area, v_cone=695, form2=False,
+                            capacity=13300, overfill=1.1, extra_fill=600, min_height=0.2, extra_volume=50,
+                            labware='nest_12_reservoir_15ml'),
+}
+
+plot_names = {'mmix_screwcap': 'simulated_screwcap_volume_heights.png',
+              'mmix_screwcap_form2': 'simulated_screwcap_volume_heights_form2.png'}
+
+
+def sweep(case, max_samples=total_NUM_SAMPLES):
+    '''
+    Arrays of shape (samples, transfers): height, height in the labware
+    geometry, remaining volume in the tube used and tube number, plus the
+    mask of transfers that happen
+    '''
+    n = np.arange(1, max_samples + 1, dtype=float)[:, None]
+    transfers = np.ceil(n / 8) if case['per_column'] else n
+    i = np.arange(max_samples)[None, :]
+    valid = i < transfers
+    v = case['volume']
+    total = transfers * v * case['overfill']
+    first_wells = np.ceil(total / case['capacity'])
+    total = total + case['extra_fill'] * first_wells
+    wells = np.ceil(total / case['capacity'])
+    W = total / wells # volume in each tube at the start
+    per_well = 1 + np.maximum(0, np.floor((W - v - case['extra_volume']) / v))
+    offset = (W < v + case['extra_volume']).astype(int) # first tube skipped when already too low
+    tube = offset + i // per_well
+    remaining = W - (i % per_well + 1) * v
+    height = (remaining - case['v_cone']) / case['area']
+    if case['form2']:
+        height = height - case['v_cone'] * 3 / case['area']
+    height = np.maximum(height, case['min_height'])
+    geometry_height = np.maximum(np.vectorize(geometry(case['labware']).height)(remaining), case['min_height'])
+    return {'height': np.where(valid, height, np.nan), 'geometry_height': np.where(valid, geometry_height, np.nan),
+            'remaining': np.where(valid, remaining, np.nan),
+            'tube': np.where(valid, tube + 1, 0).astype(np.int16), 'valid': valid}
+
+
+def plot(name, result, path, samples=total_NUM_SAMPLES):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    row = samples - 1
+    valid = result['valid'][row]
+    x = np.arange(1, valid.sum() + 1)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.bar(x, result['remaining'][row][valid], color='#66c2a5')
+    ax.axhline(50, linestyle=':', color='red')
+    ax.set_xlabel('Sample number')
+    ax.set_ylabel('Remaining volume in µl')
+    twin = ax.twinx()
+    twin.bar(x, result['height'][row][valid], color='#fc8d62', width=0.4)
+    twin.set_ylabel('Pickup Height in mm')
+    for tube in np.unique(result['tube'][row][valid]):
+        centre = x[result['tube'][row][valid] == tube].mean()
+        ax.annotate('Tube ' + str(tube), (centre, ax.get_ylim()[1] * 0.95), ha='center')
+    ax.set_title(name + ' (' + str(samples) + ' samples)')
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vectorized sweep of aspiration heights')
+    parser.add_argument('--out', default='sweep_volume_height.npz')
+    parser.add_argument('--plots', help='folder for the png plots of 96 samples')
+    args = parser.parse_args()
+
+    results = {name: sweep(case) for name, case in cases.items()}
+    arrays = {}
+    for name, result in results.items():
+        for key in ('height', 'geometry_height', 'remaining', 'tube'):
+            arrays[name + '.' + key] = result[key].astype(np.float32) if key != 'tube' else result[key]
+        at_min = np.nansum(result['height'] <= cases[name]['min_height'], axis=1)
+        print('%-22s min remaining %7.0f ul, transfers at min_height (96 samples): %d, max tubes: %d, '
+              'max difference with the geometry: %.2f mm' % (
+                  name, np.nanmin(result['remaining']), at_min[-1], result['tube'].max(),
+                  np.nanmax(np.abs(result['height'] - result['geometry_height']))))
+        if args.plots:
+            plot(name, result, args.plots + '/' + plot_names.get(name, 'simulated_' + name + '.png'))
+    np.savez_compressed(args.out, **arrays)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
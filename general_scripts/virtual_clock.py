@@ -0,0 +1,194 @@
+# Simulation of a station script with a virtual clock. Every command of the
+# run log advances the clock with a motion and flow rate model (travel between
+# locations at gantry speed, volume over flow rate, delays, temperature ramps)
+# and the run is drawn as a Gantt timeline (svg) with one lane for the steps,
+# one per pipette and one per module. The longest idle blocks are listed, as
+# they are the first places to look for time savings.
+#
+#   python virtual_clock.py ../KingFisher_viral/KB_station_viral.py --out KB.svg
+
+import sys
+import math
+import argparse
+
+from protocol_timing import simulate, command_cost, step_re, move_time
+
+# motion model
+xy_speed = 400 # mm/s
+z_speed = 125 # mm/s
+clearance = 20 # mm travelled above the highest of two points between wells
+temperature_rate = 0.1 # ºC/s of the temperature module
+room_temperature = 25
+pause_time = 60 # s assumed for an operator to answer a pause
+
+lane_colors = {'aspirate': '#4c72b0', 'dispense': '#55a868', 'pick_up': '#8172b2',
+               'drop_tip': '#8172b2', 'blow_out': '#64b5cd', 'touch_tip': '#64b5cd',
+               'move': '#cccccc', 'delay': '#c44e52', 'pause': '#dd8452', 'module': '#937860',
+               'engaged': '#937860', 'ramp': '#da8bc3', 'step': '#e5e5e5'}
+
+
+def point_of(location):
+    '''
+    (x, y, z) of a Location, Well or Point of the run log, None if unknown
+    '''
+    if location is None:
+        return None
+    if hasattr(location, 'point'):
+        location = location.point
+    elif hasattr(location, 'top'):
+        location = location.top().point
+    if hasattr(location, 'x'):
+        return (location.x, location.y, location.z)
+    return None
+
+
+def travel_time(a, b):
+    if a is None or b is None:
+        return None
+    xy = math.hypot(b[0] - a[0], b[1] - a[1])
+    if xy < 0.5: # same well, only up or down
+        return abs(b[2] - a[2]) / z_speed
+    top = max(a[2], b[2]) + clearance
+    return xy / xy_speed + ((top - a[2]) + (top - b[2])) / z_speed
+
+
+def pipette_name(instrument):
+    if instrument is None:
+        return 'Pipette'
+    return str(getattr(instrument, 'name', instrument)) + ' ' + str(getattr(instrument, 'mount', ''))
+
+
+def timeline(commands):
+    '''
+    Returns (blocks, steps): blocks are [lane, kind, start, end, label] and
+    steps are [step, description, start, end] in virtual seconds
+    '''
+    clock = 0
+    blocks = []
+    steps = []
+    open_step = False
+    position = {}
+    magnet_on = None
+    temperature = {'now': room_temperature, 'target': room_temperature, 'since': 0}
+
+    def temperature_at(t):
+        change = temperature_rate * (t - temperature['since'])
+        if temperature['target'] < temperature['now']:
+            return max(temperature['target'], temperature['now'] - change)
+        return min(temperature['target'], temperature['now'] + change)
+
+    for command in commands:
+        text, payload = command['text'], command.get('payload') or {}
+        found = step_re.match(text)
+        if found:
+            # a step starts at its 'Step N: ...' comment and ends at its '... took ...'
+            # one; the C stations only print the latter, so their steps start
+            # where the previous one ended
+            number = int(found.group(1))
+            if ' took ' not in text:
+                if not (open_step and steps[-1][0] == number):
+                    if open_step:
+                        steps[-1][3] = clock
+                    steps.append([number, found.group(2), clock, clock])
+                    open_step = True
+            elif open_step:
+                steps[-1][3] = clock
+                open_step = False
+            else:
+                steps.append([number, found.group(2).rsplit(' took ', 1)[0], steps[-1][3] if steps else 0, clock])
+            continue
+        [kind, seconds, volume] = command_cost(text)
+        if kind == 'other':
+            continue
+        if kind in ('aspirate', 'dispense', 'pick_up', 'drop_tip', 'blow_out', 'touch_tip'):
+            lane = pipette_name(payload.get('instrument'))
+            target = point_of(payload.get('location'))
+            move = travel_time(position.get(lane), target)
+            if move is not None:
+                blocks.append([lane, 'move', clock, clock + move, ''])
+                clock += move
+                seconds = seconds - (move_time if kind in ('aspirate', 'dispense') else 0)
+            if target is not None:
+                position[lane] = target
+            blocks.append([lane, kind, clock, clock + seconds, text])
+            clock += seconds
+        elif kind == 'delay':
+            blocks.append(['Robot', 'delay', clock, clock + seconds, text])
+            clock += seconds
+        elif kind == 'pause':
+            blocks.append(['Robot', 'pause', clock, clock + pause_time, text])
+            clock += pause_time
+        elif text.startswith('Engaging'):
+            magnet_on = clock
+        elif text.startswith('Disengaging'):
+            if magnet_on is not None:
+                blocks.append(['Magnet', 'engaged', magnet_on, clock, 'engaged'])
+            magnet_on = None
+        elif text.startswith('Waiting for Temperature'):
+            remaining = abs(temperature_at(clock) - temperature['target']) / temperature_rate
+            blocks.append(['Robot', 'delay', clock, clock + remaining, text])
+            clock += remaining
+        else:
+            words = [w for w in text.replace('°', ' ').split() if w.replace('.', '', 1).isdigit()]
+            if words:
+                temperature.update({'now': temperature_at(clock), 'target': float(words[0]), 'since': clock})
+                ramp = abs(temperature['now'] - temperature['target']) / temperature_rate
+                blocks.append(['Temperature', 'ramp', clock, clock + ramp, text])
+    if magnet_on is not None:
+        blocks.append(['Magnet', 'engaged', magnet_on, clock, 'engaged'])
+    if open_step:
+        steps[-1][3] = clock
+    return blocks, steps
+
+
+def idle_blocks(blocks, top=10):
+    return sorted([b for b in blocks if b[1] in ('delay', 'pause')], key=lambda b: b[2] - b[3])[:top]
+
+
+def svg(blocks, steps, width=1600, lane_height=28):
+    end = max([b[3] for b in blocks] + [s[3] for s in steps] + [1])
+    lanes = ['Steps'] + sorted(set(b[0] for b in blocks) - {'Robot'}) + ['Robot']
+    scale = (width - 200) / end
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="11">'
+           % (width, lane_height * (len(lanes) + 1))]
+
+    def rect(lane, kind, start, stop, label):
+        y = lanes.index(lane) * lane_height + 4
+        out.append('<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s"><title>%s (%.0f s)</title></rect>'
+                   % (200 + start * scale, y, max((stop - start) * scale, 0.5), lane_height - 8,
+                      lane_colors.get(kind, '#999999'), label.replace('&', '&amp;').replace('<', '&lt;'), stop - start))
+    for i, lane in enumerate(lanes):
+        out.append('<text x="4" y="%d">%s</text>' % (i * lane_height + 18, lane))
+    for [step, description, start, stop] in steps:
+        rect('Steps', 'step', start, stop, 'Step ' + str(step) + ': ' + description)
+        out.append('<line x1="%.1f" x2="%.1f" y1="0" y2="%d" stroke="#bbbbbb"/>'
+                   % (200 + start * scale, 200 + start * scale, lane_height * len(lanes)))
+    for block in blocks:
+        rect(*block)
+    for minute in range(0, int(end / 60) + 1, 10):
+        out.append('<text x="%.1f" y="%d">%d min</text>' % (200 + minute * 60 * scale, lane_height * len(lanes) + 16, minute))
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual clock simulation of a station script')
+    parser.add_argument('script')
+    parser.add_argument('--out', help='svg file for the Gantt timeline')
+    args = parser.parse_args()
+
+    blocks, steps = timeline(simulate(args.script))
+    for [step, description, start, stop] in steps:
+        print('%3d  %-60s %8.0f s  (at %5.1f min)' % (step, description[:60], stop - start, start / 60))
+    print('Total: %.1f min' % (max([b[3] for b in blocks] + [0]) / 60))
+    print('Longest idle blocks:')
+    for [lane, kind, start, stop, label] in idle_blocks(blocks):
+        print('  %6.0f s at %5.1f min  %s' % (stop - start, start / 60, label))
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(svg(blocks, steps))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())